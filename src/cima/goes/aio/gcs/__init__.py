@@ -1,3 +1,12 @@
 from google.cloud.storage import Blob
 from netCDF4 import Dataset
-from .gcs import download_datasets, get_blobs, get_blob, get_blob_dataset, save_blob
\ No newline at end of file
+from .gcs import download_datasets, get_blobs, get_blob, get_bucket, get_blob_dataset, save_blob
+from .ranges import RangeFile, RangedRead, VariableWindow, get_variable_window
+from .cache import BlobCache, CacheStats, set_blob_cache, get_blob_cache
+from .concurrency import AdaptiveLimiter, SharedConcurrency, ByteBudget, share_concurrency, get_shared_concurrency
+from .retry import RetryPolicy, DEFAULT_RETRY, NO_RETRY, is_retryable
+from .listing import BlobInfo, list_blobs, list_prefix, list_prefixes, date_range
+from .manifest import Manifest
+from .sessions import SessionConfig, get_session, close_sessions
+from .hedging import HedgePolicy
+from .sources import Mirror, SourceSelector, PUBLIC_MIRRORS
\ No newline at end of file
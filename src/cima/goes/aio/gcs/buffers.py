@@ -0,0 +1,99 @@
+import io
+from dataclasses import dataclass
+
+import aiohttp
+
+
+class BufferWriter(io.RawIOBase):
+    """Writable file object over a preallocated buffer, so a blob download
+    lands directly in the memory later handed to netCDF4."""
+    def __init__(self, buffer: bytearray):
+        super().__init__()
+        self.buffer = buffer
+        self._view = memoryview(buffer)
+        self._position = 0
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        return self._position
+
+    def truncate(self, size=None):
+        self.size = self._position if size is None else size
+        return self.size
+
+    def write(self, data) -> int:
+        count = len(data)
+        end = self._position + count
+        if end > len(self._view):
+            raise IOError(f'Received more than the expected {len(self._view)} bytes')
+        self._view[self._position:end] = data
+        self._position = end
+        self.size = max(self.size, end)
+        return count
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+@dataclass
+class PartialDownload:
+    buffer: bytearray = None
+    length: int = None
+    received: int = 0
+    etag: str = None
+    # bytes taken from a ByteBudget for this download
+    reserved: int = 0
+
+
+def _content_range_start(resp: aiohttp.ClientResponse) -> int:
+    # Content-Range: bytes <start>-<end>/<total>
+    return int(resp.headers['Content-Range'].split()[1].split('-')[0])
+
+
+async def read_response_into_buffer(resp: aiohttp.ClientResponse,
+                                    size: int = None,
+                                    partial: PartialDownload = None) -> bytearray:
+    if partial is None:
+        partial = PartialDownload()
+    if resp.status == 206 and partial.buffer is not None:
+        if _content_range_start(resp) != partial.received:
+            raise aiohttp.ClientPayloadError(f'Resumed at byte {_content_range_start(resp)}, expected {partial.received}')
+    else:
+        partial.length = resp.content_length if resp.content_length is not None else size
+        partial.buffer = bytearray() if partial.length is None else bytearray(partial.length)
+        partial.received = 0
+        partial.etag = resp.headers.get('ETag')
+
+    view = None if partial.length is None else memoryview(partial.buffer)
+    try:
+        async for chunk in resp.content.iter_any():
+            if view is None:
+                partial.buffer += chunk
+            else:
+                end = partial.received + len(chunk)
+                if end > partial.length:
+                    raise aiohttp.ClientPayloadError(f'Received more than the expected {partial.length} bytes')
+                view[partial.received:end] = chunk
+            partial.received += len(chunk)
+    finally:
+        if view is not None:
+            view.release()
+    if partial.length is not None and partial.received != partial.length:
+        raise aiohttp.ClientPayloadError(f'Received {partial.received} of {partial.length} bytes')
+    return partial.buffer
@@ -0,0 +1,172 @@
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import Union
+
+import netCDF4
+
+
+DEFAULT_CACHE_MAX_BYTES = 50 * 1024 ** 3
+# The directory is scanned again after this fraction of max_bytes is written by a process,
+# to count what the other processes wrote, or as soon as the size passes max_bytes
+RESCAN_FRACTION = 0.1
+LEASES_DIRECTORY = 'leases'
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+
+
+class BlobCache(object):
+    """Content cache of downloaded blobs on local disk.
+
+    Entries are keyed by blob name plus generation (or etag) and evicted
+    least recently used first once the directory exceeds max_bytes. Files are
+    written to a temporary name and renamed, so several processes can share
+    the same directory. Without a generation nothing is cached or served, an
+    object rewritten in the bucket would be served stale. A hit is a hard link
+    to the entry (a lease), that stays readable if the entry is evicted before
+    it is opened, the caller removes it with release."""
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        # Used from executor threads
+        self._lock = threading.Lock()
+        # The size at the last scan plus what this process wrote since, None before the first scan
+        self._size = None
+        self._written_since_scan = 0
+        os.makedirs(os.path.join(directory, LEASES_DIRECTORY), exist_ok=True)
+
+    def _name_path(self, name: str) -> str:
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def path(self, name: str, generation: Union[int, str]) -> str:
+        generation = str(generation).strip('"')
+        return f'{self._name_path(name)}.{generation}.nc'
+
+    def get(self, name: str, generation: Union[None, int, str]) -> Union[None, str]:
+        # The path of a lease of the entry, None on a miss
+        if generation is None:
+            self._count(misses=1)
+            return None
+        path = self.path(name, generation)
+        lease = os.path.join(self.directory, LEASES_DIRECTORY, f'{uuid.uuid4().hex}.lease')
+        try:
+            os.link(path, lease)
+            # mtime is the LRU clock
+            os.utime(path)
+        except FileNotFoundError:
+            self._count(misses=1)
+            return None
+        self._count(hits=1, bytes_read=os.path.getsize(lease))
+        return lease
+
+    @staticmethod
+    def release(lease: str):
+        try:
+            os.remove(lease)
+        except FileNotFoundError:
+            pass
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, increment in increments.items():
+                setattr(self.stats, name, getattr(self.stats, name) + increment)
+
+    def put(self, name: str, data, generation: Union[None, int, str]) -> Union[None, str]:
+        if generation is None:
+            return None
+        path = self.path(name, generation)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._count(bytes_written=len(data))
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+                self._written_since_scan += len(data)
+            scan = self._size is None or self._size > self.max_bytes or \
+                self._written_since_scan > self.max_bytes * RESCAN_FRACTION
+        if scan:
+            self.evict()
+        return path
+
+    def open_dataset(self, name: str, generation: Union[None, int, str]) -> Union[None, netCDF4.Dataset]:
+        lease = self.get(name, generation)
+        if lease is None:
+            return None
+        try:
+            return netCDF4.Dataset(lease, mode='r')
+        finally:
+            # The open file stays readable
+            self.release(lease)
+
+    def size(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        entries = []
+        for path in glob.glob(os.path.join(glob.escape(self.directory), '*', '*.nc')):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def evict(self):
+        # Scans the whole directory, put calls it only when the size may be over max_bytes
+        entries = self._entries()
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._count(evictions=1)
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._lock:
+            self._size = total
+            self._written_since_scan = 0
+
+    def clear(self):
+        for _, path, _ in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._size = 0
+            self._written_since_scan = 0
+
+
+_blob_cache: Union[None, BlobCache] = None
+
+
+def set_blob_cache(cache: Union[None, BlobCache]):
+    global _blob_cache
+    _blob_cache = cache
+
+
+def get_blob_cache() -> Union[None, BlobCache]:
+    return _blob_cache
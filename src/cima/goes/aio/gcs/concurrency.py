@@ -0,0 +1,266 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass
+from typing import Union
+
+from .retry import is_retryable
+
+
+# Seconds between checks for dead processes of a process waiting for the shared limit
+RECONCILE_INTERVAL = 1.0
+
+
+@dataclass
+class Permit:
+    started: float
+    bytes: int = 0
+    # A download of a whole object, the only requests whose latency and throughput are
+    # learned: HEAD requests and Range reads are much shorter and slower per byte
+    full_transfer: bool = False
+
+
+class SharedConcurrency(object):
+    """Connection budget shared by all the worker processes of a Store.process
+    round. Create it in the parent and install it in the workers with
+    Store.process(..., initializer=share_concurrency, initargs=(shared,)).
+
+    The requests in flight are also counted by process, under the lock of
+    in_flight, so the ones of a process that died holding them are given back
+    when the limit is reached."""
+    def __init__(self, initial_limit: float, min_limit: float, max_limit: float, max_processes: int = 256):
+        context = multiprocessing.get_context('spawn')
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = context.Value('d', initial_limit)
+        self.in_flight = context.Value('i', 0)
+        self.last_decrease = context.Value('d', 0.0)
+        self.pids = context.Array('q', max_processes, lock=False)
+        self.process_in_flight = context.Array('i', max_processes, lock=False)
+        self._slot = None
+        self._last_reconcile = 0.0
+
+    def __getstate__(self):
+        # The slot is claimed by each process
+        state = self.__dict__.copy()
+        state['_slot'] = None
+        return state
+
+    def start(self) -> bool:
+        with self.in_flight.get_lock():
+            if self.in_flight.value >= max(int(self.limit.value), 1):
+                now = time.monotonic()
+                if now - self._last_reconcile < RECONCILE_INTERVAL:
+                    return False
+                self._last_reconcile = now
+                self._reconcile()
+                if self.in_flight.value >= max(int(self.limit.value), 1):
+                    return False
+            self.in_flight.value += 1
+            self.process_in_flight[self._get_slot()] += 1
+            return True
+
+    def finish(self):
+        with self.in_flight.get_lock():
+            self.in_flight.value -= 1
+            self.process_in_flight[self._get_slot()] -= 1
+
+    def _get_slot(self) -> int:
+        # Under the lock. A slot left by an earlier process with the same pid is reset.
+        if self._slot is None:
+            pid = os.getpid()
+            free = None
+            for slot, slot_pid in enumerate(self.pids):
+                if slot_pid == pid:
+                    self._release_slot(slot)
+                if free is None and self.pids[slot] == 0:
+                    free = slot
+            if free is None:
+                self._reconcile()
+                free = next((slot for slot, slot_pid in enumerate(self.pids) if slot_pid == 0), None)
+                if free is None:
+                    raise RuntimeError(f'More than {len(self.pids)} processes share the concurrency limit')
+            self.pids[free] = pid
+            self._slot = free
+        return self._slot
+
+    def _reconcile(self):
+        # Under the lock. Gives back the requests of the processes that are gone.
+        for slot, pid in enumerate(self.pids):
+            if pid != 0 and not _process_alive(pid):
+                self._release_slot(slot)
+
+    def _release_slot(self, slot: int):
+        self.in_flight.value -= self.process_in_flight[slot]
+        self.process_in_flight[slot] = 0
+        self.pids[slot] = 0
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        # A zombie is gone too, waiting for its parent to reap it
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+
+_shared_concurrency: Union[None, SharedConcurrency] = None
+
+
+def share_concurrency(shared: SharedConcurrency):
+    global _shared_concurrency
+    _shared_concurrency = shared
+
+
+def get_shared_concurrency() -> Union[None, SharedConcurrency]:
+    return _shared_concurrency
+
+
+class AdaptiveLimiter(object):
+    """AIMD concurrency limit, usable in place of an asyncio.Semaphore.
+
+    Every request that finishes without congestion adds increase/limit to the
+    limit (about +increase per round trip), timeouts, connection errors and
+    429/5xx responses multiply it by decrease_factor, at most once per
+    observed latency. A download of a whole object whose throughput falls
+    below best_throughput / latency_tolerance also counts as congestion,
+    only those downloads are used for the latency and the throughput. With
+    shared, the limit and the in flight count are global to all processes."""
+    def __init__(self,
+                 initial_limit: float = 10,
+                 min_limit: float = 1,
+                 max_limit: float = 64,
+                 increase: float = 1.0,
+                 decrease_factor: float = 0.5,
+                 latency_tolerance: float = 3.0,
+                 shared: SharedConcurrency = None,
+                 poll_interval: float = 0.1):
+        self.min_limit = shared.min_limit if shared else min_limit
+        self.max_limit = shared.max_limit if shared else max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.shared = shared
+        self.poll_interval = poll_interval
+        self._limit = float(initial_limit)
+        self._last_decrease = 0.0
+        self.in_flight = 0
+        self.completed = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency = None
+        self.best_throughput = 0.0
+        self._condition = asyncio.Condition()
+        self._permits = {}
+
+    @property
+    def limit(self) -> float:
+        return self.shared.limit.value if self.shared else self._limit
+
+    def _try_start(self) -> bool:
+        if self.shared is None:
+            if self.in_flight >= max(int(self._limit), 1):
+                return False
+        elif not self.shared.start():
+            return False
+        self.in_flight += 1
+        return True
+
+    def _finish(self):
+        self.in_flight -= 1
+        if self.shared is not None:
+            self.shared.finish()
+
+    def _set_limit(self, update):
+        if self.shared is None:
+            self._limit = min(max(update(self._limit), self.min_limit), self.max_limit)
+        else:
+            with self.shared.limit.get_lock():
+                self.shared.limit.value = min(max(update(self.shared.limit.value), self.min_limit), self.max_limit)
+
+    def _decrease(self, now: float):
+        last_decrease = self.shared.last_decrease if self.shared else None
+        if last_decrease is not None:
+            with last_decrease.get_lock():
+                if now - last_decrease.value < (self.latency or 0):
+                    return
+                last_decrease.value = now
+        else:
+            if now - self._last_decrease < (self.latency or 0):
+                return
+            self._last_decrease = now
+        self._set_limit(lambda limit: limit * self.decrease_factor)
+
+    def observe(self, permit: Permit, error: BaseException = None):
+        now = time.monotonic()
+        elapsed = max(now - permit.started, 1e-6)
+        self.completed += 1
+        self.bytes += permit.bytes
+        if error is not None:
+            # The errors worth a retry are the ones that signal congestion
+            if is_retryable(error):
+                self.errors += 1
+                self._decrease(now)
+            return
+        if not permit.full_transfer:
+            self._set_limit(lambda limit: limit + self.increase / limit)
+            return
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        if permit.bytes:
+            throughput = permit.bytes / elapsed
+            self.best_throughput = max(throughput, self.best_throughput * 0.99)
+            if throughput * self.latency_tolerance < self.best_throughput:
+                self._decrease(now)
+                return
+        self._set_limit(lambda limit: limit + self.increase / limit)
+
+    async def acquire(self) -> Permit:
+        async with self._condition:
+            while not self._try_start():
+                try:
+                    await asyncio.wait_for(self._condition.wait(), self.poll_interval if self.shared else None)
+                except asyncio.TimeoutError:
+                    pass
+        return Permit(started=time.monotonic())
+
+    async def release(self, permit: Permit, error: BaseException = None):
+        self._finish()
+        if not isinstance(error, asyncio.CancelledError):
+            self.observe(permit, error)
+        async with self._condition:
+            self._condition.notify_all()
+
+    async def __aenter__(self) -> Permit:
+        permit = await self.acquire()
+        self._permits[asyncio.current_task()] = permit
+        return permit
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release(self._permits.pop(asyncio.current_task()), exc)
+
+
+class ByteBudget(object):
+    """Cap on the bytes of downloaded objects held in memory at once. An object
+    larger than the whole budget is let through when nothing else is held."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size: int):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.used == 0 or self.used + size <= self.max_bytes)
+            self.used += size
+
+    async def release(self, size: int):
+        async with self._condition:
+            self.used -= size
+            self._condition.notify_all()
@@ -1,85 +1,433 @@
 import asyncio
+import concurrent.futures
 import datetime
-import io
+import functools
+import itertools
+import time
+from dataclasses import dataclass
 
 import netCDF4
 import aiohttp
-from typing import List, Callable, Awaitable
+from typing import List, Callable, Awaitable, Union, Any, Iterable, AsyncIterable, AsyncIterator
 from google.auth.credentials import AnonymousCredentials
 from google.cloud import storage
 from google.cloud.storage import Blob
-from cima.goes.products import GOES_PUBLIC_BUCKET, path_prefix, file_regex_pattern, ANY_MODE
+from cima.goes.products import GOES_PUBLIC_BUCKET, path_prefix, file_regex_pattern, ANY_MODE, get_public_url
 from cima.goes.products import ProductBand
+from .buffers import BufferWriter, PartialDownload, read_response_into_buffer
+from .cache import BlobCache, get_blob_cache
+from .concurrency import AdaptiveLimiter, ByteBudget, get_shared_concurrency
+from .hedging import HedgePolicy
+from .ranges import RangedRead, VariableWindow, get_variable_window
+from .retry import RetryPolicy, with_retry
+from .sessions import get_session
+from .sources import SourceSelector, is_missing
 
 
 MAX_CONCURRENT = 10
+MAX_PROCESSING = 2
+MAX_IN_FLIGHT = 64
 
 
 async def download(url: str,
                    session: aiohttp.ClientSession=None,
-                   semaphore: asyncio.Semaphore=None,
-                   proxy: str=None) -> bytes:
-    async with semaphore:
-        async with session.get(url, proxy=proxy) as resp:
-            return await resp.read()
+                   semaphore: Union[asyncio.Semaphore, AdaptiveLimiter]=None,
+                   proxy: str=None,
+                   size: int=None,
+                   headers: dict=None,
+                   retry: RetryPolicy=None,
+                   budget: ByteBudget=None,
+                   hedging: HedgePolicy=None,
+                   transfer_started: asyncio.Event=None) -> bytearray:
+    # With budget, the returned buffer holds len(buffer) bytes of it, the caller releases them.
+    # transfer_started is set once the permit and the budget are held and the body is read.
+    if hedging is not None:
+        # Every attempt downloads into its own buffer, the losing ones release their budget.
+        # The hedge delay counts from the start of the transfer of the first attempt.
+        transfer_started = asyncio.Event()
+        attempts = itertools.count()
+        return await hedging.run(
+            lambda: download(url, session, semaphore, proxy, size, headers, retry, budget,
+                             transfer_started=transfer_started if next(attempts) == 0 else None),
+            discard=None if budget is None else lambda buffer: budget.release(len(buffer)),
+            transfer_started=transfer_started)
+    partial = PartialDownload()
+    try:
+        buffer = await with_retry(
+            lambda: _download_attempt(url, session, semaphore, proxy, size, headers, partial, budget,
+                                      transfer_started), retry)
+        if budget is not None and partial.reserved != len(buffer):
+            if len(buffer) > partial.reserved:
+                await budget.acquire(len(buffer) - partial.reserved)
+            else:
+                await budget.release(partial.reserved - len(buffer))
+            partial.reserved = len(buffer)
+    except BaseException:
+        if budget is not None and partial.reserved:
+            await budget.release(partial.reserved)
+        raise
+    return buffer
 
 
-def get_blob_dataset(blob: Blob) -> netCDF4.Dataset:
-    in_memory_file = io.BytesIO()
-    blob.download_to_file(in_memory_file)
-    in_memory_file.seek(0)
-    bytes = in_memory_file.read()
-    return netCDF4.Dataset("in_memory_file", mode='r', memory=bytes)
+async def _download_attempt(url: str,
+                            session: aiohttp.ClientSession,
+                            semaphore: Union[asyncio.Semaphore, AdaptiveLimiter],
+                            proxy: str,
+                            size: int,
+                            headers: dict,
+                            partial: PartialDownload,
+                            budget: ByteBudget=None,
+                            transfer_started: asyncio.Event=None) -> bytearray:
+    request_headers = {}
+    if partial.received:
+        # Resume from the last received byte, If-Range makes the server send it all again if the object changed
+        request_headers['Range'] = f'bytes={partial.received}-'
+        if partial.etag:
+            request_headers['If-Range'] = partial.etag
+    async with semaphore as permit:
+        async with session.get(url, proxy=proxy, headers=request_headers) as resp:
+            resp.raise_for_status()
+            if headers is not None:
+                headers.update(resp.headers)
+            start = partial.received if resp.status == 206 else 0
+            length = resp.content_length if resp.content_length is not None else size
+            if budget is not None and length is not None and partial.reserved < start + length:
+                # Waiting here stops reading from the network until processing frees memory
+                await budget.acquire(start + length - partial.reserved)
+                partial.reserved = start + length
+                if permit is not None:
+                    permit.started = time.monotonic()
+            if transfer_started is not None:
+                transfer_started.set()
+            buffer = await read_response_into_buffer(resp, size, partial)
+            if permit is not None:
+                permit.bytes = partial.received - start
+                permit.full_transfer = start == 0
+            return buffer
+
+
+async def download_from_sources(name: str,
+                                sources: SourceSelector,
+                                session: aiohttp.ClientSession=None,
+                                semaphore: Union[asyncio.Semaphore, AdaptiveLimiter]=None,
+                                proxy: str=None,
+                                size: int=None,
+                                headers: dict=None,
+                                retry: RetryPolicy=None,
+                                budget: ByteBudget=None,
+                                hedging: HedgePolicy=None) -> bytearray:
+    # The fastest healthy mirror first, and the remaining ones in order after a failure.
+    # Every attempt (and hedge) takes its own permit of semaphore.
+    retry = sources.retry if retry is None else retry
+    tried = []
+    error = None
+    while True:
+        candidates = [mirror for mirror in sources.rank() if mirror not in tried]
+        if not candidates:
+            if error is None:
+                raise ValueError(f'There are no mirrors to download {name} from')
+            raise error
+        mirror = candidates[0]
+        tried.append(mirror)
+        timed = _TimedPermits(semaphore)
+        started = time.monotonic()
+        try:
+            data = await download(mirror.url(name), session, timed, proxy, size, headers, retry, budget, hedging)
+        except Exception as e:
+            if not is_missing(e):
+                sources.observe_failure(mirror)
+            error = e
+            continue
+        seconds = timed.seconds if timed.seconds is not None else time.monotonic() - started
+        sources.observe_success(mirror, len(data), seconds)
+        return data
+
+
+class _TimedPermits(object):
+    # Hands out the permits of semaphore and measures how long the last successful one was
+    # held, without the wait for the permit or for the byte budget (which moves permit.started)
+    def __init__(self, semaphore: Union[asyncio.Semaphore, AdaptiveLimiter]):
+        self.semaphore = semaphore
+        self.seconds = None
+        self._started = {}
+
+    async def __aenter__(self):
+        permit = await self.semaphore.__aenter__()
+        self._started[asyncio.current_task()] = (permit, time.monotonic())
+        return permit
+
+    async def __aexit__(self, exc_type, exc, tb):
+        permit, started = self._started.pop(asyncio.current_task())
+        if exc_type is None:
+            started = max(started, permit.started) if permit is not None else started
+            self.seconds = time.monotonic() - started
+        return await self.semaphore.__aexit__(exc_type, exc, tb)
+
+
+def get_blob_dataset(blob: Blob, cache: BlobCache=None) -> netCDF4.Dataset:
+    if cache is None:
+        cache = get_blob_cache()
+    if cache is not None:
+        dataset = cache.open_dataset(blob.name, blob.generation)
+        if dataset is not None:
+            return dataset
+    if blob.size is None:
+        blob.reload()
+    buffer = bytearray(blob.size)
+    with BufferWriter(buffer) as writer:
+        blob.download_to_file(writer)
+        if writer.size != blob.size:
+            raise IOError(f'Received {writer.size} of {blob.size} bytes for {blob.name}')
+    if cache is not None:
+        cache.put(blob.name, buffer, blob.generation)
+    # netCDF4 keeps a reference to the buffer and reads it in place
+    return netCDF4.Dataset("in_memory_file", mode='r', memory=buffer)
 
 
 def save_blob(blob: Blob, filename: str):
     blob.download_to_filename(filename)
 
 
+def open_dataset(source: Union[str, bytearray]) -> netCDF4.Dataset:
+    # source is a local path (a lease of a cache hit) or the downloaded buffer
+    if isinstance(source, str):
+        return netCDF4.Dataset(source, mode='r')
+    return netCDF4.Dataset("in_memory_file", mode='r', memory=source)
+
+
+def process_dataset(process: Callable[[str, netCDF4.Dataset], Any], name: str, source: Union[str, bytearray]) -> Any:
+    # Runs in the processing executor, the decoding happens there too
+    dataset = open_dataset(source)
+    try:
+        return process(name, dataset)
+    finally:
+        dataset.close()
+
+
+def _generation(headers) -> Union[None, str]:
+    # headers may be a plain dict copied from the response, with the server's capitalization
+    headers = {k.lower(): v for k, v in headers.items()}
+    return headers.get('x-goog-generation', headers.get('etag'))
+
+
+async def get_generation(url: str,
+                         session: aiohttp.ClientSession,
+                         semaphore: Union[asyncio.Semaphore, AdaptiveLimiter],
+                         proxy: str=None,
+                         retry: RetryPolicy=None) -> Union[None, str]:
+    # The current generation (or ETag) of the object, from a HEAD request
+    async def attempt():
+        async with semaphore:
+            async with session.head(url, proxy=proxy) as resp:
+                resp.raise_for_status()
+                return _generation(resp.headers)
+    return await with_retry(attempt, retry)
+
+
+async def get_dataset_source(url: str,
+                             session: aiohttp.ClientSession=None,
+                             semaphore: Union[asyncio.Semaphore, AdaptiveLimiter]=None,
+                             proxy: str=None,
+                             size: int=None,
+                             name: str=None,
+                             cache: BlobCache=None,
+                             retry: RetryPolicy=None,
+                             budget: ByteBudget=None,
+                             hedging: HedgePolicy=None,
+                             sources: SourceSelector=None,
+                             generation: Union[int, str]=None) -> Union[str, bytearray]:
+    # With sources, name is the object name and url is not used. With a cache and no
+    # generation (as listed in a Manifest or BlobInfo), a HEAD request gets the current one.
+    # A cache hit is the path of a lease of the cached file, to remove with BlobCache.release.
+    if cache is None:
+        cache = get_blob_cache()
+    name = url if name is None else name
+    loop = asyncio.get_running_loop()
+    if cache is not None:
+        if generation is None:
+            head_url = url if sources is None else sources.rank()[0].url(name)
+            generation = await get_generation(head_url, session, semaphore, proxy, retry)
+        path = await loop.run_in_executor(None, cache.get, name, generation)
+        if path is not None:
+            return path
+    headers = {}
+    if sources is not None:
+        data = await download_from_sources(name, sources, session, semaphore=semaphore, proxy=proxy, size=size,
+                                           headers=headers, retry=retry, budget=budget, hedging=hedging)
+    else:
+        data = await download(url, session, semaphore=semaphore, proxy=proxy, size=size, headers=headers,
+                              retry=retry, budget=budget, hedging=hedging)
+    if cache is not None:
+        await loop.run_in_executor(None, cache.put, name, data, _generation(headers))
+    return data
+
+
 async def get_dataset(url: str,
                       session: aiohttp.ClientSession=None,
-                      semaphore: asyncio.Semaphore=None,
-                      proxy: str=None) -> netCDF4.Dataset:
-    data = await download(url, session, semaphore=semaphore, proxy=proxy)
-    return netCDF4.Dataset("in_memory_file", mode='r', memory=data)
+                      semaphore: Union[asyncio.Semaphore, AdaptiveLimiter]=None,
+                      proxy: str=None,
+                      size: int=None,
+                      name: str=None,
+                      cache: BlobCache=None,
+                      retry: RetryPolicy=None,
+                      hedging: HedgePolicy=None) -> netCDF4.Dataset:
+    source = await get_dataset_source(url, session, semaphore, proxy, size, name, cache, retry, hedging=hedging)
+    try:
+        return open_dataset(source)
+    finally:
+        if isinstance(source, str):
+            # The open file stays readable
+            BlobCache.release(source)
+
+
+@dataclass
+class TransferStats:
+    files: int = 0
+    failed: int = 0
+    bytes: int = 0
+    # Summed over files, they overlap with each other
+    hedges: int = 0
+    hedge_wins: int = 0
+    download_seconds: float = 0.0
+    processing_seconds: float = 0.0
+    wall_seconds: float = 0.0
+
+
+async def _iterate(names: Union[Iterable[str], AsyncIterable[str]]) -> AsyncIterator[str]:
+    if hasattr(names, '__aiter__'):
+        async for name in names:
+            yield name
+    else:
+        for name in names:
+            yield name
 
 
-async def download_datasets(names: List[str],
-                            on_success: Callable[[str, netCDF4.Dataset], Awaitable[None]],
+async def download_datasets(names: Union[Iterable[str], AsyncIterable[str]],
+                            on_success: Callable[[str, Any], Awaitable[None]],
                             on_error: Callable[[str, Exception], Awaitable[None]],
-                            proxy: str=None):
-    async def process(name, url, session, semaphore):
+                            proxy: str=None,
+                            cache: BlobCache=None,
+                            limiter: AdaptiveLimiter=None,
+                            retry: RetryPolicy=None,
+                            session: aiohttp.ClientSession=None,
+                            process: Callable[[str, netCDF4.Dataset], Any]=None,
+                            executor: concurrent.futures.Executor=None,
+                            max_processing: int=MAX_PROCESSING,
+                            max_in_flight: int=MAX_IN_FLIGHT,
+                            max_in_flight_bytes: int=None,
+                            hedging: HedgePolicy=None,
+                            sources: SourceSelector=None,
+                            ranged: RangedRead=None) -> TransferStats:
+    # Without process, on_success receives the open dataset and runs on the event loop.
+    # With process, the dataset is opened and handed to process(name, dataset) in the
+    # executor and on_success receives its result. netCDF-C is not thread safe, so the
+    # default executor is a single thread; pass a ProcessPoolExecutor (and a picklable
+    # process) to decode in parallel.
+    # Names are consumed lazily: at most max_in_flight files are being downloaded or
+    # waiting for processing, holding at most max_in_flight_bytes of downloaded data.
+    # With hedging, stragglers get a duplicate request and the first copy to finish wins.
+    # With sources, every file comes from the fastest healthy mirror, failing over to the others.
+    # With ranged, only the chunks of a window are read with Range requests and on_success
+    # (or process) receives a VariableWindow instead of a dataset, the cache is not used.
+    async def run(name, url, semaphore):
+        source = None
         try:
-            dataset = await get_dataset(url, session=session, semaphore=semaphore, proxy=proxy)
-            try:
-                await on_success(name, dataset)
-            finally:
-                dataset.close()
+            started = time.monotonic()
+            if ranged is not None:
+                url = url if sources is None else sources.rank()[0].url(name)
+                window = await get_variable_window(url, ranged.indexes, ranged.variable_name, session=session,
+                                                   semaphore=semaphore, proxy=proxy, max_gap=ranged.max_gap,
+                                                   retry=retry)
+                stats.download_seconds += time.monotonic() - started
+                stats.bytes += window.bytes_downloaded
+                await process_window(name, window)
+                return
+            source = await get_dataset_source(url, session=session, semaphore=semaphore, proxy=proxy, name=name,
+                                              cache=cache, retry=retry, budget=budget,
+                                              hedging=hedging, sources=sources)
+            stats.download_seconds += time.monotonic() - started
+            stats.bytes += len(source) if not isinstance(source, str) else 0
+            async with processing:
+                started = time.monotonic()
+                if process is None:
+                    dataset = open_dataset(source)
+                    try:
+                        await on_success(name, dataset)
+                    finally:
+                        dataset.close()
+                else:
+                    result = await loop.run_in_executor(executor, process_dataset, process, name, source)
+                    await on_success(name, result)
+                stats.processing_seconds += time.monotonic() - started
+            stats.files += 1
         except Exception as e:
+            stats.failed += 1
             await on_error(name, e)
+        finally:
+            if isinstance(source, str):
+                BlobCache.release(source)
+            elif budget is not None and source is not None:
+                await budget.release(len(source))
+            in_flight.release()
 
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
-    tasks = []
-    storage_client = storage.Client(project="<none>", credentials=AnonymousCredentials())
-    bucket = storage_client.get_bucket(GOES_PUBLIC_BUCKET)
-    timeout = aiohttp.ClientTimeout(total=10*60)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        for name in names:
-            blob = bucket.blob(name)
-            url = blob.public_url
-            tasks.append(process(name, url, session, semaphore))
-        await asyncio.gather(*tasks)
+    async def process_window(name: str, window: VariableWindow):
+        async with processing:
+            started = time.monotonic()
+            if process is None:
+                await on_success(name, window)
+            else:
+                await on_success(name, await loop.run_in_executor(executor, process, name, window))
+            stats.processing_seconds += time.monotonic() - started
+        stats.files += 1
 
+    loop = asyncio.get_running_loop()
+    stats = TransferStats()
+    wall_started = time.monotonic()
+    if hedging is not None:
+        hedges, hedge_wins = hedging.hedges, hedging.hedge_wins
+    if limiter is None:
+        limiter = AdaptiveLimiter(initial_limit=MAX_CONCURRENT, shared=get_shared_concurrency())
+    if session is None:
+        session = get_session()
+    processing = asyncio.Semaphore(max_processing)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    budget = ByteBudget(max_in_flight_bytes) if max_in_flight_bytes else None
+    own_executor = None
+    if process is not None and executor is None:
+        executor = own_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    tasks = set()
+    try:
+        async for name in _iterate(names):
+            await in_flight.acquire()
+            task = asyncio.ensure_future(run(name, get_public_url(name) if sources is None else None, limiter))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if own_executor is not None:
+            own_executor.shutdown(wait=False)
+    stats.wall_seconds = time.monotonic() - wall_started
+    if hedging is not None:
+        stats.hedges, stats.hedge_wins = hedging.hedges - hedges, hedging.hedge_wins - hedge_wins
+    return stats
 
-def get_blob(name: str):
+
+@functools.lru_cache(maxsize=None)
+def get_bucket(name: str=GOES_PUBLIC_BUCKET) -> storage.Bucket:
+    # No metadata round trip, public buckets need nothing but the name
     client = storage.Client(project="<none>", credentials=AnonymousCredentials())
-    bucket = client.get_bucket(GOES_PUBLIC_BUCKET)
-    return bucket.blob(name)
+    return client.bucket(name)
+
+
+def get_blob(name: str):
+    return get_bucket().blob(name)
 
 
 def get_blobs(product_band: ProductBand, date: datetime.date, hour: int=None) -> List[Blob]:
-    client = storage.Client(project="<none>", credentials=AnonymousCredentials())
-    bucket = client.get_bucket(GOES_PUBLIC_BUCKET)
+    bucket = get_bucket()
     prefix = path_prefix(product=product_band.product, year=date.year, month=date.month, day=date.day, hour=hour)
     pattern = file_regex_pattern(
         band=product_band.band, product=product_band.product, mode=ANY_MODE,
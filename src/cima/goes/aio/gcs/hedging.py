@@ -0,0 +1,94 @@
+import asyncio
+import collections
+import time
+from typing import Awaitable, Callable, TypeVar, Union
+
+import numpy as np
+
+
+T = TypeVar('T')
+
+
+class HedgePolicy(object):
+    """Launches a duplicate of a transfer that takes longer than
+    multiplier * the quantile of the recent transfer times (never before
+    min_delay seconds) and keeps whichever finishes first. The same policy
+    object should be shared by all the transfers of a batch, it learns the
+    transfer time distribution from them."""
+    def __init__(self,
+                 quantile: float = 0.95,
+                 multiplier: float = 1.5,
+                 min_delay: float = 5.0,
+                 min_samples: int = 10,
+                 max_hedges: int = 1,
+                 window: int = 200):
+        self.quantile = quantile
+        self.multiplier = multiplier
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._samples = collections.deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def delay(self) -> Union[None, float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        return max(self.min_delay, self.multiplier * float(np.quantile(self._samples, self.quantile)))
+
+    async def run(self, attempt_factory: Callable[[], Awaitable[T]],
+                  discard: Callable[[T], Awaitable[None]] = None,
+                  transfer_started: asyncio.Event = None) -> T:
+        # Each attempt has its own retries, a failed attempt does not trigger a hedge.
+        # discard is called with the result of every other attempt that also succeeds,
+        # to free what it holds (the byte budget of a download). With transfer_started,
+        # set by the first attempt once it holds its permits and its transfer begins, the
+        # time waiting for them is neither a reason to hedge nor part of the transfer times.
+        delay = self.delay()
+        primary = asyncio.ensure_future(attempt_factory())
+        pending = {primary}
+        launched = 1
+        winner = None
+        try:
+            if transfer_started is not None:
+                waiter = asyncio.ensure_future(transfer_started.wait())
+                try:
+                    await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+            started = time.monotonic()
+            while pending:
+                timeout = None
+                if delay is not None and launched <= self.max_hedges:
+                    timeout = max(started + delay * launched - time.monotonic(), 0)
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedges += 1
+                    launched += 1
+                    pending.add(asyncio.ensure_future(attempt_factory()))
+                    continue
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded:
+                    winner = primary if primary in succeeded else succeeded[0]
+                    if winner is not primary:
+                        self.hedge_wins += 1
+                    self.observe(time.monotonic() - started)
+                    for task in succeeded:
+                        if task is not winner and discard is not None:
+                            await discard(task.result())
+                    return winner.result()
+                error = next(iter(done)).exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                # An attempt may finish before its cancellation is delivered
+                results = await asyncio.gather(*pending, return_exceptions=True)
+                if discard is not None:
+                    for result in results:
+                        if not isinstance(result, BaseException):
+                            await discard(result)
@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, Iterator, Pattern
+
+import aiohttp
+
+from cima.goes.products import GOES_PUBLIC_BUCKET, path_prefix, file_regex_pattern, ANY_MODE
+from cima.goes.products import ProductBand
+from .retry import RetryPolicy, with_retry
+from .sessions import get_session
+
+
+GCS_LIST_URL = 'https://storage.googleapis.com/storage/v1/b/{bucket}/o'
+LIST_PAGE_SIZE = 1000
+MAX_CONCURRENT_LISTINGS = 32
+
+
+@dataclass
+class BlobInfo:
+    name: str
+    size: int
+    generation: int
+
+
+def date_range(from_date: datetime.date, to_date: datetime.date) -> Iterator[datetime.date]:
+    date = from_date
+    while date <= to_date:
+        yield date
+        date = date + datetime.timedelta(days=1)
+
+
+async def _get_page(session: aiohttp.ClientSession, url: str, params: dict, proxy: str) -> dict:
+    async with session.get(url, params=params, proxy=proxy) as resp:
+        resp.raise_for_status()
+        return await resp.json()
+
+
+async def list_prefix(prefix: str,
+                      session: aiohttp.ClientSession,
+                      proxy: str = None,
+                      pattern: Pattern = None,
+                      bucket: str = GOES_PUBLIC_BUCKET,
+                      retry: RetryPolicy = None) -> AsyncIterator[BlobInfo]:
+    url = GCS_LIST_URL.format(bucket=bucket)
+    params = {
+        'prefix': prefix,
+        'maxResults': str(LIST_PAGE_SIZE),
+        'fields': 'items(name,size,generation),nextPageToken',
+    }
+    while True:
+        page = await with_retry(lambda: _get_page(session, url, params, proxy), retry)
+        for item in page.get('items', []):
+            if pattern is None or pattern.search(item['name']):
+                yield BlobInfo(name=item['name'], size=int(item['size']), generation=int(item['generation']))
+        if 'nextPageToken' not in page:
+            return
+        params = dict(params, pageToken=page['nextPageToken'])
+
+
+async def list_prefixes(prefixes: Iterable[str],
+                        session: aiohttp.ClientSession,
+                        proxy: str = None,
+                        pattern: Pattern = None,
+                        max_concurrent: int = MAX_CONCURRENT_LISTINGS,
+                        bucket: str = GOES_PUBLIC_BUCKET,
+                        retry: RetryPolicy = None) -> AsyncIterator[BlobInfo]:
+    # Results come in completion order, not in prefix order
+    done = object()
+    results = asyncio.Queue(maxsize=max_concurrent * LIST_PAGE_SIZE)
+    prefixes = iter(prefixes)
+
+    async def worker():
+        try:
+            for prefix in prefixes:
+                async for blob in list_prefix(prefix, session, proxy, pattern, bucket, retry):
+                    await results.put(blob)
+        except Exception as e:
+            await results.put(e)
+            return
+        await results.put(done)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max_concurrent)]
+    try:
+        running = len(workers)
+        while running:
+            item = await results.get()
+            if item is done:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for w in workers:
+            w.cancel()
+
+
+def blob_prefixes(product_band: ProductBand, dates: Iterable[datetime.date], hours: Iterable[int] = None) -> Iterator[str]:
+    for date in dates:
+        for hour in (hours if hours is not None else [None]):
+            yield path_prefix(product=product_band.product, year=date.year, month=date.month, day=date.day, hour=hour)
+
+
+async def list_blobs(product_band: ProductBand,
+                     dates: Iterable[datetime.date],
+                     hours: Iterable[int] = None,
+                     session: aiohttp.ClientSession = None,
+                     proxy: str = None,
+                     max_concurrent: int = MAX_CONCURRENT_LISTINGS,
+                     retry: RetryPolicy = None) -> AsyncIterator[BlobInfo]:
+    if hours is not None:
+        hours = list(hours)
+    pattern = file_regex_pattern(
+        band=product_band.band, product=product_band.product, mode=ANY_MODE,
+        subproduct=product_band.subproduct)
+    prefixes = blob_prefixes(product_band, dates, hours)
+    if session is None:
+        session = get_session()
+    async for blob in list_prefixes(prefixes, session, proxy, pattern, max_concurrent, retry=retry):
+        yield blob
@@ -0,0 +1,146 @@
+import datetime
+from typing import Iterable, List, Tuple, Union
+
+import aiohttp
+import apsw
+
+from cima.goes.products import ProductBand, GoesFileName, GoesFileNames, parse_file_names, path_prefix, file_regex_pattern, ANY_MODE
+from .listing import BlobInfo, list_prefixes, MAX_CONCURRENT_LISTINGS
+from .retry import RetryPolicy
+from .sessions import get_session
+
+
+def _parse_name(name: str) -> Tuple[str, Union[None, int], Union[None, int], Union[None, str], str]:
+    parsed = GoesFileName.parse(name)
+    mode = None if parsed.mode is None else str(parsed.mode)
+    return parsed.product, parsed.subproduct, parsed.band, mode, parsed.start.isoformat()
+
+
+class Manifest(object):
+    """Local index of bucket objects (name, size, generation, observation
+    start) queried by product, band and time without touching the network."""
+    def __init__(self, database_filepath: str):
+        self.database_filepath = database_filepath
+        self.connection = apsw.Connection(database_filepath)
+        objects_sql = """CREATE TABLE IF NOT EXISTS object (
+                name text PRIMARY KEY,
+                product text NOT NULL,
+                subproduct integer,
+                band integer,
+                mode text,
+                obs_start timestamp NOT NULL,
+                size integer,
+                generation integer
+        );"""
+        index_sql = """CREATE INDEX IF NOT EXISTS by_product_band_time ON object(product, band, obs_start)"""
+        with self.connection:
+            cursor = self.connection.cursor()
+            cursor.execute(objects_sql)
+            cursor.execute(index_sql)
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def add(self, blobs: Iterable[BlobInfo]) -> int:
+        insert_sql = """INSERT OR REPLACE INTO object(name, product, subproduct, band, mode, obs_start, size, generation)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?)"""
+        rows = [(blob.name, *_parse_name(blob.name), blob.size, blob.generation) for blob in blobs]
+        with self.connection:
+            self.connection.cursor().executemany(insert_sql, rows)
+        return len(rows)
+
+    def _where(self, product_band: ProductBand, start: datetime.datetime = None, end: datetime.datetime = None):
+        where = 'product = ? AND subproduct IS ? AND band IS ?'
+        args = [product_band.product.value, product_band.subproduct,
+                None if product_band.band is None else int(product_band.band)]
+        if start is not None:
+            where += ' AND obs_start >= ?'
+            args.append(start.isoformat())
+        if end is not None:
+            where += ' AND obs_start < ?'
+            args.append(end.isoformat())
+        return where, args
+
+    def query(self, product_band: ProductBand,
+              start: datetime.datetime = None, end: datetime.datetime = None) -> List[BlobInfo]:
+        where, args = self._where(product_band, start, end)
+        cursor = self.connection.cursor()
+        rows = cursor.execute(f'SELECT name, size, generation FROM object WHERE {where} ORDER BY obs_start', args)
+        return [BlobInfo(name=name, size=size, generation=generation) for name, size, generation in rows]
+
+    def names(self, product_band: ProductBand,
+              start: datetime.datetime = None, end: datetime.datetime = None) -> List[str]:
+        return [blob.name for blob in self.query(product_band, start, end)]
+
+    def file_names(self, product_band: ProductBand,
+                   start: datetime.datetime = None, end: datetime.datetime = None) -> GoesFileNames:
+        return parse_file_names(self.names(product_band, start, end))
+
+    def total_size(self, product_band: ProductBand,
+                   start: datetime.datetime = None, end: datetime.datetime = None) -> int:
+        where, args = self._where(product_band, start, end)
+        cursor = self.connection.cursor()
+        return cursor.execute(f'SELECT coalesce(sum(size), 0) FROM object WHERE {where}', args).fetchall()[0][0]
+
+    def obs_starts(self, product_band: ProductBand,
+                   start: datetime.datetime = None, end: datetime.datetime = None) -> List[datetime.datetime]:
+        where, args = self._where(product_band, start, end)
+        cursor = self.connection.cursor()
+        rows = cursor.execute(f'SELECT obs_start FROM object WHERE {where} ORDER BY obs_start', args)
+        return [datetime.datetime.fromisoformat(row[0]) for row in rows]
+
+    def first_obs_start(self, product_band: ProductBand) -> Union[None, datetime.datetime]:
+        where, args = self._where(product_band)
+        cursor = self.connection.cursor()
+        row = cursor.execute(f'SELECT min(obs_start) FROM object WHERE {where}', args).fetchall()[0][0]
+        return None if row is None else datetime.datetime.fromisoformat(row)
+
+    def last_obs_start(self, product_band: ProductBand) -> Union[None, datetime.datetime]:
+        where, args = self._where(product_band)
+        cursor = self.connection.cursor()
+        row = cursor.execute(f'SELECT max(obs_start) FROM object WHERE {where}', args).fetchall()[0][0]
+        return None if row is None else datetime.datetime.fromisoformat(row)
+
+    def gaps(self, product_band: ProductBand, start: datetime.datetime, end: datetime.datetime,
+             interval: datetime.timedelta) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+        # (last obs before the gap, first obs after it) for every hole longer than 1.5 intervals
+        times = [start - interval] + self.obs_starts(product_band, start, end) + [end]
+        return [(t0, t1) for t0, t1 in zip(times[:-1], times[1:]) if t1 - t0 > interval * 1.5]
+
+    async def refresh(self, product_band: ProductBand,
+                      from_date: datetime.date,
+                      to_date: datetime.date = None,
+                      session: aiohttp.ClientSession = None,
+                      proxy: str = None,
+                      max_concurrent: int = MAX_CONCURRENT_LISTINGS,
+                      retry: RetryPolicy = None) -> int:
+        # When the indexed objects already span from_date, only prefixes from the hour of the
+        # last one on are listed again, otherwise the whole [from_date, to_date]
+        to_date = datetime.datetime.now(datetime.timezone.utc).date() if to_date is None else to_date
+        first, last = self.first_obs_start(product_band), self.last_obs_start(product_band)
+        prefixes = []
+        date = from_date
+        if last is not None and first.date() <= from_date <= last.date():
+            date = last.date()
+            for hour in range(last.hour, 24):
+                prefixes.append(path_prefix(product_band.product, date.year, date.month, date.day, hour))
+            date = date + datetime.timedelta(days=1)
+        while date <= to_date:
+            prefixes.append(path_prefix(product_band.product, date.year, date.month, date.day))
+            date = date + datetime.timedelta(days=1)
+
+        pattern = file_regex_pattern(
+            band=product_band.band, product=product_band.product, mode=ANY_MODE,
+            subproduct=product_band.subproduct)
+        if session is None:
+            session = get_session()
+        blobs = [blob async for blob in list_prefixes(prefixes, session, proxy, pattern, max_concurrent, retry=retry)]
+        return self.add(blobs)
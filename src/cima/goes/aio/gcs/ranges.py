@@ -0,0 +1,320 @@
+import asyncio
+import concurrent.futures
+import io
+import itertools
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple, Union
+
+import aiohttp
+import h5py
+import numpy as np
+
+from .concurrency import AdaptiveLimiter
+from .retry import RetryPolicy, with_retry
+from .sessions import get_session
+
+
+RANGE_BLOCK_SIZE = 256 * 1024
+MAX_RANGE_GAP = 64 * 1024
+# Concurrent Range requests of a window when no limiter is given
+MAX_RANGE_REQUESTS = 8
+
+H5Z_FILTER_DEFLATE = 1
+H5Z_FILTER_SHUFFLE = 2
+H5Z_FILTER_FLETCHER32 = 3
+
+# Attributes written by the netCDF-4 library for its own bookkeeping
+_HIDDEN_ATTRIBUTES = {'DIMENSION_LIST', 'REFERENCE_LIST', 'NAME', 'CLASS', '_Netcdf4Dimid', '_Netcdf4Coordinates', '_nc3_strict'}
+
+
+class RangeFile(io.RawIOBase):
+    """Read only file over HTTP, every read is served by Range requests
+    of block_size bytes, so h5py only pulls the blocks it really touches
+    (superblock, object headers, chunk B-tree nodes). The requests run on
+    the aiohttp session and limiter of the event loop that opened it, so
+    the reads block and must come from another thread (an executor)."""
+    def __init__(self, url: str, size: int, loop: asyncio.AbstractEventLoop,
+                 session: aiohttp.ClientSession,
+                 semaphore: Union[asyncio.Semaphore, AdaptiveLimiter],
+                 proxy: str = None,
+                 retry: RetryPolicy = None,
+                 block_size: int = RANGE_BLOCK_SIZE):
+        super().__init__()
+        self.url = url
+        self.size = size
+        self.loop = loop
+        self.session = session
+        self.semaphore = semaphore
+        self.proxy = proxy
+        self.retry = retry
+        self.block_size = block_size
+        self.bytes_downloaded = 0
+        self._position = 0
+        self._blocks: Dict[int, bytes] = {}
+
+    @staticmethod
+    async def open(url: str,
+                   session: aiohttp.ClientSession,
+                   semaphore: Union[asyncio.Semaphore, AdaptiveLimiter],
+                   proxy: str = None,
+                   retry: RetryPolicy = None,
+                   block_size: int = RANGE_BLOCK_SIZE) -> 'RangeFile':
+        async def head():
+            async with semaphore:
+                async with session.head(url, proxy=proxy) as resp:
+                    resp.raise_for_status()
+                    return int(resp.headers['Content-Length'])
+        size = await with_retry(head, retry)
+        return RangeFile(url, size, asyncio.get_running_loop(), session, semaphore, proxy, retry, block_size)
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        future = asyncio.run_coroutine_threadsafe(
+            fetch_range(self.url, start, end, self.session, self.semaphore, self.proxy, self.retry), self.loop)
+        data = future.result()
+        self.bytes_downloaded += len(data)
+        return data
+
+    def _block(self, index: int) -> bytes:
+        if index not in self._blocks:
+            start = index * self.block_size
+            self._blocks[index] = self._fetch(start, min(start + self.block_size, self.size))
+        return self._blocks[index]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        end = min(self._position + len(view), self.size)
+        written = 0
+        while self._position < end:
+            index, offset = divmod(self._position, self.block_size)
+            block = self._block(index)
+            count = min(len(block) - offset, end - self._position)
+            view[written:written + count] = block[offset:offset + count]
+            written += count
+            self._position += count
+        return written
+
+
+@dataclass
+class ChunkLayout:
+    dtype: np.dtype
+    shape: Tuple[int, ...]
+    chunks: Tuple[int, ...]
+    filters: List[int]
+    fill_value: any
+    attributes: dict
+    # chunk offset -> (byte offset, stored size, filter mask), None when the chunk was never written
+    locations: Dict[Tuple[int, ...], Tuple[int, int, int]] = field(default_factory=dict)
+
+
+@dataclass
+class VariableWindow:
+    name: str
+    data: np.ma.MaskedArray
+    attributes: dict
+    global_attributes: dict
+    bytes_downloaded: int
+    object_size: int
+
+
+def _attribute_value(value):
+    if isinstance(value, np.ndarray) and value.size == 1:
+        value = value.reshape(())[()]
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+def _attributes(h5_object) -> dict:
+    return {k: _attribute_value(v) for k, v in h5_object.attrs.items() if k not in _HIDDEN_ATTRIBUTES}
+
+
+def _window_chunk_offsets(indexes, chunks: Tuple[int, int]):
+    rows = range(indexes.row_min // chunks[0] * chunks[0], indexes.row_max, chunks[0])
+    cols = range(indexes.col_min // chunks[1] * chunks[1], indexes.col_max, chunks[1])
+    return list(itertools.product(rows, cols))
+
+
+def read_chunk_layout(range_file: RangeFile, variable_name: str, indexes) -> Tuple[ChunkLayout, dict]:
+    with h5py.File(range_file, 'r') as h5:
+        dataset = h5[variable_name]
+        if dataset.chunks is None or len(dataset.shape) != 2:
+            raise ValueError(f'{variable_name} is not a chunked 2D variable')
+        plist = dataset.id.get_create_plist()
+        layout = ChunkLayout(
+            dtype=dataset.dtype,
+            shape=dataset.shape,
+            chunks=dataset.chunks,
+            filters=[plist.get_filter(i)[0] for i in range(plist.get_nfilters())],
+            fill_value=dataset.fillvalue,
+            attributes=_attributes(dataset))
+        for offset in _window_chunk_offsets(indexes, dataset.chunks):
+            info = dataset.id.get_chunk_info_by_coord(offset)
+            layout.locations[offset] = None if info.byte_offset is None else (info.byte_offset, info.size, info.filter_mask)
+        return layout, _attributes(h5)
+
+
+def _coalesce(locations: List[Tuple[int, int]], max_gap: int) -> List[Tuple[int, int]]:
+    ranges = []
+    for start, size in sorted(locations):
+        if ranges and start - ranges[-1][1] <= max_gap:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], start + size))
+        else:
+            ranges.append((start, start + size))
+    return ranges
+
+
+def fletcher32(data: bytes) -> int:
+    # H5_checksum_fletcher32: big endian 16 bit words, an odd last byte is the high byte
+    # of a word, sums kept in 1..65535 (0 only when every word is 0)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if raw.size % 2:
+        raw = np.append(raw, np.uint8(0))
+    words = raw.view('>u2').astype(np.int64)
+    weights = np.arange(words.size, 0, -1, dtype=np.int64)
+    sum1 = int(words.sum())
+    sum2 = int((words * weights).sum())
+    sum1 = 0 if sum1 == 0 else (sum1 - 1) % 65535 + 1
+    sum2 = 0 if sum2 == 0 else (sum2 - 1) % 65535 + 1
+    return (sum2 << 16) | sum1
+
+
+def decode_chunk(raw: bytes, layout: ChunkLayout, filter_mask: int) -> np.ndarray:
+    data = raw
+    for position, code in reversed(list(enumerate(layout.filters))):
+        if filter_mask & (1 << position):
+            continue
+        if code == H5Z_FILTER_DEFLATE:
+            data = zlib.decompress(data)
+        elif code == H5Z_FILTER_SHUFFLE:
+            size = layout.dtype.itemsize
+            shuffled = np.frombuffer(data, dtype=np.uint8)
+            data = shuffled.reshape(size, -1).T.tobytes()
+        elif code == H5Z_FILTER_FLETCHER32:
+            data, stored = data[:-4], int.from_bytes(data[-4:], 'little')
+            if fletcher32(data) != stored:
+                raise IOError(f'Fletcher32 checksum mismatch in a chunk of {len(data)} bytes')
+        else:
+            raise ValueError(f'Unsupported HDF5 filter {code}')
+    return np.frombuffer(data, dtype=layout.dtype).reshape(layout.chunks)
+
+
+def unpack_variable(data: np.ndarray, attributes: dict) -> np.ma.MaskedArray:
+    # Same conventions netCDF4 applies with auto mask and scale
+    if str(attributes.get('_Unsigned', 'false')).lower() == 'true' and data.dtype.kind == 'i':
+        data = data.view(data.dtype.str.replace('i', 'u'))
+    mask = np.zeros(data.shape, dtype=bool)
+    if '_FillValue' in attributes:
+        mask |= data == np.asarray(attributes['_FillValue']).astype(data.dtype)
+    if 'valid_range' in attributes:
+        valid_min, valid_max = np.asarray(attributes['valid_range']).astype(data.dtype)
+        mask |= (data < valid_min) | (data > valid_max)
+    if 'scale_factor' in attributes or 'add_offset' in attributes:
+        data = data * attributes.get('scale_factor', 1) + attributes.get('add_offset', 0)
+    return np.ma.MaskedArray(data, mask=mask)
+
+
+async def fetch_range(url: str, start: int, end: int,
+                      session: aiohttp.ClientSession,
+                      semaphore: Union[asyncio.Semaphore, AdaptiveLimiter],
+                      proxy: str = None,
+                      retry: RetryPolicy = None) -> bytes:
+    async def attempt():
+        async with semaphore as permit:
+            async with session.get(url, proxy=proxy, headers={'Range': f'bytes={start}-{end - 1}'}) as resp:
+                resp.raise_for_status()
+                if resp.status != 206:
+                    raise IOError(f'{url} does not support Range requests (status {resp.status})')
+                data = await resp.read()
+                if permit is not None:
+                    permit.bytes = len(data)
+                return data
+    return await with_retry(attempt, retry)
+
+
+@dataclass(frozen=True)
+class RangedRead:
+    """Option of download_datasets: read only the chunks of variable_name that
+    overlap indexes (a RegionIndexes) instead of downloading whole files."""
+    indexes: any
+    variable_name: str = "CMI"
+    max_gap: int = MAX_RANGE_GAP
+
+
+async def get_variable_window(url: str,
+                              indexes,
+                              variable_name: str = "CMI",
+                              session: aiohttp.ClientSession = None,
+                              semaphore: Union[asyncio.Semaphore, AdaptiveLimiter] = None,
+                              proxy: str = None,
+                              max_gap: int = MAX_RANGE_GAP,
+                              retry: RetryPolicy = None,
+                              executor: concurrent.futures.Executor = None) -> VariableWindow:
+    # indexes: any object with row_min/row_max/col_min/col_max, e.g. RegionIndexes.
+    # The chunks are decoded in executor (the default one of the loop when None), not on the loop.
+    if session is None:
+        session = get_session()
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_RANGE_REQUESTS)
+    loop = asyncio.get_running_loop()
+    range_file = await RangeFile.open(url, session, semaphore, proxy=proxy, retry=retry)
+    layout, global_attributes = await loop.run_in_executor(
+        None, read_chunk_layout, range_file, variable_name, indexes)
+
+    stored = [(location[0], location[1]) for location in layout.locations.values() if location is not None]
+    ranges = _coalesce(stored, max_gap)
+    contents = await asyncio.gather(
+        *[fetch_range(url, start, end, session, semaphore, proxy, retry) for start, end in ranges])
+    bytes_downloaded = range_file.bytes_downloaded + sum(len(x) for x in contents)
+    window = await loop.run_in_executor(executor, assemble_window, layout, indexes, ranges, contents)
+    return VariableWindow(
+        name=variable_name,
+        data=window,
+        attributes=layout.attributes,
+        global_attributes=global_attributes,
+        bytes_downloaded=bytes_downloaded,
+        object_size=range_file.size)
+
+
+def assemble_window(layout: ChunkLayout, indexes, ranges: List[Tuple[int, int]],
+                    contents: List[bytes]) -> np.ma.MaskedArray:
+    # Decodes the chunks fetched as ranges and copies their overlap with indexes into the window
+    rows = indexes.row_max - indexes.row_min
+    cols = indexes.col_max - indexes.col_min
+    window = np.empty((rows, cols), dtype=layout.dtype)
+    chunk_rows, chunk_cols = layout.chunks
+    for (row, col), location in layout.locations.items():
+        if location is None:
+            chunk = np.full(layout.chunks, layout.fill_value, dtype=layout.dtype)
+        else:
+            start, size, filter_mask = location
+            range_index = next(i for i, r in enumerate(ranges) if r[0] <= start < r[1])
+            offset = start - ranges[range_index][0]
+            chunk = decode_chunk(contents[range_index][offset:offset + size], layout, filter_mask)
+        src_row0 = max(indexes.row_min - row, 0)
+        src_row1 = min(indexes.row_max - row, chunk_rows)
+        src_col0 = max(indexes.col_min - col, 0)
+        src_col1 = min(indexes.col_max - col, chunk_cols)
+        dst_row = row + src_row0 - indexes.row_min
+        dst_col = col + src_col0 - indexes.col_min
+        window[dst_row:dst_row + src_row1 - src_row0, dst_col:dst_col + src_col1 - src_col0] = \
+            chunk[src_row0:src_row1, src_col0:src_col1]
+    return unpack_variable(window, layout.attributes)
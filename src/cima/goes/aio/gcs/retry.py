@@ -0,0 +1,52 @@
+import asyncio
+import random
+from dataclasses import dataclass
+from typing import Callable, Awaitable, TypeVar
+
+import aiohttp
+
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable(e: BaseException) -> bool:
+    # Transient failures, also what AdaptiveLimiter counts as congestion
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status in RETRYABLE_STATUS
+    return isinstance(e, (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError))
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    multiplier: float = 2.0
+    # fraction of the delay drawn at random, 1.0 is "full jitter"
+    jitter: float = 1.0
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** attempt)
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+    def should_retry(self, attempt: int, e: BaseException) -> bool:
+        return attempt < self.max_attempts and is_retryable(e)
+
+
+DEFAULT_RETRY = RetryPolicy()
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+T = TypeVar('T')
+
+
+async def with_retry(attempt_factory: Callable[[], Awaitable[T]], retry: RetryPolicy = None) -> T:
+    retry = DEFAULT_RETRY if retry is None else retry
+    attempt = 0
+    while True:
+        try:
+            return await attempt_factory()
+        except Exception as e:
+            attempt += 1
+            if not retry.should_retry(attempt, e):
+                raise
+            await asyncio.sleep(retry.delay(attempt - 1))
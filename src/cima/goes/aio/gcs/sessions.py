@@ -0,0 +1,65 @@
+import asyncio
+import atexit
+import weakref
+from dataclasses import dataclass
+from typing import Dict
+
+import aiohttp
+
+
+@dataclass(frozen=True)
+class SessionConfig:
+    limit: int = 100
+    limit_per_host: int = 0
+    ttl_dns_cache: int = 300
+    keepalive_timeout: float = 60
+    total_timeout: float = 10 * 60
+
+
+DEFAULT_SESSION_CONFIG = SessionConfig()
+
+# One session per event loop and config, kept for the life of the worker process
+_sessions: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[SessionConfig, aiohttp.ClientSession]]' = \
+    weakref.WeakKeyDictionary()
+
+
+def get_session(config: SessionConfig = None) -> aiohttp.ClientSession:
+    config = DEFAULT_SESSION_CONFIG if config is None else config
+    loop = asyncio.get_running_loop()
+    loop_sessions = _sessions.setdefault(loop, {})
+    session = loop_sessions.get(config)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=config.limit,
+            limit_per_host=config.limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=config.ttl_dns_cache,
+            keepalive_timeout=config.keepalive_timeout)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=config.total_timeout))
+        loop_sessions[config] = session
+    return session
+
+
+async def close_sessions():
+    loop_sessions = _sessions.pop(asyncio.get_running_loop(), {})
+    for session in loop_sessions.values():
+        await session.close()
+
+
+# The loops whose sessions are already closed at exit
+_closed_at_exit: 'weakref.WeakSet[asyncio.AbstractEventLoop]' = weakref.WeakSet()
+
+
+def close_sessions_at_exit(loop: asyncio.AbstractEventLoop = None):
+    # For a worker process whose event loop outlives the coroutines it runs (the Store.process
+    # pool workers), the sessions of loop are closed when the process exits. Without loop, it is
+    # called from a coroutine and it is the running one. Registered once per loop.
+    loop = asyncio.get_running_loop() if loop is None else loop
+    if loop in _closed_at_exit:
+        return
+    _closed_at_exit.add(loop)
+
+    def close():
+        if not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(close_sessions())
+    atexit.register(close)
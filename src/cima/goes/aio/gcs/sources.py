@@ -0,0 +1,87 @@
+import time
+import urllib.parse
+from dataclasses import dataclass
+from typing import Iterable, List
+
+import aiohttp
+
+from cima.goes.products import GOES_PUBLIC_BUCKET
+from .retry import RetryPolicy
+
+
+@dataclass(eq=False)
+class Mirror:
+    # url_template has a {name} placeholder for the quoted object name
+    name: str
+    url_template: str
+    # EWMA of bytes per second, None until the first transfer
+    throughput: float = None
+    error_rate: float = 0.0
+    last_failure: float = 0.0
+    transfers: int = 0
+    failures: int = 0
+
+    def url(self, object_name: str) -> str:
+        return self.url_template.format(name=urllib.parse.quote(object_name, safe="/~"))
+
+
+GCS_MIRROR = f'https://storage.googleapis.com/{GOES_PUBLIC_BUCKET}/{{name}}'
+AWS_MIRROR = 'https://noaa-goes16.s3.amazonaws.com/{name}'
+AZURE_MIRROR = 'https://goeseuwest.blob.core.windows.net/noaa-goes16/{name}'
+PUBLIC_MIRRORS = {'gcs': GCS_MIRROR, 'aws': AWS_MIRROR, 'azure': AZURE_MIRROR}
+
+# Fewer attempts per mirror than DEFAULT_RETRY, failing over is usually faster
+FAILOVER_RETRY = RetryPolicy(max_attempts=2)
+
+
+def is_missing(e: BaseException) -> bool:
+    # The object is not on that mirror, which says nothing about the mirror health
+    return isinstance(e, aiohttp.ClientResponseError) and e.status in (403, 404)
+
+
+class SourceSelector(object):
+    """Maps an object name to the same object on several mirrors (all with the
+    bucket layout of the GOES public datasets) and orders them by measured
+    throughput. Mirrors with an error rate above max_error_rate go last until
+    cooldown seconds pass without failures. Mirrors not measured yet go first
+    so that every mirror gets a sample."""
+    def __init__(self,
+                 mirrors: dict = None,
+                 alpha: float = 0.2,
+                 max_error_rate: float = 0.5,
+                 cooldown: float = 60.0,
+                 retry: RetryPolicy = FAILOVER_RETRY):
+        mirrors = PUBLIC_MIRRORS if mirrors is None else mirrors
+        self.mirrors: List[Mirror] = [Mirror(name, template) for name, template in mirrors.items()]
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.retry = retry
+
+    def is_healthy(self, mirror: Mirror) -> bool:
+        return mirror.error_rate <= self.max_error_rate or time.monotonic() - mirror.last_failure > self.cooldown
+
+    def rank(self) -> List[Mirror]:
+        def key(mirror: Mirror):
+            return (not self.is_healthy(mirror),
+                    mirror.throughput is not None,
+                    -(mirror.throughput or 0.0) if self.is_healthy(mirror) else mirror.error_rate)
+        return sorted(self.mirrors, key=key)
+
+    def urls(self, object_name: str) -> Iterable[str]:
+        return [mirror.url(object_name) for mirror in self.rank()]
+
+    def observe_success(self, mirror: Mirror, size: int, seconds: float):
+        mirror.transfers += 1
+        mirror.error_rate = (1 - self.alpha) * mirror.error_rate
+        throughput = size / max(seconds, 1e-6)
+        if mirror.throughput is None:
+            mirror.throughput = throughput
+        else:
+            mirror.throughput = (1 - self.alpha) * mirror.throughput + self.alpha * throughput
+
+    def observe_failure(self, mirror: Mirror):
+        mirror.transfers += 1
+        mirror.failures += 1
+        mirror.error_rate = (1 - self.alpha) * mirror.error_rate + self.alpha
+        mirror.last_failure = time.monotonic()
@@ -2,7 +2,7 @@ import asyncio
 import multiprocessing
 import os
 import datetime
-from typing import Callable, List, Awaitable, Union
+from typing import Callable, List, Awaitable, Union, Sequence
 
 import apsw
 import six
@@ -11,6 +11,7 @@ import uvloop
 from .singleton import SingletonType
 from .commands import Command, BreakCommand
 from aiomultiprocess import Pool
+from cima.goes.aio.gcs.sessions import close_sessions_at_exit
 
 _store_lock = multiprocessing.Lock()
 
@@ -20,6 +21,8 @@ class Store(object):
     def __init__(self, database_filepath: str):
         self.database_filepath = database_filepath
         self.connection = None
+        self._pool = None
+        self._pool_initializer = None
         self._open_database()
 
     def add(self, name: str, detail=''):
@@ -163,12 +166,15 @@ class Store(object):
     def __exit__(self, *args, **kwargs):
         pass
 
-    async def process(self, process_taks: Callable[[List[str]], Awaitable[None]], pool_size: int, workers_count: int=None):
+    async def process(self, process_taks: Callable[[List[str]], Awaitable[None]], pool_size: int, workers_count: int=None,
+                      initializer: Callable[..., None]=None, initargs: Sequence=()):
         async def finish():
             queue.put(BreakCommand())
             while not queue.empty():
                 await asyncio.sleep(1)
 
+        # Before the queue worker starts, it raises if the initializer changed
+        pool = self._get_pool(initializer, initargs)
         queue = self._run_queue()
         files_pools = self._get_pools(workers_count, pool_size, queue)
         if not sum([len(x[0]) for x in files_pools]):
@@ -176,11 +182,32 @@ class Store(object):
             await finish()
             return False
 
-        async with Pool(loop_initializer=uvloop.new_event_loop) as pool:
-            await pool.starmap(process_taks, files_pools)
+        await pool.starmap(
+            _run_in_worker, [(process_taks, *files_pool) for files_pool in files_pools])
         await finish()
         return True
 
+    def _get_pool(self, initializer: Callable[..., None], initargs: Sequence) -> Pool:
+        # The same worker processes and event loops serve every round, so their HTTP sessions
+        # are reused from one batch to the next. They were initialized in the first round, so
+        # every round has to pass the same initializer and initargs.
+        if self._pool is None:
+            self._pool = Pool(loop_initializer=uvloop.new_event_loop, initializer=initializer,
+                              initargs=tuple(initargs))
+            self._pool_initializer = initializer, tuple(initargs)
+        elif self._pool_initializer != (initializer, tuple(initargs)):
+            raise ValueError('The worker processes were started with another initializer or initargs, '
+                             'call close_pool before changing them')
+        return self._pool
+
+    async def close_pool(self):
+        # Call it once there are no more rounds, the workers close their sessions as they exit
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.join()
+            self._pool = None
+            self._pool_initializer = None
+
     def put(self, command: Command):
         if isinstance(command, Processed):
             self._processed(*command._args, **command._kwargs)
@@ -218,6 +245,12 @@ class Store(object):
                 store.put(command)
 
 
+async def _run_in_worker(process_taks: Callable[..., Awaitable[None]], *args):
+    # On the event loop of a pool worker, that runs every round until the process exits
+    close_sessions_at_exit()
+    return await process_taks(*args)
+
+
 class Processed(Command):
     pass
 
@@ -4,3 +4,23 @@ from .clipping import generate_info_files, get_sat_lon, get_clipping_info, get_p
 from .clipping import get_clipping_info_from_dataset, write_clipping_to_dataset
 from .clipping import get_clipping_info_from_info_dataset, write_clipping_to_info_dataset
 from .clipping import get_spatial_resolution, fill_clipped_variable_from_source
+from .clipping import find_region_indexes, find_points_indexes
+from .fixed_grid import FixedGrid, compute_lats_lons, iter_lats_lons_tiles
+from .clipping import ImagerProjection, clipping_info_key, share_clipping_info, get_shared_clipping_info
+from .shared_clipping import SharedClippingInfo
+from .clipping import LazyGrid, write_clipping_to_grid_store, get_clipping_info_from_grid_store, get_grid_store_filename
+from .clipping import get_clipping_info_from_grid, clipping_info_fingerprint, set_clipping_info_directory, get_clipping_info_directory
+from .fixed_grid import full_disk_grid, band_resolution
+from .clipping import register_region, unregister_region, get_registered_regions
+from .clipping import union_indexes, get_regions_clipping_info, clip_regions
+from .clipping import clip_variables, fill_clipped_variables_from_source
+from .time_series import TimeSeriesFrame, FrameVariable, TimeSeriesWriter, TimeSeriesAppender, TimeSeriesChannel, frame_from_source
+from .time_series import share_time_series_appender, get_shared_time_series_appender, append_frame
+from .time_series import read_time_series, time_indexes, get_shard_filenames, get_shard_filename
+from .clipping import OutputProfile, UNCOMPRESSED_OUTPUT_PROFILE, set_output_profile, get_output_profile, packing
+from .regridding import LatLonGrid, Regridder, get_regridder, get_dataset_regridder, regridding_weights
+from .regridding import NEAREST, BILINEAR, CELL_MEAN
+from .clipping import AGGREGATIONS, aggregate_blocks, aggregate_clipping_info, clip_aggregated, resolution_factor
+from .clipping import source_indexes
+from .clipping import QualityRules, clip_with_quality, mask_with_quality, pack_quality, unpack_quality, write_quality_layer
+from .clipping import QUALITY_LAYER_NAME, QUALITY_REJECTED_FLAG
@@ -1,6 +1,11 @@
+import concurrent.futures
+import dataclasses
+import hashlib
+import json
 import multiprocessing
-import datetime
-from typing import List, Dict, Union
+import os
+import tempfile
+from typing import Callable, List, Dict, Tuple, Union
 import math
 
 import netCDF4
@@ -9,8 +14,9 @@ import pyproj
 import numpy as np
 from dataclasses import dataclass
 
-from cima.goes.aio.gcs import get_blobs, get_blob_dataset
 from cima.goes.products import ProductBand
+from .fixed_grid import FixedGrid, TILE_ROWS, PREFETCH_TILES, compute_lats_lons, full_disk_grid, band_resolution
+from .fixed_grid import GOES_R_INVERSE_FLATTENING
 
 old_sat_lon = -89.5
 actual_sat_lon = -75.0
@@ -18,6 +24,11 @@ default_major_order = FORTRAN_ORDER = 'F'
 
 _clipping_info = multiprocessing.Lock()
 
+ORBITAL_SLOTS = {old_sat_lon: 'GOES-Test', actual_sat_lon: 'GOES-East', -137.2: 'GOES-West'}
+ABI_INSTRUMENT_TYPE = 'GOES R Series Advanced Baseline Imager'
+
+REGION_EDGE_SAMPLES = 64
+
 @dataclass
 class LatLonRegion:
     lat_north: float
@@ -46,6 +57,15 @@ class DatasetClippingInfo:
     lons: any
     x: any
     y: any
+    # Source pixels per side of a pixel, the indexes are of the coarse grid when above 1
+    aggregation_factor: int = 1
+
+
+def source_indexes(dscd: DatasetClippingInfo) -> RegionIndexes:
+    # The window of the source grid, the one of the indexes unless aggregated
+    factor = dscd.aggregation_factor
+    return RegionIndexes(col_min=dscd.indexes.col_min * factor, col_max=dscd.indexes.col_max * factor,
+                         row_min=dscd.indexes.row_min * factor, row_max=dscd.indexes.row_max * factor)
 
 
 @dataclass
@@ -55,6 +75,62 @@ class ClippedData:
     data: any
 
 
+@dataclass
+class OutputProfile:
+    # How clipped variables are stored. chunksizes is (rows, columns), None for the
+    # netCDF default. With pack, float variables that are not packed in the source
+    # are packed to pack_datatype with scale_factor and add_offset from their range.
+    zlib: bool = True
+    complevel: int = 4
+    shuffle: bool = True
+    chunksizes: Tuple[int, int] = (512, 512)
+    pack: bool = False
+    pack_datatype: str = 'i2'
+
+    def chunks(self, shape: Tuple[int, ...]) -> Union[None, Tuple[int, ...]]:
+        # The chunk shape of a variable, leading dimensions like time get 1
+        if self.chunksizes is None:
+            return None
+        leading = (1,) * (len(shape) - len(self.chunksizes))
+        return leading + tuple(max(1, min(c, n)) for c, n in zip(self.chunksizes, shape[len(leading):]))
+
+    def variable_kwargs(self, shape: Tuple[int, ...]) -> dict:
+        return dict(zlib=self.zlib, complevel=self.complevel, shuffle=self.shuffle, chunksizes=self.chunks(shape))
+
+
+# Without compression, as the clipped files have always been written. The default profile.
+UNCOMPRESSED_OUTPUT_PROFILE = OutputProfile(zlib=False, shuffle=False, chunksizes=None)
+
+
+@dataclass
+class QualityRules:
+    # Pixels with a data quality flag not in accepted_flags (0 good, 1 conditionally usable,
+    # 2 out of range, 3 no value for CMI, 4 focal plane temperature exceeded) or without flag
+    # are masked. With quality_layer the flags are also written, 2 bits per pixel, as
+    # QUALITY_LAYER_NAME, where flags over 2 and the pixels without flag are QUALITY_REJECTED_FLAG.
+    accepted_flags: Tuple[int, ...] = (0,)
+    dqf_variable_name: str = 'DQF'
+    mask: bool = True
+    quality_layer: bool = False
+
+    def invalid(self, dqf) -> np.ndarray:
+        flags = np.ma.getdata(dqf)
+        if flags.dtype.itemsize == 1:
+            # A lookup table by byte value, several times faster than isin
+            accepted = np.zeros(256, dtype=bool)
+            accepted[np.asarray(self.accepted_flags, dtype=np.int64) & 0xff] = True
+            rejected = ~accepted[flags.view(np.uint8)]
+        else:
+            rejected = ~np.isin(flags, self.accepted_flags)
+        return np.ma.getmaskarray(dqf) | rejected
+
+
+QUALITY_LAYER_NAME = 'DQF_2bits'
+QUALITY_REJECTED_FLAG = 3
+QUALITY_REJECTED_MEANING = 'rejected_pixel_qf'
+QUALITY_FILL_FLAG = QUALITY_REJECTED_FLAG
+
+
 clipping_info_dict = Dict[float, DatasetClippingInfo]
 
 
@@ -69,20 +145,258 @@ def get_info_filename_for_dataset(dataset: netCDF4.Dataset, name_prefix) -> str:
     return get_info_filename(resolution, sat_lon, name_prefix)
 
 
+def get_grid_store_filename(info_filename: str) -> str:
+    return os.path.splitext(info_filename)[0] + '.grid'
+
+
+class ImagerProjection(object):
+    """Picklable copy of a goes_imager_projection variable. Its attributes
+    read like the variable ones and it can be passed to copy_variable."""
+    def __init__(self, name: str, datatype, dimensions: tuple, value, attributes: dict):
+        self.name = name
+        self.datatype = datatype
+        self.dimensions = dimensions
+        self.value = value
+        self.attributes = attributes
+
+    @staticmethod
+    def from_variable(variable) -> 'ImagerProjection':
+        if isinstance(variable, ImagerProjection):
+            return variable
+        return ImagerProjection(
+            name=variable.name,
+            datatype=variable.datatype,
+            dimensions=variable.dimensions,
+            value=np.asarray(variable[...]),
+            attributes={k: variable.getncattr(k) for k in variable.ncattrs()})
+
+    @staticmethod
+    def from_grid(grid: FixedGrid) -> 'ImagerProjection':
+        return ImagerProjection(
+            name='goes_imager_projection',
+            datatype=np.dtype('int32'),
+            dimensions=(),
+            value=np.array(-2147483647, dtype=np.int32),
+            attributes={
+                'long_name': 'GOES-R ABI fixed grid projection',
+                'grid_mapping_name': 'geostationary',
+                'perspective_point_height': grid.sat_height,
+                'semi_major_axis': grid.semi_major_axis,
+                'semi_minor_axis': grid.semi_minor_axis,
+                'inverse_flattening': GOES_R_INVERSE_FLATTENING,
+                'latitude_of_projection_origin': 0.0,
+                'longitude_of_projection_origin': grid.sat_lon,
+                'sweep_angle_axis': 'x',
+            })
+
+    def ncattrs(self) -> List[str]:
+        return list(self.attributes)
+
+    def getncattr(self, name: str):
+        return self.attributes[name]
+
+    def __getattr__(self, name: str):
+        attributes = self.__dict__.get('attributes')
+        if attributes is None or name not in attributes:
+            raise AttributeError(name)
+        return attributes[name]
+
+    def __getitem__(self, item):
+        return self.value if self.value.ndim == 0 else self.value[item]
+
+
+class LazyGrid(object):
+    """Variable of a netCDF file read the first time its values are used."""
+    def __init__(self, filename: str, variable_name: str, shape: tuple, dtype):
+        self.filename = filename
+        self.variable_name = variable_name
+        self.shape = shape
+        self.dtype = dtype
+        self._values = None
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def load(self) -> np.ndarray:
+        if self._values is None:
+            dataset = netCDF4.Dataset(self.filename)
+            try:
+                self._values = dataset.variables[self.variable_name][...]
+            finally:
+                dataset.close()
+        return self._values
+
+    def __getitem__(self, item):
+        return self.load()[item]
+
+    def __array__(self, dtype=None, copy=None):
+        values = np.ma.getdata(self.load())
+        return values if dtype is None else values.astype(dtype)
+
+
+def clipping_info_key(imager_projection, spatial_resolution: str, name_prefix: str) -> str:
+    # The same region of the same grid seen from the same place shares the key
+    resolution = spatial_resolution.split(" ")[0]
+    return f'{name_prefix}-{resolution}-' \
+           f'{float(imager_projection.longitude_of_projection_origin):.6f}-' \
+           f'{float(imager_projection.perspective_point_height):.1f}-' \
+           f'{float(imager_projection.semi_major_axis):.1f}-' \
+           f'{float(imager_projection.semi_minor_axis):.5f}-' \
+           f'{imager_projection.sweep_angle_axis}'
+
+
+def clipping_info_fingerprint(grid: FixedGrid, region: LatLonRegion) -> str:
+    # Everything the clipping info is computed from
+    values = [grid.sat_lon, grid.sat_height, grid.semi_major_axis, grid.semi_minor_axis,
+              grid.x_offset, grid.x_scale, grid.y_offset, grid.y_scale, grid.columns, grid.rows,
+              region.lat_north, region.lat_south, region.lon_west, region.lon_east]
+    return hashlib.sha1(' '.join(f'{float(v):.9g}' for v in values).encode('ascii')).hexdigest()[:16]
+
+
+_clipping_info_directory: Union[None, str] = None
+
+
+def set_clipping_info_directory(directory: Union[None, str]):
+    # Clipping info computed on demand is saved there as grid stores
+    global _clipping_info_directory
+    _clipping_info_directory = directory
+
+
+def get_clipping_info_directory() -> Union[None, str]:
+    return _clipping_info_directory
+
+
+# Compression is opt in with set_output_profile, the default writes the files as they always were
+_output_profile = UNCOMPRESSED_OUTPUT_PROFILE
+
+
+def set_output_profile(profile: OutputProfile):
+    # The profile of the functions that write clipped files when they are not given one
+    global _output_profile
+    _output_profile = profile
+
+
+def get_output_profile() -> OutputProfile:
+    return _output_profile
+
+
+def packing(data, datatype: str = 'i2') -> Tuple[float, float, int]:
+    # scale_factor, add_offset and _FillValue to pack the range of data to an integer type,
+    # the lowest value of the type is the fill value
+    info = np.iinfo(np.dtype(datatype))
+    valid = np.ma.masked_invalid(data).compressed()
+    low, high = (float(valid.min()), float(valid.max())) if valid.size else (0.0, 0.0)
+    steps = int(info.max) - int(info.min) - 1
+    scale = (high - low) / steps if high > low else 1.0
+    offset = low - (int(info.min) + 1) * scale
+    return scale, offset, int(info.min)
+
+
+_shared_clipping_info = None
+
+
+def share_clipping_info(shared):
+    # shared is a SharedClippingInfo published by the parent process
+    global _shared_clipping_info
+    _shared_clipping_info = shared
+
+
+def get_shared_clipping_info():
+    return _shared_clipping_info
+
+
+_regions: Dict[str, LatLonRegion] = {}
+
+
+def register_region(name: str, region: LatLonRegion):
+    # Regions clipped by clip_regions when none are given
+    _regions[name] = region
+
+
+def unregister_region(name: str):
+    _regions.pop(name, None)
+
+
+def get_registered_regions() -> Dict[str, LatLonRegion]:
+    return dict(_regions)
+
+
 clipping_info_cache: Dict[str, Union[None, DatasetClippingInfo]] = {}
 
-def get_clipping_info(dataset: netCDF4.Dataset, name_prefix: str, matrix_type='') -> DatasetClippingInfo:
+def get_clipping_info(dataset: netCDF4.Dataset, name_prefix: str, matrix_type='',
+                      region: LatLonRegion = None, lazy: bool = False) -> DatasetClippingInfo:
+    # matrix_type is not needed any more, the key has the resolution.
+    # Without region the info file written by generate_info_files for name_prefix is read,
+    # with region the clipping info is computed from the grid of the dataset the first time
+    # and kept in the clipping info directory. With lazy, the lats and lons of an info file
+    # are LazyGrid, only read if they are used.
     global clipping_info_cache
     imager_projection = dataset.variables['goes_imager_projection']
-    sat_lon = imager_projection.longitude_of_projection_origin
-    clipping_key = f'{matrix_type}-{sat_lon}'
+    clipping_key = clipping_info_key(imager_projection, dataset.spatial_resolution, name_prefix)
+    grid = None
+    if region is not None:
+        grid = FixedGrid.from_dataset(dataset)
+        clipping_key = f'{clipping_key}-{clipping_info_fingerprint(grid, region)}'
+    if _shared_clipping_info is not None:
+        clipping_info = _shared_clipping_info.get(clipping_key)
+        if clipping_info is not None:
+            return clipping_info
+    # Lazy and loaded grids of the same info file are kept apart
+    cache_key = f'{clipping_key}-lazy' if lazy and region is None else clipping_key
     with _clipping_info:
-        clipping_info = clipping_info_cache[clipping_key] if clipping_key in clipping_info_cache else None
+        clipping_info = clipping_info_cache[cache_key] if cache_key in clipping_info_cache else None
         if clipping_info is None:
-            filename = get_info_filename_for_dataset(dataset, name_prefix)
-            info_dataset = netCDF4.Dataset(filename)
-            clipping_info_cache[clipping_key] = get_clipping_info_from_info_dataset(info_dataset)
-        return clipping_info_cache[clipping_key]
+            if region is not None:
+                clipping_info = _get_computed_clipping_info(dataset, grid, region, name_prefix)
+            else:
+                clipping_info = _read_clipping_info(get_info_filename_for_dataset(dataset, name_prefix), lazy)
+            clipping_info_cache[cache_key] = clipping_info
+        return clipping_info
+
+
+def _read_clipping_info(filename: str, lazy: bool = False) -> DatasetClippingInfo:
+    grid_store_filename = get_grid_store_filename(filename)
+    if os.path.exists(grid_store_filename):
+        return get_clipping_info_from_grid_store(grid_store_filename)
+    info_dataset = netCDF4.Dataset(filename)
+    try:
+        return get_clipping_info_from_info_dataset(info_dataset, lazy)
+    finally:
+        info_dataset.close()
+
+
+def _get_computed_clipping_info(dataset: netCDF4.Dataset, grid: FixedGrid, region: LatLonRegion,
+                                name_prefix: str) -> DatasetClippingInfo:
+    directory = _clipping_info_directory
+    if directory is None:
+        return get_clipping_info_from_dataset(dataset, region)
+    resolution = dataset.spatial_resolution.split(" ")[0]
+    filename = os.path.join(directory, f'{name_prefix}-{resolution}-{clipping_info_fingerprint(grid, region)}.grid')
+    if not os.path.exists(filename):
+        clipping_info = get_clipping_info_from_dataset(dataset, region)
+        write_atomically(filename, lambda temp_filename: write_clipping_to_grid_store(temp_filename, clipping_info))
+    return get_clipping_info_from_grid_store(filename)
+
+
+def write_atomically(filename: str, write: Callable[[str], None], suffix: str = '.tmp'):
+    # write(temp_filename) writes the file under a temporary name in the same directory, that is
+    # then renamed over filename: readers see no file or a whole one, never a partial one. Other
+    # processes may be writing the same file at the same time, the last rename wins, which is
+    # harmless as long as they all write the same content.
+    directory = os.path.dirname(filename) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_filename = tempfile.mkstemp(dir=directory, suffix=suffix)
+    os.close(fd)
+    try:
+        write(temp_filename)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
 
 
 def generate_info_files(product_bands: List[ProductBand],
@@ -90,7 +404,9 @@ def generate_info_files(product_bands: List[ProductBand],
                         filename_prefix="./",
                         institution="Center for Oceanic and Atmospheric Research (CIMA), University of Buenos Aires (UBA) > ARGENTINA",
                         creator_name="Juan Ruiz and Paola Salio",
-                        creator_email="jruiz@cima.fcen.uba.ar, salio@cima.fcen.uba.ar") -> None:
+                        creator_email="jruiz@cima.fcen.uba.ar, salio@cima.fcen.uba.ar",
+                        grid_store=False) -> None:
+    # With grid_store, a .grid file is written next to every info file
     filenames = []
     for product_band in product_bands:
         all_clipping_info = _generate_clipping_info(product_band, latLonRegion)
@@ -107,6 +423,8 @@ def generate_info_files(product_bands: List[ProductBand],
                 info_dataset.creator_email = creator_email
             finally:
                 info_dataset.close()
+            if grid_store:
+                write_clipping_to_grid_store(get_grid_store_filename(filename), clipping_info)
     return filenames
 
 
@@ -120,21 +438,23 @@ def get_sat_lon(dataset: netCDF4.Dataset):
     return imager_projection.longitude_of_projection_origin
 
 
-def _generate_clipping_info(product_band: ProductBand, latLonRegion: LatLonRegion) -> clipping_info_dict:
-    clipping_info: clipping_info_dict = {old_sat_lon: None, actual_sat_lon: None}
-
-    blob = get_blobs(product_band, datetime.date(year=2017, month=8, day=1), hour=15)[0]
-    dataset = get_blob_dataset(blob)
-    clipping_info[old_sat_lon] = get_clipping_info_from_dataset(dataset, latLonRegion)
-
-    blob = get_blobs(product_band, datetime.date(year=2018, month=8, day=1), hour=15)[0]
-    dataset = get_blob_dataset(blob)
-    clipping_info[actual_sat_lon] = get_clipping_info_from_dataset(dataset, latLonRegion)
-
+def _generate_clipping_info(product_band: ProductBand, latLonRegion: LatLonRegion,
+                            sat_lons=(old_sat_lon, actual_sat_lon)) -> clipping_info_dict:
+    # From the known full disk grids, nothing is downloaded
+    if not product_band.product.value.endswith('F'):
+        raise ValueError(f'Only full disk grids are known, not {product_band.product.value}')
+    resolution = band_resolution(product_band.band) if product_band.band is not None else '2km'
+    clipping_info: clipping_info_dict = {}
+    for sat_lon in sat_lons:
+        clipping_info[sat_lon] = get_clipping_info_from_grid(
+            full_disk_grid(sat_lon, resolution), latLonRegion,
+            spatial_resolution=f'{resolution} at nadir',
+            orbital_slot=ORBITAL_SLOTS.get(sat_lon, 'GOES-Test'))
     return clipping_info
 
 
-def get_clipping_info_from_info_dataset(info_dataset: netCDF4.Dataset):
+def get_clipping_info_from_info_dataset(info_dataset: netCDF4.Dataset, lazy=False):
+    # With lazy, lats and lons are read from the file when they are used
     latLonRegion = LatLonRegion(
         lat_north=info_dataset.geospatial_lat_max,
         lat_south=info_dataset.geospatial_lat_min,
@@ -150,33 +470,151 @@ def get_clipping_info_from_info_dataset(info_dataset: netCDF4.Dataset):
     )
 
     return DatasetClippingInfo(
-        goes_imager_projection=info_dataset.variables['goes_imager_projection'],
+        goes_imager_projection=ImagerProjection.from_variable(info_dataset.variables['goes_imager_projection']),
         spatial_resolution=info_dataset.spatial_resolution,
         orbital_slot=info_dataset.orbital_slot,
         instrument_type=info_dataset.instrument_type,
         region=latLonRegion,
         indexes=indexes,
-        lats=info_dataset.variables['lats'][:,:],
-        lons=info_dataset.variables['lons'][:,:],
+        lats=_info_grid(info_dataset, 'lats', lazy),
+        lons=_info_grid(info_dataset, 'lons', lazy),
         x=info_dataset.variables['x'][:],
         y=info_dataset.variables['y'][:]
     )
     
     
+def _info_grid(info_dataset: netCDF4.Dataset, variable_name: str, lazy: bool):
+    variable = info_dataset.variables[variable_name]
+    filename = info_dataset.filepath()
+    if lazy and os.path.exists(filename):
+        return LazyGrid(filename, variable_name, variable.shape, variable.dtype)
+    return variable[:,:]
+
+
+# Grid store: GRID_STORE_MAGIC, the header length as a little endian uint64, a JSON header
+# and the raw little endian lats and lons, starting at a GRID_STORE_ALIGNMENT boundary
+GRID_STORE_MAGIC = b'CIMAGRID'
+GRID_STORE_ALIGNMENT = 4096
+
+
+def _json_value(value):
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return value
+
+
+def write_clipping_to_grid_store(filename: str, dscd: DatasetClippingInfo):
+    projection = ImagerProjection.from_variable(dscd.goes_imager_projection)
+    grids = {}
+    data_length = 0
+    for name in ('lats', 'lons'):
+        dtype = np.dtype(getattr(dscd, name).dtype).newbyteorder('<')
+        shape = tuple(getattr(dscd, name).shape)
+        grids[name] = {'offset': data_length, 'shape': shape, 'dtype': dtype.str}
+        data_length += -(-int(np.prod(shape)) * dtype.itemsize // GRID_STORE_ALIGNMENT) * GRID_STORE_ALIGNMENT
+    header = {
+        'goes_imager_projection': {
+            'name': projection.name,
+            'datatype': np.dtype(projection.datatype).str,
+            'dimensions': list(projection.dimensions),
+            'value': _json_value(projection.value),
+            'attributes': {k: _json_value(v) for k, v in projection.attributes.items()},
+        },
+        'spatial_resolution': dscd.spatial_resolution,
+        'orbital_slot': dscd.orbital_slot,
+        'instrument_type': dscd.instrument_type,
+        'region': dscd.region.__dict__,
+        'indexes': {k: int(v) for k, v in dscd.indexes.__dict__.items()},
+        'x': {'dtype': np.dtype(dscd.x.dtype).str, 'values': np.ma.getdata(dscd.x).tolist()},
+        'y': {'dtype': np.dtype(dscd.y.dtype).str, 'values': np.ma.getdata(dscd.y).tolist()},
+        'grids': grids,
+    }
+    header = json.dumps(header).encode('utf-8')
+    data_start = _grid_store_data_start(len(header))
+    with open(filename, 'wb') as f:
+        f.write(GRID_STORE_MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for name, grid in grids.items():
+            f.seek(data_start + grid['offset'])
+            # Row by row, a lazy or memory mapped source is never loaded whole
+            values = getattr(dscd, name)
+            for row in range(grid['shape'][0]):
+                f.write(np.ascontiguousarray(np.ma.getdata(values[row]), dtype=grid['dtype']).tobytes())
+        f.truncate(data_start + data_length)
+
+
+def _grid_store_data_start(header_length: int) -> int:
+    return -(-(len(GRID_STORE_MAGIC) + 8 + header_length) // GRID_STORE_ALIGNMENT) * GRID_STORE_ALIGNMENT
+
+
+def get_clipping_info_from_grid_store(filename: str) -> DatasetClippingInfo:
+    # Only the header is read, lats and lons are memory mapped
+    with open(filename, 'rb') as f:
+        if f.read(len(GRID_STORE_MAGIC)) != GRID_STORE_MAGIC:
+            raise ValueError(f'{filename} is not a grid store')
+        header_length = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    data_start = _grid_store_data_start(header_length)
+    projection = header['goes_imager_projection']
+    grids = {name: np.memmap(filename, dtype=np.dtype(grid['dtype']), mode='r',
+                             offset=data_start + grid['offset'], shape=tuple(grid['shape']))
+             for name, grid in header['grids'].items()}
+    return DatasetClippingInfo(
+        goes_imager_projection=ImagerProjection(
+            name=projection['name'],
+            datatype=np.dtype(projection['datatype']),
+            dimensions=tuple(projection['dimensions']),
+            value=np.array(projection['value'], dtype=projection['datatype']),
+            attributes=projection['attributes']),
+        spatial_resolution=header['spatial_resolution'],
+        orbital_slot=header['orbital_slot'],
+        instrument_type=header['instrument_type'],
+        region=LatLonRegion(**header['region']),
+        indexes=RegionIndexes(**header['indexes']),
+        lats=grids['lats'],
+        lons=grids['lons'],
+        x=np.array(header['x']['values'], dtype=header['x']['dtype']),
+        y=np.array(header['y']['values'], dtype=header['y']['dtype'])
+    )
+
+
+def get_clipping_info_from_grid(grid: FixedGrid, region: LatLonRegion, spatial_resolution: str,
+                                orbital_slot: str, instrument_type: str = ABI_INSTRUMENT_TYPE,
+                                imager_projection=None) -> DatasetClippingInfo:
+    indexes = find_region_indexes(grid, region)
+    shape = (indexes.row_max - indexes.row_min, indexes.col_max - indexes.col_min)
+    lats = np.empty(shape, dtype=np.float64)
+    lons = np.empty(shape, dtype=np.float64)
+    compute_lats_lons(grid, lats, lons, indexes, off_disk=np.inf)
+    return DatasetClippingInfo(
+        goes_imager_projection=imager_projection if imager_projection is not None else ImagerProjection.from_grid(grid),
+        spatial_resolution=spatial_resolution,
+        orbital_slot=orbital_slot,
+        instrument_type=instrument_type,
+        region=region,
+        indexes=indexes,
+        lats=lats,
+        lons=lons,
+        x=grid.x(np.arange(indexes.col_min, indexes.col_max)).astype(np.float32),
+        y=grid.y(np.arange(indexes.row_min, indexes.row_max)).astype(np.float32)
+    )
+
+
 def get_clipping_info_from_dataset(dataset: netCDF4.Dataset, region: LatLonRegion) -> DatasetClippingInfo:
-    lats, lons, x, y = get_lats_lons_x_y(dataset)
-    indexes = find_indexes(region, lats, lons, default_major_order)
+    indexes = find_region_indexes(FixedGrid.from_dataset(dataset), region)
+    lats, lons, x, y = get_lats_lons_x_y(dataset, indexes)
     return DatasetClippingInfo(
-        goes_imager_projection=dataset.variables['goes_imager_projection'],
+        goes_imager_projection=ImagerProjection.from_variable(dataset.variables['goes_imager_projection']),
         spatial_resolution=dataset.spatial_resolution,
         orbital_slot=dataset.orbital_slot,
         instrument_type=dataset.instrument_type,
         region=region,
         indexes=indexes,
-        lats=lats[indexes.row_min: indexes.row_max, indexes.col_min: indexes.col_max],
-        lons=lons[indexes.row_min: indexes.row_max, indexes.col_min: indexes.col_max],
-        x=x[indexes.col_min: indexes.col_max],
-        y=y[indexes.row_min: indexes.row_max]
+        lats=lats,
+        lons=lons,
+        x=x,
+        y=y
     )
 
 
@@ -193,16 +631,196 @@ def clip_data_indexes(indexes: RegionIndexes, data, lats, lons, copy=False) -> C
     return ClippedData(lats=clipped_lats, lons=clipped_lons, data=clipped_data)
 
 
+def union_indexes(indexes: List[RegionIndexes]) -> RegionIndexes:
+    return RegionIndexes(
+        col_min=min(i.col_min for i in indexes),
+        col_max=max(i.col_max for i in indexes),
+        row_min=min(i.row_min for i in indexes),
+        row_max=max(i.row_max for i in indexes))
+
+
+def get_regions_clipping_info(dataset: netCDF4.Dataset, name_prefix: str,
+                              regions: Dict[str, LatLonRegion] = None) -> Dict[str, DatasetClippingInfo]:
+    # The registered regions when regions is None, each one named {name_prefix}-{name}
+    regions = get_registered_regions() if regions is None else regions
+    return {
+        name: get_clipping_info(dataset, name_prefix=f'{name_prefix}-{name}', region=region)
+        for name, region in regions.items()
+    }
+
+
+def clip_regions(source_dataset: netCDF4.Dataset, clipping_infos: Dict[str, DatasetClippingInfo],
+                 variable_name: str = "CMI") -> Dict[str, np.ndarray]:
+    # The variable is read and decoded once over the union of the regions,
+    # every region gets a view into that buffer
+    if not clipping_infos:
+        return {}
+    union = union_indexes([info.indexes for info in clipping_infos.values()])
+    data = source_dataset.variables[variable_name][union.row_min:union.row_max, union.col_min:union.col_max]
+    clipped = {}
+    for name, info in clipping_infos.items():
+        clipped[name] = data[
+            info.indexes.row_min - union.row_min:info.indexes.row_max - union.row_min,
+            info.indexes.col_min - union.col_min:info.indexes.col_max - union.col_min]
+    return clipped
+
+
+AGGREGATIONS = ('mean', 'nanmean', 'max', 'min')
+
+
+def aggregate_blocks(data, factor: int, method: str = 'mean', dqf=None, max_dqf: int = 0) -> np.ma.MaskedArray:
+    # Reduces factor x factor blocks, rows and columns beyond the last whole block are dropped.
+    # Masked, NaN and, with dqf, pixels with a quality flag over max_dqf are not valid:
+    # mean needs all the pixels of the block, nanmean, max and min take the valid ones.
+    if method not in AGGREGATIONS:
+        raise ValueError(f'Unknown aggregation {method}, use one of {AGGREGATIONS}')
+    rows, cols = np.shape(data)[0] // factor * factor, np.shape(data)[1] // factor * factor
+    values = np.ma.getdata(data)[:rows, :cols]
+    valid = ~np.ma.getmaskarray(data)[:rows, :cols]
+    if values.dtype.kind == 'f':
+        valid &= np.isfinite(values)
+    if dqf is not None:
+        valid &= np.ma.filled(dqf, max_dqf + 1)[:rows, :cols] <= max_dqf
+    all_valid = valid.all()
+    counts = _block_reduce(valid.view(np.uint8), factor, np.add, np.uint16)
+    dtype = values.dtype if values.dtype.kind == 'f' else np.float32
+    if method in ('mean', 'nanmean'):
+        sums = _block_reduce(values if all_valid else np.where(valid, values, 0), factor, np.add, np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = (sums / counts).astype(dtype)
+        mask = counts < factor * factor if method == 'mean' else counts == 0
+    else:
+        empty = -np.inf if method == 'max' else np.inf
+        ufunc = np.maximum if method == 'max' else np.minimum
+        result = _block_reduce(values if all_valid else np.where(valid, values, empty), factor, ufunc, dtype)
+        mask = counts == 0
+    return np.ma.masked_array(result, mask=mask)
+
+
+def _block_reduce(values: np.ndarray, factor: int, ufunc, dtype) -> np.ndarray:
+    # The rows of each block as a middle axis, then the columns as strided slices:
+    # much faster than reducing a (rows, factor, cols, factor) view over its small axes
+    block_rows = ufunc.reduce(values.reshape(-1, factor, values.shape[1]), axis=1, dtype=dtype)
+    result = block_rows[:, 0::factor].copy()
+    for k in range(1, factor):
+        ufunc(result, block_rows[:, k::factor], out=result)
+    return result
+
+
+def resolution_factor(spatial_resolution: str, target_resolution: str) -> int:
+    # '0.5km at nadir' to '2km' is 4
+    source = float(spatial_resolution[:spatial_resolution.find('km')])
+    target = float(target_resolution[:target_resolution.find('km')])
+    factor = int(round(target / source))
+    if factor < 1 or not math.isclose(factor * source, target):
+        raise ValueError(f'{target_resolution} is not a multiple of {spatial_resolution}')
+    return factor
+
+
+_aggregated_clipping_info: Dict[tuple, DatasetClippingInfo] = {}
+
+
+def aggregate_clipping_info(clipping_info: DatasetClippingInfo, factor: int,
+                            grid: FixedGrid = None) -> DatasetClippingInfo:
+    # The clipping info of the coarse grid. The source window is widened to whole blocks aligned
+    # to the grid, so the coarse pixels are the ones of the grid with factor times the resolution,
+    # and the indexes are of that coarse grid. grid is the source grid, without it it comes from x and y.
+    if clipping_info.aggregation_factor != 1:
+        raise ValueError('The clipping info is already aggregated')
+    indexes = clipping_info.indexes
+    projection = clipping_info.goes_imager_projection
+    if grid is None:
+        x = np.asarray(clipping_info.x, dtype=np.float64)
+        y = np.asarray(clipping_info.y, dtype=np.float64)
+        x_scale, y_scale = (x[-1] - x[0]) / (len(x) - 1), (y[-1] - y[0]) / (len(y) - 1)
+        grid = FixedGrid(
+            sat_lon=float(projection.longitude_of_projection_origin),
+            sat_height=float(projection.perspective_point_height),
+            semi_major_axis=float(projection.semi_major_axis),
+            semi_minor_axis=float(projection.semi_minor_axis),
+            x_offset=x[0] - x_scale * indexes.col_min,
+            x_scale=x_scale,
+            y_offset=y[0] - y_scale * indexes.row_min,
+            y_scale=y_scale,
+            columns=None,
+            rows=None)
+    key = (grid, factor, indexes.row_min, indexes.row_max, indexes.col_min, indexes.col_max)
+    with _clipping_info:
+        aggregated = _aggregated_clipping_info.get(key)
+    if aggregated is not None:
+        return aggregated
+    row_min, col_min = indexes.row_min // factor * factor, indexes.col_min // factor * factor
+    row_max, col_max = -(-indexes.row_max // factor) * factor, -(-indexes.col_max // factor) * factor
+    if grid.rows is not None and row_max > grid.rows:
+        row_max = grid.rows // factor * factor
+    if grid.columns is not None and col_max > grid.columns:
+        col_max = grid.columns // factor * factor
+    # The centers of the blocks
+    grid = dataclasses.replace(
+        grid,
+        x_offset=grid.x_offset + grid.x_scale * (col_min + (factor - 1) / 2),
+        x_scale=grid.x_scale * factor,
+        y_offset=grid.y_offset + grid.y_scale * (row_min + (factor - 1) / 2),
+        y_scale=grid.y_scale * factor,
+        columns=(col_max - col_min) // factor,
+        rows=(row_max - row_min) // factor)
+    lats = np.empty((grid.rows, grid.columns), dtype=np.float64)
+    lons = np.empty((grid.rows, grid.columns), dtype=np.float64)
+    compute_lats_lons(grid, lats, lons, off_disk=np.inf)
+    resolution = float(clipping_info.spatial_resolution[:clipping_info.spatial_resolution.find('km')]) * factor
+    aggregated = dataclasses.replace(
+        clipping_info,
+        spatial_resolution=f'{resolution:g}km at nadir',
+        indexes=RegionIndexes(col_min=col_min // factor, col_max=col_max // factor,
+                              row_min=row_min // factor, row_max=row_max // factor),
+        aggregation_factor=factor,
+        lats=lats,
+        lons=lons,
+        x=grid.x(np.arange(grid.columns)).astype(np.float32),
+        y=grid.y(np.arange(grid.rows)).astype(np.float32))
+    with _clipping_info:
+        _aggregated_clipping_info[key] = aggregated
+    return aggregated
+
+
+def clip_aggregated(source_dataset: netCDF4.Dataset, clipping_info: DatasetClippingInfo, factor: int,
+                    method: str = 'mean', variable_name: str = 'CMI', dqf_variable_name: str = None,
+                    max_dqf: int = 0,
+                    quality: QualityRules = None) -> Tuple[DatasetClippingInfo, np.ma.MaskedArray]:
+    # The coarse clipping info and the variable reduced by blocks, to write with
+    # write_clipping_to_dataset and fill_clipped_variable_from_source(..., data=data).
+    # quality masks the source pixels by its rules, instead of dqf_variable_name and max_dqf.
+    source_variable = source_dataset.variables[variable_name]
+    aggregated = aggregate_clipping_info(clipping_info, factor, FixedGrid.from_dataset(source_dataset))
+    indexes = source_indexes(aggregated)
+    window = slice(indexes.row_min, indexes.row_max), slice(indexes.col_min, indexes.col_max)
+    data = source_variable[window]
+    dqf = None
+    if quality is not None:
+        if quality.mask:
+            data = np.ma.masked_where(quality.invalid(source_dataset.variables[quality.dqf_variable_name][window]),
+                                      data, copy=False)
+    elif dqf_variable_name is not None:
+        dqf = source_dataset.variables[dqf_variable_name][window]
+    data = aggregate_blocks(data, factor, method, dqf, max_dqf)
+    return aggregated, data
+
+
 def get_spatial_resolution(dataset: netCDF4.Dataset) -> float:
     return float(dataset.spatial_resolution[:dataset.spatial_resolution.find("km")])
 
 
-def _write_clipping_to_any_dataset(dataset: netCDF4.Dataset, dscd: DatasetClippingInfo):
+def _write_clipping_to_any_dataset(dataset: netCDF4.Dataset, dscd: DatasetClippingInfo,
+                                   profile: OutputProfile = None):
+    profile = profile if profile is not None else _output_profile
     copy_variable(dscd.goes_imager_projection, dataset)
     dataset.col_min = np.short(dscd.indexes.col_min)
     dataset.col_max = np.short(dscd.indexes.col_max)
     dataset.row_min = np.short(dscd.indexes.row_min)
     dataset.row_max = np.short(dscd.indexes.row_max)
+    if dscd.aggregation_factor != 1:
+        # The indexes are of the grid with this many source pixels per side
+        dataset.aggregation_factor = np.short(dscd.aggregation_factor)
 
     dataset.geospatial_lat_min = dscd.region.lat_south
     dataset.geospatial_lat_max = dscd.region.lat_north
@@ -220,7 +838,8 @@ def _write_clipping_to_any_dataset(dataset: netCDF4.Dataset, dscd: DatasetClippi
     dataset.createDimension('cropped_x', x_dim)
 
     # create x
-    new_x = dataset.createVariable('x', dscd.x.dtype, ('cropped_x',), zlib=True)
+    # x and y are compressed with any profile, as they always were
+    new_x = dataset.createVariable('x', dscd.x.dtype, ('cropped_x',), zlib=True, complevel=profile.complevel)
     new_x.standard_name = 'projection_x_coordinate'
     new_x.long_name = 'GOES fixed grid projection x-coordinate'
     new_x.comments = 'Vector x of the cropping area'
@@ -229,7 +848,7 @@ def _write_clipping_to_any_dataset(dataset: netCDF4.Dataset, dscd: DatasetClippi
     new_x[:] = dscd.x[:]
 
     # create y
-    new_y = dataset.createVariable('y', dscd.y.dtype, ('cropped_y',), zlib=True)
+    new_y = dataset.createVariable('y', dscd.y.dtype, ('cropped_y',), zlib=True, complevel=profile.complevel)
     new_y.standard_name = 'projection_y_coordinate'
     new_y.long_name = 'GOES fixed grid projection y-coordinate'
     new_y.comments = 'Vector y of the cropping area'
@@ -270,34 +889,185 @@ def write_clipping_to_info_dataset(dataset: netCDF4.Dataset, dscd: DatasetClippi
     new_lons[:,:] = dscd.lons[:,:]
 
 
-def write_clipping_to_dataset(dataset: netCDF4.Dataset, dscd: DatasetClippingInfo):
-    _write_clipping_to_any_dataset(dataset, dscd)
+def write_clipping_to_dataset(dataset: netCDF4.Dataset, dscd: DatasetClippingInfo, profile: OutputProfile = None):
+    _write_clipping_to_any_dataset(dataset, dscd, profile)
 
 
 def fill_clipped_variable_from_source(clipped_dataset: netCDF4.Dataset,
                                       source_dataset: netCDF4.Dataset,
                                       comments: str,
-                                      variable_name: str="CMI"):
+                                      variable_name: str="CMI",
+                                      data=None,
+                                      clipped_variable_name: str = None,
+                                      profile: OutputProfile = None,
+                                      quality: QualityRules = None):
+    # data is the already clipped variable, as returned by clip_regions or clip_variables.
+    # clipped_variable_name renames it, CMI_C13 of a multi band file as CMI for example.
+    # With quality and without data, the DQF of the window is read with it (clip_with_quality),
+    # with data the DQF of the window masks it (mask_with_quality). The quality of an aggregated
+    # clipping is the one given to clip_aggregated.
+    profile = profile if profile is not None else _output_profile
     source_variable = source_dataset.variables[variable_name]
-    cmi = clipped_dataset.createVariable(variable_name, source_variable.datatype, ('cropped_y', 'cropped_x'))
+    flags = None
+    aggregated = 'aggregation_factor' in clipped_dataset.ncattrs()
+    if data is None and aggregated:
+        raise ValueError('An aggregated clipping needs its data, as returned by clip_aggregated')
+    if quality is not None and aggregated:
+        raise ValueError('The quality of an aggregated clipping is applied by clip_aggregated')
+    indexes = RegionIndexes(col_min=int(clipped_dataset.col_min), col_max=int(clipped_dataset.col_max),
+                            row_min=int(clipped_dataset.row_min), row_max=int(clipped_dataset.row_max))
+    if data is None:
+        if quality is not None:
+            data, flags = clip_with_quality(source_dataset, indexes, quality, variable_name)
+        else:
+            data = source_variable[indexes.row_min:indexes.row_max, indexes.col_min:indexes.col_max]
+    elif quality is not None:
+        data, flags = mask_with_quality(source_dataset, indexes, quality, data)
     cmi_attr = {k: source_variable.getncattr(k) for k in source_variable.ncattrs() if k[0] != '_'}
     cmi_attr['comments'] = comments
+    datatype = source_variable.datatype
+    fill_value = None
+    if profile.pack and 'scale_factor' not in cmi_attr and np.dtype(datatype).kind == 'f':
+        datatype = np.dtype(profile.pack_datatype)
+        cmi_attr['scale_factor'], cmi_attr['add_offset'], fill_value = packing(data, datatype)
+        # NaN as masked, and nothing under the mask to cast
+        data = np.ma.masked_invalid(data)
+        data = np.ma.masked_array(data.filled(cmi_attr['add_offset']), mask=np.ma.getmaskarray(data))
+        cmi_attr.pop('valid_range', None)
+    variable_name = clipped_variable_name if clipped_variable_name is not None else variable_name
+    cmi = clipped_dataset.createVariable(variable_name, datatype, ('cropped_y', 'cropped_x'), fill_value=fill_value,
+                                         **profile.variable_kwargs(np.shape(data)))
     cmi.setncatts(cmi_attr)
 
     clipped_dataset.time_coverage_start = source_dataset.time_coverage_start
     clipped_dataset.time_coverage_end = source_dataset.time_coverage_end
     copy_variable(source_dataset.variables['goes_imager_projection'], clipped_dataset)
 
-    clipped_dataset.variables[variable_name][:, :] = source_variable[
-                                             clipped_dataset.row_min:clipped_dataset.row_max,
-                                             clipped_dataset.col_min:clipped_dataset.col_max]
+    clipped_dataset.variables[variable_name][:, :] = data
+    if flags is not None and quality.quality_layer:
+        write_quality_layer(clipped_dataset, source_dataset, flags, quality, profile)
+
+
+def clip_variables(source_dataset: netCDF4.Dataset, indexes: RegionIndexes,
+                   variable_names: List[str]) -> Dict[str, np.ndarray]:
+    # The window of several variables of the same grid, the bands of a multi band file
+    return {
+        name: source_dataset.variables[name][indexes.row_min:indexes.row_max, indexes.col_min:indexes.col_max]
+        for name in variable_names
+    }
+
+
+def fill_clipped_variables_from_source(clipped_dataset: netCDF4.Dataset,
+                                       source_dataset: netCDF4.Dataset,
+                                       comments: Dict[str, str],
+                                       data: Dict[str, np.ndarray],
+                                       clipped_variable_names: Dict[str, str] = None,
+                                       profile: OutputProfile = None):
+    # data as returned by clip_variables, comments and new names by source variable name
+    clipped_variable_names = clipped_variable_names if clipped_variable_names is not None else {}
+    for variable_name, variable_data in data.items():
+        fill_clipped_variable_from_source(clipped_dataset, source_dataset, comments[variable_name],
+                                          variable_name=variable_name, data=variable_data,
+                                          clipped_variable_name=clipped_variable_names.get(variable_name),
+                                          profile=profile)
+
+
+def _row_blocks(variable, row_min: int, row_max: int):
+    # Row ranges aligned to the chunks of the variable, each chunk row is decompressed once
+    chunking = variable.chunking()
+    chunk_rows = chunking[-2] if isinstance(chunking, list) else TILE_ROWS
+    start = row_min
+    while start < row_max:
+        stop = min(row_max, (start // chunk_rows + 1) * chunk_rows)
+        yield start, stop
+        start = stop
+
+
+def clip_with_quality(source_dataset: netCDF4.Dataset, indexes: RegionIndexes, rules: QualityRules,
+                      variable_name: str = 'CMI') -> Tuple[np.ma.MaskedArray, np.ndarray]:
+    # The window of the variable, masked by the rules, and its quality flags (QUALITY_FILL_FLAG
+    # where there are none). Both variables are read together by chunk rows: netCDF4 decompresses
+    # each variable on its own, so this keeps the chunks of both in cache without reading any twice.
+    variable = source_dataset.variables[variable_name]
+    dqf_variable = source_dataset.variables[rules.dqf_variable_name]
+    shape = (indexes.row_max - indexes.row_min, indexes.col_max - indexes.col_min)
+    data = None
+    flags = np.empty(shape, dtype=np.uint8)
+    for start, stop in _row_blocks(variable, indexes.row_min, indexes.row_max):
+        block = variable[start:stop, indexes.col_min:indexes.col_max]
+        dqf = dqf_variable[start:stop, indexes.col_min:indexes.col_max]
+        if rules.mask:
+            block = np.ma.masked_where(rules.invalid(dqf), block, copy=False)
+        if data is None:
+            data = np.ma.masked_all(shape, dtype=block.dtype)
+        rows = slice(start - indexes.row_min, stop - indexes.row_min)
+        data[rows] = block
+        flags[rows] = np.ma.filled(dqf, QUALITY_FILL_FLAG)
+    return data, flags
+
+
+def mask_with_quality(source_dataset: netCDF4.Dataset, indexes: RegionIndexes, rules: QualityRules,
+                      data) -> Tuple[np.ma.MaskedArray, np.ndarray]:
+    # The same as clip_with_quality for a window already read, by clip_regions or clip_variables
+    shape = (indexes.row_max - indexes.row_min, indexes.col_max - indexes.col_min)
+    if np.shape(data) != shape:
+        raise ValueError(f'Expected the data of the window {shape}, not {np.shape(data)}')
+    dqf = source_dataset.variables[rules.dqf_variable_name][indexes.row_min:indexes.row_max,
+                                                             indexes.col_min:indexes.col_max]
+    if rules.mask:
+        data = np.ma.masked_where(rules.invalid(dqf), data)
+    return data, np.ma.filled(dqf, QUALITY_FILL_FLAG).astype(np.uint8)
+
+
+def pack_quality(flags) -> np.ndarray:
+    # 2 bits per flag, 4 per byte: the flag of column j in bits 2 * (j % 4). The flags that
+    # do not fit, 4 of the CMI DQF for example, are QUALITY_REJECTED_FLAG.
+    flags = np.minimum(np.asarray(flags, dtype=np.uint8), QUALITY_REJECTED_FLAG)
+    columns = -(-flags.shape[1] // 4) * 4
+    padded = np.zeros((flags.shape[0], columns), dtype=np.uint8)
+    padded[:, :flags.shape[1]] = flags
+    return padded[:, 0::4] | (padded[:, 1::4] << 2) | (padded[:, 2::4] << 4) | (padded[:, 3::4] << 6)
+
+
+def unpack_quality(packed, columns: int) -> np.ndarray:
+    packed = np.asarray(packed, dtype=np.uint8)
+    flags = np.empty((packed.shape[0], packed.shape[1] * 4), dtype=np.uint8)
+    for k in range(4):
+        flags[:, k::4] = (packed >> (2 * k)) & 3
+    return flags[:, :columns]
+
+
+def write_quality_layer(clipped_dataset: netCDF4.Dataset, source_dataset: netCDF4.Dataset, flags,
+                        rules: QualityRules, profile: OutputProfile = None):
+    profile = profile if profile is not None else _output_profile
+    packed = pack_quality(flags)
+    if 'cropped_x_quality' not in clipped_dataset.dimensions:
+        clipped_dataset.createDimension('cropped_x_quality', packed.shape[1])
+    layer = clipped_dataset.createVariable(QUALITY_LAYER_NAME, 'u1', ('cropped_y', 'cropped_x_quality'),
+                                           **profile.variable_kwargs(packed.shape))
+    source_dqf = source_dataset.variables[rules.dqf_variable_name]
+    if 'long_name' in source_dqf.ncattrs():
+        layer.long_name = source_dqf.long_name
+    # The flags of the layer, not the ones of the source: the ones over 2 are rejected
+    meanings = {}
+    if 'flag_values' in source_dqf.ncattrs() and 'flag_meanings' in source_dqf.ncattrs():
+        meanings = dict(zip(np.atleast_1d(source_dqf.flag_values).tolist(), source_dqf.flag_meanings.split()))
+    layer.flag_values = np.arange(QUALITY_REJECTED_FLAG + 1, dtype=np.uint8)
+    layer.flag_meanings = ' '.join([meanings.get(flag, f'flag_{flag}') for flag in range(QUALITY_REJECTED_FLAG)] +
+                                   [QUALITY_REJECTED_MEANING])
+    rejected = [meanings[flag] for flag in sorted(meanings) if flag >= QUALITY_REJECTED_FLAG]
+    layer.comments = f'{rules.dqf_variable_name} of the cropping area packed 2 bits per pixel, ' \
+                     f'the flag of column j is in bits 2 * (j % 4) of byte j // 4, ' \
+                     f'{QUALITY_REJECTED_FLAG} ({QUALITY_REJECTED_MEANING}) for ' \
+                     f'{", ".join(rejected + ["no flag"])}'
+    layer[:, :] = packed
 
 
 def copy_variable(variable, dest_dataset):
     if not variable.name in dest_dataset.variables:
         dest_dataset.createVariable(variable.name, variable.datatype, variable.dimensions)
     dest_dataset[variable.name][:] = variable[:]
-    dest_dataset[variable.name].setncatts(variable.__dict__)
+    dest_dataset[variable.name].setncatts({k: variable.getncattr(k) for k in variable.ncattrs()})
 
 
 def nearest_indexes(lat, lon, lats, lons, major_order):
@@ -335,6 +1105,31 @@ def find_indexes(region: LatLonRegion, lats, lons, major_order) -> RegionIndexes
     return indexes
 
 
+def find_points_indexes(grid: FixedGrid, lats, lons) -> RegionIndexes:
+    # Same convention as find_indexes: the max are the nearest pixels to the extreme points.
+    # Points not seen from the satellite are ignored.
+    rows, cols, visible = grid.rows_cols(lats, lons)
+    if not np.any(visible):
+        raise ValueError('None of the points is on the satellite disk')
+    rows = np.clip(np.rint(rows[visible]), 0, grid.rows - 1)
+    cols = np.clip(np.rint(cols[visible]), 0, grid.columns - 1)
+    return RegionIndexes(
+        col_min=int(cols.min()),
+        col_max=int(cols.max()),
+        row_min=int(rows.min()),
+        row_max=int(rows.max()))
+
+
+def find_region_indexes(grid: FixedGrid, region: LatLonRegion, samples: int = REGION_EDGE_SAMPLES) -> RegionIndexes:
+    # Parallels and meridians are curves on the fixed grid, the whole border is sampled
+    t = np.linspace(0, 1, samples)
+    along_lon = region.lon_west + t * (region.lon_east - region.lon_west)
+    along_lat = region.lat_south + t * (region.lat_north - region.lat_south)
+    lats = np.concatenate([np.full(samples, region.lat_north), np.full(samples, region.lat_south), along_lat, along_lat])
+    lons = np.concatenate([along_lon, along_lon, np.full(samples, region.lon_west), np.full(samples, region.lon_east)])
+    return find_points_indexes(grid, lats, lons)
+
+
 def get_projection(dataset: netCDF4.Dataset) -> pyproj.Proj:
     imager_projection = dataset.variables['goes_imager_projection']
     sat_height = imager_projection.perspective_point_height
@@ -357,16 +1152,16 @@ def get_crs_projection(dataset: netCDF4.Dataset):
         sweep_axis=sat_sweep)
 
 
-def get_lats_lons_x_y(dataset, indexes: RegionIndexes = None):
+def get_lats_lons_x_y(dataset, indexes: RegionIndexes = None, dtype=np.float64, tile_rows: int = TILE_ROWS,
+                      executor: concurrent.futures.Executor = None, prefetch: int = PREFETCH_TILES):
+    # Off disk pixels are inf, as pyproj leaves them
     if indexes is None:
         source_x = dataset['x'][:]
         source_y = dataset['y'][:]
     else:
         source_x = dataset['x'][indexes.col_min: indexes.col_max]
         source_y = dataset['y'][indexes.row_min: indexes.row_max]
-    x = source_x * sat_height
-    y = source_y * sat_height
-    XX, YY = np.meshgrid(np.array(x), np.array(y))
-    projection = get_projection(dataset)
-    lons, lats = projection(XX, YY, inverse=True)
-    return np.array(lats), np.array(lons), source_x, source_y
+    lats = np.empty((len(source_y), len(source_x)), dtype=dtype)
+    lons = np.empty((len(source_y), len(source_x)), dtype=dtype)
+    compute_lats_lons(FixedGrid.from_dataset(dataset), lats, lons, indexes, tile_rows, np.inf, executor, prefetch)
+    return lats, lons, source_x, source_y
@@ -0,0 +1,222 @@
+import collections
+import concurrent.futures
+import dataclasses
+from dataclasses import dataclass
+from typing import Iterator, Tuple
+
+import netCDF4
+import numpy as np
+
+# GOES-R Product Definition and User's Guide (PUG) volume 3, section 5.1.2.8
+
+# Rows per tile, a 0.5 km full disk tile takes about 100 MB of float64 temporaries
+TILE_ROWS = 256
+# Tiles submitted to an executor and not yet consumed, what bounds the memory in use
+PREFETCH_TILES = 8
+
+# GOES-R imager projection, the same for every satellite of the series
+GOES_R_SAT_HEIGHT = 35786023.0
+GOES_R_SEMI_MAJOR_AXIS = 6378137.0
+GOES_R_SEMI_MINOR_AXIS = 6356752.31414
+GOES_R_INVERSE_FLATTENING = 298.2572221
+
+# Full disk grids by spatial resolution: size, scale factor and add offset of x (y has the
+# opposite scale and offset), as float32 in the files
+FULL_DISK_GRIDS = {
+    '0.5km': (21696, 1.4e-05, -0.151865),
+    '1km': (10848, 2.8e-05, -0.151858),
+    '2km': (5424, 5.6e-05, -0.151844),
+}
+BAND_RESOLUTIONS = {1: '1km', 2: '0.5km', 3: '1km', 5: '1km'}
+DEFAULT_RESOLUTION = '2km'
+
+
+@dataclass(frozen=True)
+class FixedGrid:
+    """GOES-R ABI fixed grid: scan angle x = x_offset + x_scale * col and
+    y = y_offset + y_scale * row, in radians, seen from a satellite at
+    sat_height meters over sat_lon degrees east."""
+    sat_lon: float
+    sat_height: float
+    semi_major_axis: float
+    semi_minor_axis: float
+    x_offset: float
+    x_scale: float
+    y_offset: float
+    y_scale: float
+    columns: int
+    rows: int
+
+    @staticmethod
+    def from_dataset(dataset: netCDF4.Dataset) -> 'FixedGrid':
+        # Only the first and last x and y are read
+        imager_projection = dataset.variables['goes_imager_projection']
+        if imager_projection.sweep_angle_axis != 'x':
+            raise ValueError(f'Unsupported sweep angle axis {imager_projection.sweep_angle_axis}')
+        x_offset, x_scale, columns = _axis(dataset.variables['x'])
+        y_offset, y_scale, rows = _axis(dataset.variables['y'])
+        return FixedGrid(
+            sat_lon=float(imager_projection.longitude_of_projection_origin),
+            sat_height=float(imager_projection.perspective_point_height),
+            semi_major_axis=float(imager_projection.semi_major_axis),
+            semi_minor_axis=float(imager_projection.semi_minor_axis),
+            x_offset=x_offset,
+            x_scale=x_scale,
+            y_offset=y_offset,
+            y_scale=y_scale,
+            columns=columns,
+            rows=rows)
+
+    @property
+    def orbit_radius(self) -> float:
+        return self.sat_height + self.semi_major_axis
+
+    def scan_angles(self, lats, lons) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # x, y and whether the satellite sees the point
+        r_eq, r_pol, h = self.semi_major_axis, self.semi_minor_axis, self.orbit_radius
+        lats = np.radians(np.asarray(lats, dtype=np.float64))
+        lons = np.radians(np.asarray(lons, dtype=np.float64))
+        e2 = (r_eq ** 2 - r_pol ** 2) / r_eq ** 2
+        phi_c = np.arctan(r_pol ** 2 / r_eq ** 2 * np.tan(lats))
+        r_c = r_pol / np.sqrt(1 - e2 * np.cos(phi_c) ** 2)
+        s_x = h - r_c * np.cos(phi_c) * np.cos(lons - np.radians(self.sat_lon))
+        s_y = -r_c * np.cos(phi_c) * np.sin(lons - np.radians(self.sat_lon))
+        s_z = r_c * np.sin(phi_c)
+        visible = h * (h - s_x) >= s_y ** 2 + r_eq ** 2 / r_pol ** 2 * s_z ** 2
+        x = np.arcsin(-s_y / np.sqrt(s_x ** 2 + s_y ** 2 + s_z ** 2))
+        y = np.arctan(s_z / s_x)
+        return x, y, visible
+
+    def lats_lons(self, x, y) -> Tuple[np.ndarray, np.ndarray]:
+        # NaN where the scan angles miss the Earth
+        r_eq, r_pol, h = self.semi_major_axis, self.semi_minor_axis, self.orbit_radius
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        a = np.sin(x) ** 2 + np.cos(x) ** 2 * (np.cos(y) ** 2 + r_eq ** 2 / r_pol ** 2 * np.sin(y) ** 2)
+        b = -2 * h * np.cos(x) * np.cos(y)
+        c = h ** 2 - r_eq ** 2
+        with np.errstate(invalid='ignore'):
+            r_s = (-b - np.sqrt(b ** 2 - 4 * a * c)) / (2 * a)
+        s_x = r_s * np.cos(x) * np.cos(y)
+        s_y = -r_s * np.sin(x)
+        s_z = r_s * np.cos(x) * np.sin(y)
+        lats = np.degrees(np.arctan(r_eq ** 2 / r_pol ** 2 * s_z / np.sqrt((h - s_x) ** 2 + s_y ** 2)))
+        lons = self.sat_lon - np.degrees(np.arctan(s_y / (h - s_x)))
+        return lats, lons
+
+    def x(self, cols) -> np.ndarray:
+        return self.x_offset + self.x_scale * np.asarray(cols, dtype=np.float64)
+
+    def y(self, rows) -> np.ndarray:
+        return self.y_offset + self.y_scale * np.asarray(rows, dtype=np.float64)
+
+    def window(self, indexes) -> 'FixedGrid':
+        # The grid of a clipped window, indexes is a RegionIndexes
+        return dataclasses.replace(
+            self,
+            x_offset=self.x_offset + self.x_scale * indexes.col_min,
+            y_offset=self.y_offset + self.y_scale * indexes.row_min,
+            columns=indexes.col_max - indexes.col_min,
+            rows=indexes.row_max - indexes.row_min)
+
+    def rows_cols(self, lats, lons) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Fractional row and column of each point and whether it is on the disk
+        x, y, visible = self.scan_angles(lats, lons)
+        return (y - self.y_offset) / self.y_scale, (x - self.x_offset) / self.x_scale, visible
+
+
+def band_resolution(band: int) -> str:
+    return BAND_RESOLUTIONS.get(int(band), DEFAULT_RESOLUTION)
+
+
+def full_disk_grid(sat_lon: float, resolution: str) -> FixedGrid:
+    # The grid of a full disk file without reading one
+    if resolution not in FULL_DISK_GRIDS:
+        raise ValueError(f'Unknown full disk resolution {resolution}')
+    size, scale, offset = FULL_DISK_GRIDS[resolution]
+    scale, offset = float(np.float32(scale)), float(np.float32(offset))
+    return FixedGrid(
+        sat_lon=float(sat_lon),
+        sat_height=GOES_R_SAT_HEIGHT,
+        semi_major_axis=GOES_R_SEMI_MAJOR_AXIS,
+        semi_minor_axis=GOES_R_SEMI_MINOR_AXIS,
+        x_offset=offset,
+        x_scale=scale,
+        y_offset=-offset,
+        y_scale=-scale,
+        columns=size,
+        rows=size)
+
+
+def _axis(variable: netCDF4.Variable) -> Tuple[float, float, int]:
+    size = len(variable)
+    first = float(variable[0])
+    if hasattr(variable, 'scale_factor') and hasattr(variable, 'add_offset'):
+        # Packed, as in the original files: exact from the attributes, the unpacked
+        # values are rounded to float32
+        scale, offset = float(variable.scale_factor), float(variable.add_offset)
+        return offset + scale * round((first - offset) / scale), scale, size
+    if size > 1:
+        return first, (float(variable[size - 1]) - first) / (size - 1), size
+    return first, float(variable.scale_factor), size
+
+
+def _window(grid: FixedGrid, indexes) -> Tuple[int, int, int, int]:
+    # indexes is a RegionIndexes, the whole grid when None
+    if indexes is None:
+        return 0, grid.rows, 0, grid.columns
+    return indexes.row_min, indexes.row_max, indexes.col_min, indexes.col_max
+
+
+def lats_lons_tile(grid: FixedGrid, row_start: int, row_stop: int, col_min: int, col_max: int,
+                   dtype=np.float32, off_disk: float = np.nan) -> Tuple[np.ndarray, np.ndarray]:
+    x = grid.x(np.arange(col_min, col_max))
+    y = grid.y(np.arange(row_start, row_stop))
+    lats, lons = grid.lats_lons(x[np.newaxis, :], y[:, np.newaxis])
+    lats, lons = lats.astype(dtype, copy=False), lons.astype(dtype, copy=False)
+    if not np.isnan(off_disk):
+        lats[np.isnan(lats)] = off_disk
+        lons[np.isnan(lons)] = off_disk
+    return lats, lons
+
+
+def iter_lats_lons_tiles(grid: FixedGrid, indexes=None, tile_rows: int = TILE_ROWS, dtype=np.float32,
+                         off_disk: float = np.nan,
+                         executor: concurrent.futures.Executor = None,
+                         prefetch: int = PREFETCH_TILES) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    # (first row of the tile relative to the window, lats, lons), in row order. With an executor
+    # at most prefetch tiles are pending, so memory does not grow with the grid size; about two
+    # per worker keeps them all busy.
+    row_min, row_max, col_min, col_max = _window(grid, indexes)
+    starts = range(row_min, row_max, tile_rows)
+    if executor is None:
+        for start in starts:
+            yield (start - row_min, *lats_lons_tile(grid, start, min(start + tile_rows, row_max), col_min, col_max,
+                                                    dtype, off_disk))
+        return
+    window = max(prefetch, 1)
+    pending = collections.deque()
+    try:
+        for start in starts:
+            pending.append((start, executor.submit(lats_lons_tile, grid, start, min(start + tile_rows, row_max),
+                                                   col_min, col_max, dtype, off_disk)))
+            if len(pending) >= window:
+                start, future = pending.popleft()
+                yield (start - row_min, *future.result())
+        while pending:
+            start, future = pending.popleft()
+            yield (start - row_min, *future.result())
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def compute_lats_lons(grid: FixedGrid, lats_out, lons_out, indexes=None, tile_rows: int = TILE_ROWS,
+                      off_disk: float = np.nan, executor: concurrent.futures.Executor = None,
+                      prefetch: int = PREFETCH_TILES):
+    # lats_out and lons_out are anything sliceable with the window shape: numpy arrays, np.memmap
+    # or netCDF4 variables. Tiles are computed in their dtype and written as they are ready.
+    dtype = getattr(lats_out, 'dtype', np.float32)
+    for row, lats, lons in iter_lats_lons_tiles(grid, indexes, tile_rows, dtype, off_disk, executor, prefetch):
+        lats_out[row:row + lats.shape[0], :] = lats
+        lons_out[row:row + lons.shape[0], :] = lons
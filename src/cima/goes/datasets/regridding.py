@@ -0,0 +1,181 @@
+import hashlib
+import math
+import multiprocessing
+import os
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import netCDF4
+import numpy as np
+import scipy.sparse
+
+from .clipping import LatLonRegion, get_clipping_info_directory, write_atomically
+from .fixed_grid import FixedGrid, iter_lats_lons_tiles
+
+NEAREST = 'nearest'
+BILINEAR = 'bilinear'
+# The mean of the pixels with their center in each cell, not weighted by the overlap
+CELL_MEAN = 'cell_mean'
+REGRIDDING_METHODS = (NEAREST, BILINEAR, CELL_MEAN)
+
+_regridders_lock = multiprocessing.Lock()
+
+
+@dataclass(frozen=True)
+class LatLonGrid:
+    """Regular lat/lon grid of cell centers, from south to north and from west to east."""
+    lat_south: float
+    lon_west: float
+    resolution: float
+    lat_count: int
+    lon_count: int
+
+    @staticmethod
+    def from_region(region: LatLonRegion, resolution: float) -> 'LatLonGrid':
+        return LatLonGrid(
+            lat_south=region.lat_south,
+            lon_west=region.lon_west,
+            resolution=resolution,
+            lat_count=int(math.ceil((region.lat_north - region.lat_south) / resolution - 1e-9)),
+            lon_count=int(math.ceil((region.lon_east - region.lon_west) / resolution - 1e-9)))
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.lat_count, self.lon_count
+
+    @property
+    def lats(self) -> np.ndarray:
+        return self.lat_south + self.resolution * (np.arange(self.lat_count) + 0.5)
+
+    @property
+    def lons(self) -> np.ndarray:
+        return self.lon_west + self.resolution * (np.arange(self.lon_count) + 0.5)
+
+
+class Regridder(object):
+    """Sparse weights from a fixed grid window to a lat/lon grid. Masked and NaN
+    pixels are left out and the weights of the rest normalized, target cells
+    without any weight are masked."""
+    def __init__(self, weights: scipy.sparse.csr_matrix, source_shape: Tuple[int, int], target: LatLonGrid):
+        self.weights = weights.tocsr()
+        self.source_shape = tuple(source_shape)
+        self.target = target
+        self._weight_sums = np.asarray(self.weights.sum(axis=1)).ravel()
+
+    def regrid(self, data) -> np.ma.MaskedArray:
+        # data is a frame or a stack of frames (..., rows, columns), all of them regridded
+        # with one product of the weights and the (pixels, frames) matrix
+        if np.shape(data)[-2:] != self.source_shape:
+            raise ValueError(f'Expected frames of {self.source_shape}, not {np.shape(data)[-2:]}')
+        batch_shape = np.shape(data)[:-2]
+        size = self.source_shape[0] * self.source_shape[1]
+        values = np.ma.getdata(data).reshape(-1, size)
+        mask = np.ma.getmaskarray(data).reshape(-1, size)
+        if values.dtype.kind == 'f':
+            mask = mask | ~np.isfinite(values)
+        if mask.any():
+            result = (self.weights @ np.where(mask, 0, values).T.astype(np.float64)).T
+            weight_sums = (self.weights @ (~mask).T.astype(np.float64)).T
+        else:
+            result = (self.weights @ values.T.astype(np.float64)).T
+            weight_sums = np.broadcast_to(self._weight_sums, result.shape)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = result / weight_sums
+        result = np.ma.masked_array(result, mask=weight_sums <= 0)
+        return result.reshape(batch_shape + self.target.shape)
+
+
+def regridding_fingerprint(grid: FixedGrid, target: LatLonGrid, method: str) -> str:
+    values = [grid.sat_lon, grid.sat_height, grid.semi_major_axis, grid.semi_minor_axis,
+              grid.x_offset, grid.x_scale, grid.y_offset, grid.y_scale, grid.columns, grid.rows,
+              target.lat_south, target.lon_west, target.resolution, target.lat_count, target.lon_count]
+    text = method + ' ' + ' '.join(f'{float(v):.9g}' for v in values)
+    return hashlib.sha1(text.encode('ascii')).hexdigest()[:16]
+
+
+def regridding_weights(grid: FixedGrid, target: LatLonGrid, method: str = BILINEAR) -> scipy.sparse.csr_matrix:
+    # A (target cells, grid pixels) matrix, grid is the fixed grid of the data to regrid
+    if method == NEAREST:
+        return _point_weights(grid, target, bilinear=False)
+    if method == BILINEAR:
+        return _point_weights(grid, target, bilinear=True)
+    if method == CELL_MEAN:
+        return _cell_mean_weights(grid, target)
+    raise ValueError(f'Unknown regridding method {method}, use one of {REGRIDDING_METHODS}')
+
+
+def _point_weights(grid: FixedGrid, target: LatLonGrid, bilinear: bool) -> scipy.sparse.csr_matrix:
+    # The fixed grid position of every cell center, by the inverse projection
+    lats, lons = np.meshgrid(target.lats, target.lons, indexing='ij')
+    rows, cols, visible = grid.rows_cols(lats.ravel(), lons.ravel())
+    cells = np.arange(rows.size)
+    if bilinear:
+        row0, col0 = np.floor(rows), np.floor(cols)
+        row_fraction, col_fraction = rows - row0, cols - col0
+        neighbours = [
+            (row0, col0, (1 - row_fraction) * (1 - col_fraction)),
+            (row0, col0 + 1, (1 - row_fraction) * col_fraction),
+            (row0 + 1, col0, row_fraction * (1 - col_fraction)),
+            (row0 + 1, col0 + 1, row_fraction * col_fraction),
+        ]
+    else:
+        neighbours = [(np.rint(rows), np.rint(cols), np.ones(rows.size))]
+    all_cells, all_pixels, all_weights = [], [], []
+    for row, col, weight in neighbours:
+        inside = visible & (row >= 0) & (row < grid.rows) & (col >= 0) & (col < grid.columns) & (weight > 0)
+        all_cells.append(cells[inside])
+        all_pixels.append(row[inside].astype(np.int64) * grid.columns + col[inside].astype(np.int64))
+        all_weights.append(weight[inside])
+    return scipy.sparse.csr_matrix(
+        (np.concatenate(all_weights), (np.concatenate(all_cells), np.concatenate(all_pixels))),
+        shape=(rows.size, grid.rows * grid.columns))
+
+
+def _cell_mean_weights(grid: FixedGrid, target: LatLonGrid) -> scipy.sparse.csr_matrix:
+    # The mean of the pixels with their center in each cell, for cells larger than the pixels.
+    # A pixel is all in the cell of its center, its overlap with the neighbours is not weighted.
+    all_cells, all_pixels = [], []
+    for row_start, lats, lons in iter_lats_lons_tiles(grid, dtype=np.float64):
+        lat_index = np.floor((lats - target.lat_south) / target.resolution)
+        lon_index = np.floor((lons - target.lon_west) / target.resolution)
+        inside = (lat_index >= 0) & (lat_index < target.lat_count) & (lon_index >= 0) & (lon_index < target.lon_count)
+        all_cells.append(lat_index[inside].astype(np.int64) * target.lon_count + lon_index[inside].astype(np.int64))
+        tile_rows, tile_cols = np.nonzero(inside)
+        all_pixels.append((tile_rows + row_start) * grid.columns + tile_cols)
+    cells = np.concatenate(all_cells)
+    pixels = np.concatenate(all_pixels)
+    counts = np.bincount(cells, minlength=target.lat_count * target.lon_count)
+    return scipy.sparse.csr_matrix(
+        (1.0 / counts[cells], (cells, pixels)),
+        shape=(target.lat_count * target.lon_count, grid.rows * grid.columns))
+
+
+_regridders: Dict[str, Regridder] = {}
+
+
+def get_regridder(grid: FixedGrid, target: LatLonGrid, method: str = BILINEAR) -> Regridder:
+    # Computed once per grid, target and method, and kept in the clipping info directory when it is set
+    key = regridding_fingerprint(grid, target, method)
+    with _regridders_lock:
+        regridder = _regridders.get(key)
+        if regridder is None:
+            regridder = Regridder(_get_weights(grid, target, method, key), (grid.rows, grid.columns), target)
+            _regridders[key] = regridder
+        return regridder
+
+
+def get_dataset_regridder(dataset: netCDF4.Dataset, target: LatLonGrid, method: str = BILINEAR) -> Regridder:
+    # For a GOES file or a clipped one, from its x and y
+    return get_regridder(FixedGrid.from_dataset(dataset), target, method)
+
+
+def _get_weights(grid: FixedGrid, target: LatLonGrid, method: str, key: str) -> scipy.sparse.csr_matrix:
+    directory = get_clipping_info_directory()
+    if directory is None:
+        return regridding_weights(grid, target, method)
+    filename = os.path.join(directory, f'regrid-{method}-{key}.npz')
+    if not os.path.exists(filename):
+        weights = regridding_weights(grid, target, method)
+        write_atomically(filename, lambda temp_filename: scipy.sparse.save_npz(temp_filename, weights), suffix='.npz')
+        return weights
+    return scipy.sparse.load_npz(filename).tocsr()
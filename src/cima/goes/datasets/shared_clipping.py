@@ -0,0 +1,120 @@
+import dataclasses
+import glob
+import os
+import re
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple, Union
+
+import netCDF4
+import numpy as np
+
+from .clipping import DatasetClippingInfo, clipping_info_key, get_clipping_info_from_info_dataset
+from .clipping import get_clipping_info_from_grid_store
+
+
+@dataclass
+class SharedArray:
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    @staticmethod
+    def publish(array: np.ndarray) -> Tuple['SharedArray', shared_memory.SharedMemory]:
+        # Masked, lazy and memory mapped arrays are read as plain arrays
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        return SharedArray(name=block.name, shape=array.shape, dtype=array.dtype.str), block
+
+    def attach(self) -> Tuple[np.ndarray, shared_memory.SharedMemory]:
+        block = shared_memory.SharedMemory(name=self.name)
+        array = np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=block.buf)
+        array.flags.writeable = False
+        return array, block
+
+
+@dataclass
+class _SharedEntry:
+    # The info without lats and lons, those are in shared memory
+    info: DatasetClippingInfo
+    lats: SharedArray
+    lons: SharedArray
+
+
+class SharedClippingInfo(object):
+    """Clipping info loaded once by the parent process, with the lats and lons
+    grids in shared memory. Workers attach to them read only, without copies:
+    Store.process(..., initializer=share_clipping_info, initargs=(shared,)).
+    The parent must keep it open while the workers run and close it at the end."""
+    def __init__(self):
+        self.entries: Dict[str, _SharedEntry] = {}
+        self._blocks: List[shared_memory.SharedMemory] = []
+        self._attached: Dict[str, Tuple[DatasetClippingInfo, list]] = {}
+
+    def __getstate__(self):
+        return {'entries': self.entries}
+
+    def __setstate__(self, state):
+        self.entries = state['entries']
+        self._blocks = []
+        self._attached = {}
+
+    def publish(self, key: str, info: DatasetClippingInfo):
+        lats, lats_block = SharedArray.publish(info.lats)
+        self._blocks.append(lats_block)
+        lons, lons_block = SharedArray.publish(info.lons)
+        self._blocks.append(lons_block)
+        self.entries[key] = _SharedEntry(info=dataclasses.replace(info, lats=None, lons=None), lats=lats, lons=lons)
+
+    def publish_info_file(self, filename: str, name_prefix: str) -> str:
+        # A netCDF info file or a grid store
+        if filename.endswith('.grid'):
+            info = get_clipping_info_from_grid_store(filename)
+        else:
+            info_dataset = netCDF4.Dataset(filename)
+            try:
+                info = get_clipping_info_from_info_dataset(info_dataset, lazy=False)
+            finally:
+                info_dataset.close()
+        key = clipping_info_key(info.goes_imager_projection, info.spatial_resolution, name_prefix)
+        self.publish(key, info)
+        return key
+
+    def publish_info_files(self, name_prefix: str, directory: str = '.') -> List[str]:
+        # The files written by generate_info_files for that prefix, grid stores over info files.
+        # Only {prefix}-{resolution}-{N}W names, other files of the prefix (the shards of a
+        # time series for example) may be in the same directory.
+        pattern = re.compile(rf'{re.escape(name_prefix)}-[0-9.]+km-[0-9]+W\.(nc|grid)')
+        filenames = {}
+        for extension in ('.nc', '.grid'):
+            for filename in glob.glob(f'{directory}/{glob.escape(name_prefix)}-*{extension}'):
+                if pattern.fullmatch(os.path.basename(filename)):
+                    filenames[os.path.splitext(filename)[0]] = filename
+        return [self.publish_info_file(filename, name_prefix) for _, filename in sorted(filenames.items())]
+
+    def get(self, key: str) -> Union[None, DatasetClippingInfo]:
+        attached = self._attached.get(key)
+        if attached is None:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            lats, lats_block = entry.lats.attach()
+            lons, lons_block = entry.lons.attach()
+            attached = dataclasses.replace(entry.info, lats=lats, lons=lons), [lats_block, lons_block]
+            self._attached[key] = attached
+        return attached[0]
+
+    def close(self):
+        # In the parent it also frees the memory, workers only detach
+        self._attached = {}
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
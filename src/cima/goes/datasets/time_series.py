@@ -0,0 +1,391 @@
+import dataclasses
+import glob
+import math
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Tuple, Union
+
+import netCDF4
+import numpy as np
+
+from .clipping import DatasetClippingInfo, OutputProfile, write_clipping_to_dataset, get_output_profile
+
+# As the time of the GOES files, seconds since J2000
+TIME_UNITS = 'seconds since 2000-01-01 12:00:00'
+TIME_EPOCH = np.datetime64('2000-01-01T12:00:00', 'ms')
+
+SHARD_FORMATS = {'day': '%Y%m%d', 'month': '%Y%m'}
+
+# Seconds append_frame waits for its frame to be written, and between checks
+APPEND_TIMEOUT = 10 * 60
+APPEND_POLL_INTERVAL = 0.05
+# Frames already queued are written together, with one sync of the shards for all of them
+APPEND_BATCH = 16
+
+
+@dataclass
+class FrameVariable:
+    data: any
+    datatype: str
+    fill_value: any
+    attributes: dict
+
+
+@dataclass
+class TimeSeriesFrame:
+    # One clipped timestep of a series, lats and lons of the clipping info are not sent
+    name: str
+    time: np.datetime64
+    clipping_info: DatasetClippingInfo
+    variables: Dict[str, FrameVariable]
+    attributes: dict
+
+
+def coverage_time(value: str) -> np.datetime64:
+    # time_coverage_start of a GOES file, 2018-08-01T15:00:21.6Z
+    return np.datetime64(value.rstrip('Z'), 'ms')
+
+
+def time_to_seconds(times) -> np.ndarray:
+    return (np.asarray(times, dtype='datetime64[ms]') - TIME_EPOCH) / np.timedelta64(1, 's')
+
+
+def seconds_to_time(seconds) -> np.ndarray:
+    return TIME_EPOCH + np.rint(np.asarray(seconds, dtype=np.float64) * 1000).astype('timedelta64[ms]')
+
+
+def frame_from_source(name: str, source_dataset: netCDF4.Dataset, clipping_info: DatasetClippingInfo,
+                      data: Dict[str, np.ndarray] = None, variable_names: List[str] = ('CMI',)) -> TimeSeriesFrame:
+    # data is the already clipped variables, as returned by clip_variables or clip_regions
+    indexes = clipping_info.indexes
+    if data is None:
+        if clipping_info.aggregation_factor != 1:
+            raise ValueError('An aggregated clipping needs its data, as returned by clip_aggregated')
+        data = {
+            variable_name: source_dataset.variables[variable_name][
+                indexes.row_min:indexes.row_max, indexes.col_min:indexes.col_max]
+            for variable_name in variable_names
+        }
+    variables = {}
+    for variable_name, variable_data in data.items():
+        source_variable = source_dataset.variables[variable_name]
+        attributes = {k: source_variable.getncattr(k) for k in source_variable.ncattrs() if k[0] != '_'}
+        variables[variable_name] = FrameVariable(
+            data=variable_data,
+            datatype=source_variable.datatype.str,
+            fill_value=getattr(source_variable, '_FillValue', None),
+            attributes=attributes)
+    return TimeSeriesFrame(
+        name=name,
+        time=coverage_time(source_dataset.time_coverage_start),
+        clipping_info=dataclasses.replace(clipping_info, lats=None, lons=None),
+        variables=variables,
+        attributes={k: source_dataset.getncattr(k) for k in ('platform_ID', 'instrument_type', 'orbital_slot',
+                                                             'spatial_resolution', 'title')
+                    if k in source_dataset.ncattrs()})
+
+
+def get_shard_filename(directory: str, name: str, sat_lon: float, time: np.datetime64, shard: str = 'day') -> str:
+    # One file per series, satellite position and day or month
+    period = time.astype(object).strftime(SHARD_FORMATS[shard])
+    return os.path.join(directory, f'{name}-{str(abs(math.trunc(sat_lon)))}W-{period}.nc')
+
+
+def time_indexes(times, start: np.datetime64 = None, end: np.datetime64 = None) -> np.ndarray:
+    # Indexes of the times in [start, end] in time order, the frames may have been appended in any order
+    times = np.asarray(times)
+    order = np.argsort(times, kind='stable')
+    sorted_times = times[order]
+    lo = 0 if start is None else np.searchsorted(sorted_times, time_to_seconds(start), side='left')
+    hi = len(times) if end is None else np.searchsorted(sorted_times, time_to_seconds(end), side='right')
+    return order[lo:hi]
+
+
+def _check_window(dataset: netCDF4.Dataset, frame: TimeSeriesFrame, filename: str):
+    indexes = frame.clipping_info.indexes
+    if (dataset.row_min, dataset.row_max, dataset.col_min, dataset.col_max) != \
+            (indexes.row_min, indexes.row_max, indexes.col_min, indexes.col_max):
+        raise ValueError(f'{filename} has another clipping window')
+
+
+class TimeSeriesWriter(object):
+    """Appends clipped frames along an unlimited time dimension, one file per
+    series and shard. The projection, x and y are written once per file."""
+    def __init__(self, directory: str, shard: str = 'day', profile: OutputProfile = None):
+        if shard not in SHARD_FORMATS:
+            raise ValueError(f'Unknown shard {shard}, use one of {list(SHARD_FORMATS)}')
+        self.directory = directory
+        self.shard = shard
+        self.profile = profile if profile is not None else get_output_profile()
+        # The open shard of each series: filename, dataset and its sorted times
+        self._open: Dict[str, Tuple[str, netCDF4.Dataset, np.ndarray]] = {}
+
+    def append(self, frame: TimeSeriesFrame) -> bool:
+        # False when the shard already has that time, a retried task
+        sat_lon = frame.clipping_info.goes_imager_projection.longitude_of_projection_origin
+        filename = get_shard_filename(self.directory, frame.name, sat_lon, frame.time, self.shard)
+        dataset, times = self._get_shard(frame, filename)
+        seconds = float(time_to_seconds(frame.time))
+        position = np.searchsorted(times, seconds)
+        if position < len(times) and times[position] == seconds:
+            return False
+        index = len(dataset.dimensions['time'])
+        dataset.variables['time'][index] = seconds
+        for variable_name, variable in frame.variables.items():
+            dataset.variables[variable_name][index, :, :] = variable.data
+        self._open[frame.name] = filename, dataset, np.insert(times, position, seconds)
+        return True
+
+    def _get_shard(self, frame: TimeSeriesFrame, filename: str) -> Tuple[netCDF4.Dataset, np.ndarray]:
+        opened = self._open.get(frame.name)
+        if opened is not None:
+            if opened[0] == filename:
+                _check_window(opened[1], frame, filename)
+                return opened[1], opened[2]
+            opened[1].close()
+            del self._open[frame.name]
+        if os.path.exists(filename):
+            dataset = netCDF4.Dataset(filename, 'a')
+            try:
+                _check_window(dataset, frame, filename)
+            except ValueError:
+                dataset.close()
+                raise
+            times = np.sort(dataset.variables['time'][:].filled(np.nan))
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            dataset = self._create_shard(frame, filename)
+            times = np.empty(0, dtype=np.float64)
+        self._open[frame.name] = filename, dataset, times
+        return dataset, times
+
+    def _create_shard(self, frame: TimeSeriesFrame, filename: str) -> netCDF4.Dataset:
+        dataset = netCDF4.Dataset(filename, 'w', format='NETCDF4')
+        dataset.dataset_name = os.path.basename(filename)
+        dataset.setncatts(frame.attributes)
+        write_clipping_to_dataset(dataset, frame.clipping_info, self.profile)
+        dataset.createDimension('time', None)
+        time = dataset.createVariable('time', 'f8', ('time',))
+        time.standard_name = 'time'
+        time.long_name = 'start of the scan of each frame'
+        time.units = TIME_UNITS
+        time.axis = 'T'
+        # One frame per chunk, and the profile chunks within the frame
+        shape = (1, len(dataset.dimensions['cropped_y']), len(dataset.dimensions['cropped_x']))
+        kwargs = self.profile.variable_kwargs(shape)
+        if kwargs['chunksizes'] is None:
+            kwargs['chunksizes'] = shape
+        for variable_name, variable in frame.variables.items():
+            new_variable = dataset.createVariable(
+                variable_name, variable.datatype, ('time', 'cropped_y', 'cropped_x'),
+                fill_value=variable.fill_value, **kwargs)
+            new_variable.setncatts(variable.attributes)
+        return dataset
+
+    def sync(self):
+        # Flushes the frames appended to the open shards to disk
+        for _, dataset, _ in self._open.values():
+            dataset.sync()
+
+    def close(self):
+        for _, dataset, _ in self._open.values():
+            dataset.close()
+        self._open = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+
+@dataclass
+class TimeSeriesChannel:
+    # What the worker processes need to send frames to a TimeSeriesAppender and learn the result
+    queue: any
+    results: any
+    running: any
+
+
+class TimeSeriesAppender(object):
+    """The only writer of the series files, in its own process, like the
+    Store queue worker. Worker processes send it TimeSeriesFrame with
+    append_frame after share_time_series_appender(appender.channel) in the
+    pool initializer, and wait until the frame is written."""
+    def __init__(self, directory: str, shard: str = 'day', profile: OutputProfile = None):
+        self.directory = directory
+        self.shard = shard
+        self.profile = profile if profile is not None else get_output_profile()
+        self.channel = None
+        self._manager = None
+        self._process = None
+        self._monitor = None
+
+    @property
+    def queue(self):
+        return None if self.channel is None else self.channel.queue
+
+    def start(self) -> TimeSeriesChannel:
+        self._manager = multiprocessing.Manager()
+        self.channel = TimeSeriesChannel(
+            queue=self._manager.Queue(), results=self._manager.dict(), running=self._manager.Event())
+        self.channel.running.set()
+        self._process = multiprocessing.Process(
+            target=self._worker, args=(self.channel, self.directory, self.shard, self.profile))
+        self._process.start()
+        # However the writer ends, even killed, the workers waiting on it learn it is gone
+        self._monitor = threading.Thread(target=self._watch, args=(self._process, self.channel), daemon=True)
+        self._monitor.start()
+        return self.channel
+
+    @staticmethod
+    def _watch(process: multiprocessing.Process, channel: TimeSeriesChannel):
+        process.join()
+        channel.running.clear()
+
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def stop(self):
+        # Every frame already sent is written before it returns
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            self.channel.queue.put(None)
+        self._process.join()
+        self._monitor.join()
+        exitcode = self._process.exitcode
+        self._manager.shutdown()
+        self._process = None
+        self._monitor = None
+        self._manager = None
+        self.channel = None
+        if exitcode != 0:
+            raise IOError(f'The time series appender exited with code {exitcode}')
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.stop()
+
+    @staticmethod
+    def _worker(channel: TimeSeriesChannel, directory: str, shard: str, profile: OutputProfile):
+        try:
+            with TimeSeriesWriter(directory, shard=shard, profile=profile) as writer:
+                stop = False
+                while not stop:
+                    items = [channel.queue.get()]
+                    while items[-1] is not None and len(items) < APPEND_BATCH:
+                        try:
+                            items.append(channel.queue.get_nowait())
+                        except queue.Empty:
+                            break
+                    stop = items[-1] is None
+                    results = {}
+                    for key, frame in items[:-1] if stop else items:
+                        try:
+                            writer.append(frame)
+                            results[key] = None
+                        except Exception as e:
+                            results[key] = f'{type(e).__name__}: {e}'
+                    # A frame is only acknowledged once it is on disk
+                    try:
+                        writer.sync()
+                    except Exception as e:
+                        results = {key: error if error is not None else f'{type(e).__name__}: {e}'
+                                   for key, error in results.items()}
+                    channel.results.update(results)
+        finally:
+            channel.running.clear()
+
+
+_time_series_channel: Union[None, TimeSeriesChannel] = None
+
+
+def share_time_series_appender(channel: TimeSeriesChannel):
+    # channel is TimeSeriesAppender.channel of the parent process
+    global _time_series_channel
+    _time_series_channel = channel
+
+
+def get_shared_time_series_appender() -> Union[None, TimeSeriesChannel]:
+    return _time_series_channel
+
+
+def append_frame(frame: TimeSeriesFrame, timeout: float = APPEND_TIMEOUT):
+    # Returns once the frame is written, raises IOError if it could not be written, so the
+    # task that produced it is not marked as processed
+    channel = _time_series_channel
+    if channel is None:
+        raise ValueError('There is no time series appender, see share_time_series_appender')
+    if not channel.running.is_set():
+        raise IOError('The time series appender is not running')
+    key = uuid.uuid4().hex
+    channel.queue.put((key, frame))
+    deadline = time.monotonic() + timeout
+    while key not in channel.results:
+        if not channel.running.is_set() and key not in channel.results:
+            raise IOError(f'The time series appender stopped before writing {frame.name} {frame.time}')
+        if time.monotonic() > deadline:
+            raise IOError(f'Timed out waiting for {frame.name} {frame.time} to be written')
+        time.sleep(APPEND_POLL_INTERVAL)
+    error = channel.results.pop(key)
+    if error is not None:
+        raise IOError(f'Could not append {frame.name} {frame.time}: {error}')
+
+
+def get_shard_filenames(directory: str, name: str, start: np.datetime64 = None,
+                        end: np.datetime64 = None) -> List[str]:
+    # The shards of a series that may have times in [start, end], in time order
+    shard_regex = re.compile(rf'{re.escape(name)}-\d+W-(\d{{8}}|\d{{6}})\.nc')
+    selected = []
+    for filename in glob.glob(os.path.join(glob.escape(directory), f'{glob.escape(name)}-*.nc')):
+        match = shard_regex.fullmatch(os.path.basename(filename))
+        if match is None:
+            continue
+        period = match.group(1)
+        if len(period) == 8:
+            first = np.datetime64(f'{period[:4]}-{period[4:6]}-{period[6:]}', 'ms')
+            last = first + np.timedelta64(1, 'D')
+        else:
+            month = np.datetime64(f'{period[:4]}-{period[4:]}', 'M')
+            first, last = month.astype('datetime64[ms]'), (month + 1).astype('datetime64[ms]')
+        if (start is None or last > start) and (end is None or first <= end):
+            selected.append((first, filename))
+    return [filename for _, filename in sorted(selected)]
+
+
+def read_time_series(directory: str, name: str, variable_name: str = 'CMI', start: np.datetime64 = None,
+                     end: np.datetime64 = None) -> Tuple[np.ndarray, Union[np.ndarray, np.ma.MaskedArray]]:
+    # The frames in [start, end] in time order, each shard is read in one slice
+    all_times = []
+    all_data = []
+    for filename in get_shard_filenames(directory, name, start, end):
+        dataset = netCDF4.Dataset(filename)
+        try:
+            times = dataset.variables['time'][:].filled(np.nan)
+            indexes = time_indexes(times, start, end)
+            if len(indexes) == 0:
+                continue
+            first, last = int(indexes.min()), int(indexes.max())
+            data = dataset.variables[variable_name][first:last + 1]
+            all_times.append(seconds_to_time(times[indexes]))
+            all_data.append(data[indexes - first])
+        finally:
+            dataset.close()
+    if not all_data:
+        return np.empty(0, dtype='datetime64[ms]'), np.empty((0, 0, 0))
+    times, data = np.concatenate(all_times), np.ma.concatenate(all_data)
+    if np.any(times[1:] < times[:-1]):
+        # Shards of two satellite positions in the same period
+        order = np.argsort(times, kind='stable')
+        times, data = times[order], data[order]
+    return times, data
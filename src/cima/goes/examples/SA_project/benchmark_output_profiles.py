@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Write time, size and read time of the South America clip of a file with each output profile:
+#   python benchmark_output_profiles.py OR_ABI-L2-CMIPF-M3C13_G16_s20182131500.nc
+import os
+import sys
+import tempfile
+import time
+
+import netCDF4
+import numpy as np
+from cima.goes.datasets import LatLonRegion, OutputProfile, UNCOMPRESSED_OUTPUT_PROFILE, get_clipping_info
+from cima.goes.datasets import write_clipping_to_dataset, fill_clipped_variable_from_source
+
+SA_region = LatLonRegion(
+    lat_south=-53.9,
+    lat_north=15.7,
+    lon_west=-81.4,
+    lon_east=-34.7 + 3
+)
+
+PROFILES = {
+    'uncompressed (default)': UNCOMPRESSED_OUTPUT_PROFILE,
+    'zlib 1': OutputProfile(complevel=1),
+    'zlib 4': OutputProfile(),
+    'zlib 9': OutputProfile(complevel=9),
+    'zlib 4 no shuffle': OutputProfile(shuffle=False),
+    'zlib 4 row chunks': OutputProfile(chunksizes=(64, 100000)),
+    'zlib 4 one chunk': OutputProfile(chunksizes=(100000, 100000)),
+    # The same as the default when the source is already packed
+    'zlib 4 packed int16': OutputProfile(pack=True),
+}
+
+
+def write(source_dataset: netCDF4.Dataset, clipping_info, filename: str, profile: OutputProfile, data):
+    clipped_dataset = netCDF4.Dataset(filename, 'w', format='NETCDF4')
+    try:
+        write_clipping_to_dataset(clipped_dataset, clipping_info, profile)
+        fill_clipped_variable_from_source(clipped_dataset, source_dataset, 'benchmark', data=data, profile=profile)
+    finally:
+        clipped_dataset.close()
+
+
+def read(filename: str):
+    clipped_dataset = netCDF4.Dataset(filename)
+    try:
+        return clipped_dataset.variables['CMI'][:]
+    finally:
+        clipped_dataset.close()
+
+
+def run(source_filename: str, repeat: int = 3):
+    source_dataset = netCDF4.Dataset(source_filename)
+    clipping_info = get_clipping_info(source_dataset, name_prefix='SA-benchmark', region=SA_region)
+    indexes = clipping_info.indexes
+    data = source_dataset.variables['CMI'][indexes.row_min:indexes.row_max, indexes.col_min:indexes.col_max]
+    source_variable = source_dataset.variables['CMI']
+    packed = 'packed' if 'scale_factor' in source_variable.ncattrs() else 'not packed'
+    print(f'{source_filename}: {data.shape} {source_variable.datatype} {packed} in the source')
+    print(f'{"profile":>20} {"write s":>8} {"MB":>8} {"read s":>8}')
+    with tempfile.TemporaryDirectory() as directory:
+        for name, profile in PROFILES.items():
+            filename = os.path.join(directory, 'clipped.nc')
+            write_seconds = min(_timed(write, source_dataset, clipping_info, filename, profile, data)
+                                for _ in range(repeat))
+            read_seconds = min(_timed(read, filename) for _ in range(repeat))
+            size = os.path.getsize(filename) / 1024 ** 2
+            print(f'{name:>20} {write_seconds:8.3f} {size:8.2f} {read_seconds:8.3f}')
+    source_dataset.close()
+
+
+def _timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    run(sys.argv[1])
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import os
+import asyncio
+import multiprocessing
+import time
+import traceback
+from typing import List
+from cima.goes.aio.gcs import Dataset
+from cima.goes.aio.gcs import download_datasets, BlobCache, SharedConcurrency, share_concurrency
+from cima.goes.aio.tasks_store import Store, Processed, Cancelled
+from cima.goes.datasets import SharedClippingInfo, share_clipping_info, get_clipping_info
+from cima.goes.datasets import TimeSeriesAppender, share_time_series_appender, frame_from_source, append_frame
+
+
+DATABASE_FILEPATH = "test.db"
+# One file per day with all its frames, instead of one file per frame
+SERIES_NAME = "SA-CMIPF-C13"
+SHARD = "day"
+# Apart from the info files, that are read from the current directory
+DOWNLOAD_DIR = "./series"
+#DOWNLOAD_DIR = "/datoslinus/jruiz/Datos_GOES/SouthAmerica"
+BATCH_SIZE_PER_WORKER = 30
+#PROXY=None
+PROXY="http://proxy.fcen.uba.ar:8080"
+CACHE_DIR=None
+#CACHE_DIR="./blob_cache"
+# Connections to the proxy, shared by all the worker processes
+MIN_CONNECTIONS=4
+MAX_CONNECTIONS=64
+# Downloaded bytes held in memory by each worker process
+MAX_IN_FLIGHT_BYTES=2 * 1024 ** 3
+
+
+async def on_error(task_name: str, e: Exception, queue: multiprocessing.Queue):
+    print("CANCELLED:", task_name)
+    # print("ERROR:", traceback.print_exc())
+    queue.put(Cancelled(task_name, str(e)))
+
+
+def save_task(task_name: str, dataset: Dataset):
+    clipping_info = get_clipping_info(dataset, name_prefix='SA-CMIPF')
+    # Waits until the frame is written, if it cannot be the task is cancelled and retried
+    append_frame(frame_from_source(SERIES_NAME, dataset, clipping_info))
+
+
+async def on_success(task_name: str, result, queue: multiprocessing.Queue):
+    queue.put(Processed(task_name))
+    print(task_name)
+
+
+async def process_tasks(names: List[str], queue):
+    stats = await download_datasets(
+        names,
+        on_success=lambda x, y: on_success(x, y, queue),
+        on_error=lambda x, y: on_error(x, y, queue),
+        proxy=PROXY,
+        cache=BlobCache(CACHE_DIR) if CACHE_DIR else None,
+        process=save_task,
+        max_in_flight_bytes=MAX_IN_FLIGHT_BYTES)
+    print(stats)
+
+
+def initialize_worker(shared_concurrency: SharedConcurrency, shared_clipping_info: SharedClippingInfo, series_channel):
+    share_concurrency(shared_concurrency)
+    share_clipping_info(shared_clipping_info)
+    share_time_series_appender(series_channel)
+
+
+async def main():
+    store = Store(DATABASE_FILEPATH)
+    start_time = time.time()
+    print(store.get_stats())
+    store.free_taken()
+    store.free_cancelled()
+    shared_concurrency = SharedConcurrency(
+        initial_limit=MIN_CONNECTIONS, min_limit=MIN_CONNECTIONS, max_limit=MAX_CONNECTIONS)
+    # The SA-CMIPF info files are read once here, the workers share the grids
+    # and a single process appends the frames of all the workers
+    with SharedClippingInfo() as shared_clipping_info, TimeSeriesAppender(DOWNLOAD_DIR, shard=SHARD) as appender:
+        shared_clipping_info.publish_info_files('SA-CMIPF')
+        try:
+            tasks_remain = True
+            while tasks_remain:
+                print(f"{time.time() - start_time} seconds {store.get_stats()}")
+                tasks_remain = await store.process(process_tasks, BATCH_SIZE_PER_WORKER,
+                                                   initializer=initialize_worker,
+                                                   initargs=(shared_concurrency, shared_clipping_info, appender.channel))
+        finally:
+            # Closes the worker processes and their sessions, before the shared grids go away
+            await store.close_pool()
+    print("async --- %s seconds ---" % (time.time() - start_time))
+    print(store.get_stats())
+
+if __name__ == "__main__":
+    asyncio.run(main())
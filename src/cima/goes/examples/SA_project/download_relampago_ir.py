@@ -6,8 +6,9 @@ import time
 import traceback
 from typing import List
 from cima.goes.aio.gcs import Dataset
-from cima.goes.aio.gcs import download_datasets
+from cima.goes.aio.gcs import download_datasets, BlobCache, SharedConcurrency, share_concurrency
 from cima.goes.aio.tasks_store import Store, Processed, Cancelled
+from cima.goes.datasets import SharedClippingInfo, share_clipping_info
 from generate_one_file import save_SA_netcdf
 
 
@@ -17,6 +18,13 @@ DOWNLOAD_DIR = "./"
 BATCH_SIZE_PER_WORKER = 2
 PROXY=None
 #PROXY="http://proxy.fcen.uba.ar:8080"
+CACHE_DIR=None
+#CACHE_DIR="./blob_cache"
+# Connections to the proxy, shared by all the worker processes
+MIN_CONNECTIONS=4
+MAX_CONNECTIONS=64
+# Downloaded bytes held in memory by each worker process
+MAX_IN_FLIGHT_BYTES=2 * 1024 ** 3
 
 
 async def on_error(task_name: str, e: Exception, queue: multiprocessing.Queue):
@@ -25,18 +33,30 @@ async def on_error(task_name: str, e: Exception, queue: multiprocessing.Queue):
     queue.put(Cancelled(task_name, str(e)))
 
 
-async def on_success(task_name: str, dataset: Dataset, queue: multiprocessing.Queue):
-    print(task_name)
+def save_task(task_name: str, dataset: Dataset):
     save_SA_netcdf(dataset, path=os.path.join(DOWNLOAD_DIR, os.path.dirname(task_name)), matrix_type='IR')
+
+
+async def on_success(task_name: str, result, queue: multiprocessing.Queue):
+    print(task_name)
     queue.put(Processed(task_name))
 
 
 async def process_tasks(names: List[str], queue):
-    await download_datasets(
+    stats = await download_datasets(
         names,
         on_success=lambda x, y: on_success(x, y, queue),
         on_error=lambda x, y: on_error(x, y, queue),
-        proxy=PROXY)
+        proxy=PROXY,
+        cache=BlobCache(CACHE_DIR) if CACHE_DIR else None,
+        process=save_task,
+        max_in_flight_bytes=MAX_IN_FLIGHT_BYTES)
+    print(stats)
+
+
+def initialize_worker(shared_concurrency: SharedConcurrency, shared_clipping_info: SharedClippingInfo):
+    share_concurrency(shared_concurrency)
+    share_clipping_info(shared_clipping_info)
 
 
 async def main():
@@ -45,10 +65,21 @@ async def main():
     print(store.get_stats())
     store.free_taken()
     store.free_cancelled()
-    tasks_remain = True
-    while tasks_remain:
-        print(f"{time.time() - start_time} seconds {store.get_stats()}")
-        tasks_remain = await store.process(process_tasks, BATCH_SIZE_PER_WORKER, workers_count=None)
+    shared_concurrency = SharedConcurrency(
+        initial_limit=MIN_CONNECTIONS, min_limit=MIN_CONNECTIONS, max_limit=MAX_CONNECTIONS)
+    # The SA-CMIPF info files are read once here, the workers share the grids
+    with SharedClippingInfo() as shared_clipping_info:
+        shared_clipping_info.publish_info_files('SA-CMIPF')
+        try:
+            tasks_remain = True
+            while tasks_remain:
+                print(f"{time.time() - start_time} seconds {store.get_stats()}")
+                tasks_remain = await store.process(process_tasks, BATCH_SIZE_PER_WORKER, workers_count=None,
+                                                   initializer=initialize_worker,
+                                                   initargs=(shared_concurrency, shared_clipping_info))
+        finally:
+            # Closes the worker processes and their sessions, before the shared grids go away
+            await store.close_pool()
     print("async --- %s seconds ---" % (time.time() - start_time))
     print(store.get_stats())
 
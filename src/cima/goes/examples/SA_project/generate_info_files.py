@@ -15,13 +15,13 @@ def run():
         lon_west=-81.4,
         lon_east=-34.7 + 3
     )
-    filenames = generate_info_files([visible, ir], SA_region, filename_prefix='SA-CMIPF')
+    filenames = generate_info_files([visible, ir], SA_region, filename_prefix='SA-CMIPF', grid_store=True)
     for filename in filenames:
         print(filename)
         info_dataset = netCDF4.Dataset(filename)
         clipping_info = get_clipping_info_from_info_dataset(info_dataset)
-        lats = clipping_info.lats
-        lons = clipping_info.lons
+        lats = np.asarray(clipping_info.lats)
+        lons = np.asarray(clipping_info.lons)
         print(f'LAT min: {np.min(lats)} max: {np.nanmax(lats[lats != np.inf])}')
         print(f'LON min: {np.min(lons)} max: {np.nanmax(lons[lons != np.inf])}')
 
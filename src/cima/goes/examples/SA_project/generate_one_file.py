@@ -3,15 +3,18 @@ import datetime
 import os
 import netCDF4
 from cima.goes.aio.gcs import get_blobs, get_blob_dataset, save_blob
-from cima.goes.datasets import write_clipping_to_dataset, DatasetClippingInfo
+from cima.goes.datasets import write_clipping_to_dataset, DatasetClippingInfo, LatLonRegion
+from cima.goes.datasets import get_regions_clipping_info, clip_regions
+from cima.goes.datasets import clip_variables, fill_clipped_variables_from_source
+from cima.goes.datasets import clip_aggregated, resolution_factor, QualityRules
 from cima.goes.datasets.clipping import fill_clipped_variable_from_source, get_clipping_info_from_info_dataset, \
     old_sat_lon, actual_sat_lon, get_sat_lon, get_clipping_info
-from cima.goes.products import ProductBand, Product, Band
+from cima.goes.products import ProductBand, Product, Band, band_variable_name
 
 
-def vis_dataset_summary(dataset: netCDF4.Dataset, clipping_info: DatasetClippingInfo):
+def vis_dataset_summary(dataset: netCDF4.Dataset, clipping_info: DatasetClippingInfo, area='South America'):
     dataset.summary = f'This file contains red data (channel 2) from GOES 16 satellite, ' \
-                      f'within the area of South America delimited approximately ' \
+                      f'within the area of {area} delimited approximately ' \
                       f'by latitude {-clipping_info.region.lat_north}°N and ' \
                       f'{-clipping_info.region.lat_south}°S; ' \
                       f'longitude {-clipping_info.region.lon_west}°W and ' \
@@ -21,8 +24,21 @@ def vis_dataset_summary(dataset: netCDF4.Dataset, clipping_info: DatasetClipping
                       f'"SA-CMIPF-0.5km-75W" and "SA-CMIPF-0.5km-89W" in the project root directory'
 
 
-def ir_dataset_summary(dataset: netCDF4.Dataset, clipping_info: DatasetClippingInfo):
+def ir_dataset_summary(dataset: netCDF4.Dataset, clipping_info: DatasetClippingInfo, area='South America'):
     dataset.summary = f'This file contains the brightness temperature of channel 13 from GOES 16 satellite, ' \
+                      f'within the area of {area} delimited approximately ' \
+                      f'by latitude {-clipping_info.region.lat_north}°N and ' \
+                      f'{-clipping_info.region.lat_south}°S; ' \
+                      f'longitude {-clipping_info.region.lon_west}°W and ' \
+                      f'{-clipping_info.region.lon_east}°W.' \
+                      f'To obtain the corresponding Lat-Lon grids, vectors cutting x and y are attached respectively, ' \
+                      f'or you can download the file with the grids generated ' \
+                      f'"SA-CMIPF-2km-75W" and "SA-CMIPF-2km-89W" in the project root directory'
+
+
+def bands_dataset_summary(dataset: netCDF4.Dataset, clipping_info: DatasetClippingInfo, bands):
+    channels = ', '.join(str(int(band)) for band in bands)
+    dataset.summary = f'This file contains the cloud and moisture imagery of channels {channels} from GOES 16 satellite, ' \
                       f'within the area of South America delimited approximately ' \
                       f'by latitude {-clipping_info.region.lat_north}°N and ' \
                       f'{-clipping_info.region.lat_south}°S; ' \
@@ -39,10 +55,49 @@ def write_institutional_info_to_dataset(dataset: netCDF4.Dataset, clipping_info:
     dataset.creator_email = "jruiz@cima.fcen.uba.ar, salio@cima.fcen.uba.ar"
 
 
-def save_SA_netcdf(source_dataset: netCDF4.Dataset, path="./", matrix_type=''):
-    clipping_info: DatasetClippingInfo = get_clipping_info(source_dataset, matrix_type=matrix_type, name_prefix='SA-CMIPF')
+# Clipped together with South America by save_regions_netcdf once registered in the process
+# that clips: register_region('RELAMPAGO', RELAMPAGO_region)
+RELAMPAGO_region = LatLonRegion(
+    lat_south=-40.0,
+    lat_north=-26.0,
+    lon_west=-70.0,
+    lon_east=-56.0
+)
+
+
+def save_SA_netcdf(source_dataset: netCDF4.Dataset, path="./", matrix_type='', resolution=None, aggregation='mean',
+                   quality: QualityRules = None):
+    # With resolution, '2km' for example, blocks of pixels are reduced by aggregation
+    # (mean, nanmean, max or min) leaving out the pixels with a DQF that is not good, or the
+    # ones quality rejects. Otherwise quality masks the pixels by their DQF and may add the
+    # flags as a 2 bits layer.
+    clipping_info: DatasetClippingInfo = get_clipping_info(source_dataset, matrix_type=matrix_type, name_prefix='SA-CMIPF',
+                                                           lazy=True)
     filename = os.path.join(path, f"SA-{source_dataset.dataset_name}")
-    if not os.path.exists(path):
+    data = None
+    if resolution is not None:
+        factor = resolution_factor(clipping_info.spatial_resolution, resolution)
+        clipping_info, data = clip_aggregated(source_dataset, clipping_info, factor, aggregation,
+                                              dqf_variable_name='DQF', quality=quality)
+        quality = None
+    save_clipped_netcdf(source_dataset, clipping_info, filename, matrix_type, data=data, quality=quality)
+
+
+def save_regions_netcdf(source_dataset: netCDF4.Dataset, path="./", matrix_type=''):
+    # South America and the registered regions, the source is decoded once for all of them
+    clipping_infos = {'SA': get_clipping_info(source_dataset, matrix_type=matrix_type, name_prefix='SA-CMIPF')}
+    clipping_infos.update(get_regions_clipping_info(source_dataset, name_prefix='CMIPF'))
+    clipped = clip_regions(source_dataset, clipping_infos)
+    for name, clipping_info in clipping_infos.items():
+        filename = os.path.join(path, f"{name}-{source_dataset.dataset_name}")
+        area = 'South America' if name == 'SA' else name
+        save_clipped_netcdf(source_dataset, clipping_info, filename, matrix_type, data=clipped[name], area=area)
+
+
+def save_clipped_netcdf(source_dataset: netCDF4.Dataset, clipping_info: DatasetClippingInfo, filename: str,
+                        matrix_type='', data=None, area='South America', quality: QualityRules = None):
+    path = os.path.dirname(filename)
+    if path and not os.path.exists(path):
         os.makedirs(path)
     clipped_dataset = netCDF4.Dataset(filename, 'w', format='NETCDF4')
     try:
@@ -50,10 +105,10 @@ def save_SA_netcdf(source_dataset: netCDF4.Dataset, path="./", matrix_type=''):
         write_clipping_to_dataset(clipped_dataset, clipping_info)
         write_institutional_info_to_dataset(clipped_dataset, clipping_info)
         if matrix_type == 'IR':
-            ir_dataset_summary(clipped_dataset, clipping_info)
+            ir_dataset_summary(clipped_dataset, clipping_info, area)
             matrix_comment = 'Brightness temperature'
         elif matrix_type == 'VIS':
-            vis_dataset_summary(clipped_dataset, clipping_info)
+            vis_dataset_summary(clipped_dataset, clipping_info, area)
             matrix_comment = 'Visible (Red)'
         else:
             raise Exception(f'Unknown matrix type "{matrix_type}"')
@@ -65,7 +120,45 @@ def save_SA_netcdf(source_dataset: netCDF4.Dataset, path="./", matrix_type=''):
                    f'and {-clipped_dataset.geospatial_lat_min}°S; longitude {-clipped_dataset.geospatial_lon_min}°W ' \
                    f'and {-clipped_dataset.geospatial_lon_max}°W.)'
 
-        fill_clipped_variable_from_source(clipped_dataset, source_dataset, comments)
+        fill_clipped_variable_from_source(clipped_dataset, source_dataset, comments, data=data, quality=quality)
+    finally:
+        clipped_dataset.close()
+
+
+def save_SA_bands_netcdf(source_dataset: netCDF4.Dataset, bands=tuple(Band), path="./", per_band=False):
+    # From a multi band file (MCMIPF), every band is read once. All of them in one file, or with
+    # per_band one file per band with the band as CMI, like the files clipped from CMIPF.
+    clipping_info: DatasetClippingInfo = get_clipping_info(source_dataset, name_prefix='SA-CMIPF')
+    variable_names = {band_variable_name(band): band for band in bands}
+    data = clip_variables(source_dataset, clipping_info.indexes, list(variable_names))
+    if not os.path.exists(path):
+        os.makedirs(path)
+    if per_band:
+        for variable_name, band in variable_names.items():
+            filename = os.path.join(path, f"SA-C{band:02d}-{source_dataset.dataset_name}")
+            _save_SA_bands_netcdf(source_dataset, clipping_info, filename, {variable_name: band},
+                                  {variable_name: data[variable_name]}, {variable_name: 'CMI'})
+    else:
+        filename = os.path.join(path, f"SA-{source_dataset.dataset_name}")
+        _save_SA_bands_netcdf(source_dataset, clipping_info, filename, variable_names, data)
+
+
+def _save_SA_bands_netcdf(source_dataset: netCDF4.Dataset, clipping_info: DatasetClippingInfo, filename: str,
+                          variable_names, data, clipped_variable_names=None):
+    clipped_dataset = netCDF4.Dataset(filename, 'w', format='NETCDF4')
+    try:
+        clipped_dataset.dataset_name = filename
+        write_clipping_to_dataset(clipped_dataset, clipping_info)
+        write_institutional_info_to_dataset(clipped_dataset, clipping_info)
+        bands_dataset_summary(clipped_dataset, clipping_info, variable_names.values())
+        comments = {
+            variable_name: f'Channel {int(band)} of the cropping area, delimited within '
+                           f'row_min:{clipped_dataset.row_min} row_max:{clipped_dataset.row_max}; '
+                           f'col_min:{clipped_dataset.col_min}; col_max:{clipped_dataset.col_max} '
+                           f'of original matrix size'
+            for variable_name, band in variable_names.items()
+        }
+        fill_clipped_variables_from_source(clipped_dataset, source_dataset, comments, data, clipped_variable_names)
     finally:
         clipped_dataset.close()
 
@@ -76,6 +169,8 @@ async def get_vis():
         # save_blob(blob, f'./{os.path.basename(blob.name)}')
         dataset = get_blob_dataset(blob)
         save_SA_netcdf(dataset, matrix_type='VIS')
+        # The same grid as the IR bands
+        save_SA_netcdf(dataset, path='./2km', matrix_type='VIS', resolution='2km', aggregation='nanmean')
         dataset.close()
 
 
@@ -85,6 +180,18 @@ async def get_ir():
         # save_blob(blob, f'./{os.path.basename(blob.name)}')
         dataset = get_blob_dataset(blob)
         save_SA_netcdf(dataset, matrix_type='IR')
+        # Only good and conditionally usable pixels, with the flags of every pixel
+        save_SA_netcdf(dataset, path='./quality', matrix_type='IR',
+                       quality=QualityRules(accepted_flags=(0, 1), quality_layer=True))
+        dataset.close()
+
+
+async def get_mcmip():
+        # All the bands from one download
+        product_band = ProductBand(product=Product.MCMIPF)
+        blob = get_blobs(product_band, datetime.date(year=2018, month=8, day=1), hour=15)[0]
+        dataset = get_blob_dataset(blob)
+        save_SA_bands_netcdf(dataset, per_band=True)
         dataset.close()
 
 
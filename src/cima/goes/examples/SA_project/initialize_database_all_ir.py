@@ -1,42 +1,39 @@
 #!/usr/bin/env python3
+import asyncio
 import datetime
+import itertools
 import os
 import time
 
 from cima.goes.products import ProductBand, Product, Band
-from cima.goes.aio.gcs import get_blobs
+from cima.goes.aio.gcs import list_blobs, date_range
 from cima.goes.aio.tasks_store import Store
 
 
 DATABASE_FILEPATH = "all_ir.db"
+PROXY=None
+#PROXY="http://proxy.fcen.uba.ar:8080"
 
 
-def init_store():
-    date=datetime.date(2017, 7, 11)
-    to_date1=datetime.date(2017, 11, 30)
-    from_date2=datetime.date(2017, 12, 15)
-    to_date2=datetime.date.today()
-    range = 1
+async def init_store():
+    dates = itertools.chain(
+        date_range(datetime.date(2017, 7, 11), datetime.date(2017, 11, 30)),
+        date_range(datetime.date(2017, 12, 15), datetime.date.today()))
+    count = 0
     with Store(DATABASE_FILEPATH) as store:
-        while True:
-            if range == 1 and date > to_date1:
-                date = from_date2
-                range = 2
-                print("---------------  RANGE 2 --------------")
-            elif range == 2 and date > to_date2:
-                break
-            blobs = get_blobs(ProductBand(Product.CMIPF, Band.CLEAN_LONGWAVE_WINDOW), date)
-            for blob in blobs:
-                store.add(blob.name)
-            print(date.isoformat())
-            date = date + datetime.timedelta(days=1)
+        async for blob in list_blobs(ProductBand(Product.CMIPF, Band.CLEAN_LONGWAVE_WINDOW), dates, proxy=PROXY):
+            store.add(blob.name)
+            count += 1
+            if count % 1000 == 0:
+                print(count, blob.name)
+    print(count)
 
 
 def main():
     if os.path.exists(DATABASE_FILEPATH):
         os.remove(DATABASE_FILEPATH)
     start_time = time.time()
-    init_store()
+    asyncio.run(init_store())
     print("async --- %s seconds ---" % (time.time() - start_time))
 
 
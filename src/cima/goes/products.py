@@ -1,10 +1,13 @@
 import datetime
 import os
-import urllib
+import urllib.parse
 from dataclasses import dataclass
 from enum import IntEnum, Enum, unique
+from typing import Iterable, Union
 import re
 
+import numpy as np
+
 # File neme pattern:
 # OR_ABI-L2–CMIPF–M3C09_G16_sYYYYJJJHHMMSSs_eYYYYJJJHHMMSSs_cYYYYJJJHHMMSSs.nc
 # Where:
@@ -96,6 +99,15 @@ class ProductBand:
     subproduct: int = None
 
 
+# Products with all the bands in one file, as CMI_C01 ... CMI_C16
+MULTI_BAND_PRODUCTS = (Product.MCMIPF, Product.MCMIPC, Product.MCMIPM)
+
+
+def band_variable_name(band: Band, variable: str = 'CMI') -> str:
+    # The variable of a band in a multi band file, also DQF_Cxx
+    return f'{variable}_C{band:02d}'
+
+
 OR = 'OR' # Operational System Real-Time Data
 G16 = 'G16' # GOES-16
 ANY_MODE = 'M.'
@@ -138,6 +150,7 @@ def hour_file_regex_pattern(hour: int, band: Band, product: Product = Product.CM
 
 
 def slice_obs_start(product=Product.CMIPF, subproduct: int = None):
+    # Only valid for full paths of band products, GoesFileName.parse works for any name
     prefix_pos = len(path_prefix(year=1111, month=1, day=1, hour=11, product=product)) + len(
         file_name(band=Band.RED, product=product, subproduct=subproduct)) + 2
     return slice(prefix_pos, prefix_pos + len('20183650045364'))
@@ -151,10 +164,151 @@ def get_gcs_url(filepath: str):
     return f'https://storage.cloud.google.com/{GOES_PUBLIC_BUCKET}/{filepath}'
 
 
+def get_public_url(filepath: str, bucket: str = GOES_PUBLIC_BUCKET):
+    return f'https://storage.googleapis.com/{bucket}/{urllib.parse.quote(filepath, safe="/~")}'
+
+
 def get_browse_url(filepath: str):
-    parts = filepath.split('_')
-    product = '-'.join(parts[1].split('-')[:-1])
-    year = parts[3][1:5]
-    day_of_year = parts[3][6:9]
-    hour = parts[3][10:12]
-    return f'https://storage.cloud.google.com/{GOES_PUBLIC_BUCKET}/{product}/{year}/{day_of_year}/{hour}/{filepath}'
+    parsed = GoesFileName.parse(filepath)
+    return f'https://storage.cloud.google.com/{GOES_PUBLIC_BUCKET}/{parsed.path_prefix()}{os.path.basename(filepath)}'
+
+
+_HEADER_PATTERN = (r'(?P<system>[A-Z]{2})_(?P<product>[A-Z]+-L[0-9a-z]+-[A-Za-z]+?)(?P<subproduct>\d*)'
+                   r'(?:-M(?P<mode>\d)(?:C(?P<band>\d\d))?)?_(?P<satellite>G\d\d)')
+_HEADER_REGEX = re.compile(_HEADER_PATTERN)
+FILE_NAME_REGEX = re.compile(_HEADER_PATTERN + r'_s(?P<start>\d{14})_e(?P<end>\d{14})_c(?P<created>\d{14})')
+# _sYYYYJJJHHMMSSs_eYYYYJJJHHMMSSs_cYYYYJJJHHMMSSs.nc
+TIMES_SUFFIX_LENGTH = 3 * 16 + len('.nc')
+
+
+def parse_goes_time(value: str) -> datetime.datetime:
+    # YYYYJJJHHMMSSs, the last digit is tenths of second
+    return datetime.datetime.strptime(value[:13], '%Y%j%H%M%S') + datetime.timedelta(milliseconds=100 * int(value[13]))
+
+
+@dataclass(frozen=True)
+class GoesFileName:
+    system: str
+    product: str
+    subproduct: Union[None, int]
+    mode: Union[None, int]
+    band: Union[None, int]
+    satellite: str
+    start: datetime.datetime
+    end: datetime.datetime
+    created: datetime.datetime
+
+    @staticmethod
+    def parse(name: str) -> 'GoesFileName':
+        match = FILE_NAME_REGEX.search(name)
+        if match is None:
+            raise ValueError(f'Not a GOES file name: {name}')
+        return GoesFileName(
+            system=match['system'],
+            product=match['product'],
+            subproduct=int(match['subproduct']) if match['subproduct'] else None,
+            mode=int(match['mode']) if match['mode'] else None,
+            band=int(match['band']) if match['band'] else None,
+            satellite=match['satellite'],
+            start=parse_goes_time(match['start']),
+            end=parse_goes_time(match['end']),
+            created=parse_goes_time(match['created']))
+
+    def path_prefix(self) -> str:
+        return f'{self.product}/{self.start.year:04d}/{self.start.timetuple().tm_yday:03d}/{self.start.hour:02d}/'
+
+
+@dataclass
+class GoesFileNames:
+    # One entry per name, mode, band and subproduct are 0 when the name has none
+    names: np.ndarray
+    product: np.ndarray
+    subproduct: np.ndarray
+    mode: np.ndarray
+    band: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+    created: np.ndarray
+
+    def __len__(self):
+        return len(self.names)
+
+    def take(self, indexes) -> 'GoesFileNames':
+        # indexes can be a boolean mask or the result of argsort
+        return GoesFileNames(*(getattr(self, f)[indexes] for f in self.__dataclass_fields__))
+
+
+def goes_times(digits: np.ndarray) -> np.ndarray:
+    # (n, 14) array of YYYYJJJHHMMSSs ASCII codes to datetime64[ms], without a Python loop
+    def number(start, stop):
+        return (digits[:, start:stop].astype(np.int64) - ord('0')) @ 10 ** np.arange(stop - start - 1, -1, -1)
+
+    years = (number(0, 4) - 1970).astype('datetime64[Y]')
+    milliseconds = ((number(7, 9) * 60 + number(9, 11)) * 60 + number(11, 13)) * 1000 + number(13, 14) * 100
+    return (years.astype('datetime64[D]') + (number(4, 7) - 1)).astype('datetime64[ms]') + milliseconds
+
+
+def _first_invalid(names: np.ndarray, rows: np.ndarray) -> ValueError:
+    return ValueError(f'Not a GOES file name: {names[rows[0]]}')
+
+
+def parse_file_names(names: Iterable[str]) -> GoesFileNames:
+    # Names are decoded as a byte matrix. They are grouped by the position of the basename
+    # and of the times suffix, that is fixed for each product, so the fields are plain column
+    # slices; only the few distinct product-mode-band headers go through the regex.
+    names = np.asarray(list(names), dtype=object)
+    count = len(names)
+    encoded = names.astype('S') if count else np.zeros(0, dtype='S1')
+    width = encoded.dtype.itemsize
+    encoded = encoded.view(np.uint8).reshape(count, width)
+    lengths = (encoded != 0).sum(axis=1)
+    slashes = encoded[:, ::-1] == ord('/')
+    basenames = np.where(slashes.any(axis=1), width - slashes.argmax(axis=1), 0)
+    suffixes = lengths - TIMES_SUFFIX_LENGTH
+    if (suffixes < basenames).any():
+        raise _first_invalid(names, np.flatnonzero(suffixes < basenames))
+
+    product = np.empty(count, dtype=object)
+    subproduct = np.zeros(count, dtype=np.int16)
+    mode = np.zeros(count, dtype=np.int8)
+    band = np.zeros(count, dtype=np.int8)
+    digits = np.empty((count, 42), dtype=np.uint8)
+    separators = np.frombuffer(b'_s_e_c.nc', dtype=np.uint8)
+    separator_columns = [0, 1, 16, 17, 32, 33, 48, 49, 50]
+    digit_columns = np.delete(np.arange(TIMES_SUFFIX_LENGTH), separator_columns)
+    groups, group_index = np.unique(basenames * (width + 1) + suffixes, return_inverse=True)
+    group_index = group_index.reshape(-1)
+    for i, key in enumerate(groups):
+        begin, suffix = divmod(int(key), width + 1)
+        rows = np.flatnonzero(group_index == i) if len(groups) > 1 else np.arange(count)
+        times = encoded[rows, suffix:suffix + TIMES_SUFFIX_LENGTH]
+        group_digits = times[:, digit_columns]
+        invalid = (times[:, separator_columns] != separators).any(axis=1) | \
+            ((group_digits < ord('0')) | (group_digits > ord('9'))).any(axis=1)
+        if invalid.any():
+            raise _first_invalid(names, rows[invalid])
+        digits[rows] = group_digits
+        headers = encoded[rows, begin:suffix]
+        # Grouped by the header bytes, each row as one fixed width string
+        header_bytes = np.ascontiguousarray(headers).view(f'S{headers.shape[1]}').reshape(-1)
+        _, first, header_index = np.unique(header_bytes, return_index=True, return_inverse=True)
+        header_index = header_index.reshape(-1)
+        for j, row in enumerate(first):
+            match = _HEADER_REGEX.fullmatch(headers[row].tobytes().decode('ascii', errors='replace'))
+            if match is None:
+                raise _first_invalid(names, rows[row:])
+            same = rows[header_index == j] if len(first) > 1 else rows
+            product[same] = match['product']
+            subproduct[same] = int(match['subproduct'] or 0)
+            mode[same] = int(match['mode'] or 0)
+            band[same] = int(match['band'] or 0)
+
+    return GoesFileNames(
+        names=names,
+        product=product.astype(str),
+        subproduct=subproduct,
+        mode=mode,
+        band=band,
+        start=goes_times(digits[:, 0:14]),
+        end=goes_times(digits[:, 14:28]),
+        created=goes_times(digits[:, 28:42]))
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from cima.goes.datasets import DatasetClippingInfo, LatLonRegion, RegionIndexes
+from cima.goes.datasets import aggregate_clipping_info, source_indexes
+from cima.goes.datasets.fixed_grid import full_disk_grid
+
+
+def _clipping_info() -> DatasetClippingInfo:
+    return DatasetClippingInfo(
+        goes_imager_projection=None,
+        spatial_resolution='0.5km at nadir',
+        orbital_slot='GOES-East',
+        instrument_type='GOES R Series Advanced Baseline Imager',
+        region=LatLonRegion(lat_north=-30.0, lat_south=-31.0, lon_west=-65.0, lon_east=-64.0),
+        indexes=RegionIndexes(col_min=9001, col_max=9102, row_min=14003, row_max=14098),
+        lats=None,
+        lons=None,
+        x=None,
+        y=None)
+
+
+def test_aggregated_indexes_are_of_the_coarse_grid():
+    grid = full_disk_grid(-75.0, '0.5km')
+    aggregated = aggregate_clipping_info(_clipping_info(), 4, grid)
+    indexes = aggregated.indexes
+    assert aggregated.aggregation_factor == 4
+    assert aggregated.spatial_resolution == '2km at nadir'
+    assert (indexes.row_max - indexes.row_min, indexes.col_max - indexes.col_min) == aggregated.lats.shape
+    assert (len(aggregated.y), len(aggregated.x)) == aggregated.lats.shape
+    # The source window is widened to whole blocks
+    assert source_indexes(aggregated) == RegionIndexes(col_min=9000, col_max=9104, row_min=14000, row_max=14100)
+    # The coarse x is the one of the 2 km grid
+    coarse = full_disk_grid(-75.0, '2km')
+    assert np.allclose(aggregated.x, coarse.x(np.arange(indexes.col_min, indexes.col_max)), atol=1e-6)
+
+
+def test_aggregated_info_is_not_aggregated_again():
+    aggregated = aggregate_clipping_info(_clipping_info(), 4, full_disk_grid(-75.0, '0.5km'))
+    with pytest.raises(ValueError):
+        aggregate_clipping_info(aggregated, 2)
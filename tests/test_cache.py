@@ -0,0 +1,71 @@
+import asyncio
+import os
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from cima.goes.aio.gcs import BlobCache, close_sessions, get_session
+from cima.goes.aio.gcs.gcs import get_dataset_source
+
+
+def test_rewritten_object_is_not_served_from_cache(tmp_path):
+    served = tmp_path / 'served'
+    served.mkdir()
+    filename = served / 'object.nc'
+    filename.write_bytes(b'first version')
+    cache = BlobCache(str(tmp_path / 'cache'))
+
+    async def run():
+        async def handler(request):
+            return web.FileResponse(str(served / request.match_info['name']))
+        app = web.Application()
+        app.router.add_route('*', '/{name}', handler)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            url = str(server.make_url('/object.nc'))
+            semaphore = asyncio.Semaphore(2)
+            session = get_session()
+            first = await get_dataset_source(url, session, semaphore, name='object.nc', cache=cache)
+            second = await get_dataset_source(url, session, semaphore, name='object.nc', cache=cache)
+            filename.write_bytes(b'second version, longer')
+            os.utime(filename, (1, 1))
+            third = await get_dataset_source(url, session, semaphore, name='object.nc', cache=cache)
+            return first, second, third
+        finally:
+            await server.close()
+            await close_sessions()
+
+    first, second, third = asyncio.run(run())
+    assert first == b'first version'
+    assert isinstance(second, str) and open(second, 'rb').read() == b'first version'
+    assert third == b'second version, longer'
+    assert cache.stats.hits == 1 and cache.stats.misses == 2
+
+
+def test_hit_survives_eviction_before_it_is_opened(tmp_path):
+    cache = BlobCache(str(tmp_path / 'cache'), max_bytes=10)
+    cache.put('a.nc', b'0123456789', 1)
+    lease = cache.get('a.nc', 1)
+    # Another worker fills the cache and evicts a.nc
+    cache.put('b.nc', b'abcdefghij', 1)
+    assert cache.get('a.nc', 1) is None
+    assert open(lease, 'rb').read() == b'0123456789'
+    BlobCache.release(lease)
+    assert not os.path.exists(lease)
+    assert cache.stats.hits == 1 and cache.stats.misses == 1 and cache.stats.evictions == 1
+
+
+def test_put_scans_the_directory_only_near_the_budget(tmp_path, monkeypatch):
+    cache = BlobCache(str(tmp_path / 'cache'), max_bytes=1000)
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, '_entries', lambda: scans.append(None) or entries())
+    for i in range(20):
+        cache.put(f'{i}.nc', b'x' * 4, 1)
+    # The first put and then every RESCAN_FRACTION of the budget written
+    assert len(scans) == 1
+    for i in range(20, 40):
+        cache.put(f'{i}.nc', b'x' * 50, 1)
+    assert cache.size() <= 1000
+    assert 1 < len(scans) < 20
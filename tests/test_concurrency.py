@@ -0,0 +1,55 @@
+import asyncio
+import multiprocessing
+import os
+import time
+
+from cima.goes.aio.gcs import AdaptiveLimiter, SharedConcurrency
+from cima.goes.aio.gcs.concurrency import Permit
+
+
+def test_only_full_transfers_are_learned():
+    limiter = AdaptiveLimiter(initial_limit=10)
+    now = time.monotonic()
+    limiter.observe(Permit(started=now - 1.0, bytes=100 * 1024 ** 2, full_transfer=True))
+    limit = limiter.limit
+    # A HEAD and a small Range read, much slower per byte than the download
+    limiter.observe(Permit(started=now - 0.2))
+    limiter.observe(Permit(started=now - 0.2, bytes=64 * 1024))
+    assert limiter.limit > limit
+    assert abs(limiter.latency - 1.0) < 0.1
+
+
+def test_slow_full_transfer_decreases_the_limit():
+    limiter = AdaptiveLimiter(initial_limit=10)
+    now = time.monotonic()
+    limiter.observe(Permit(started=now - 1.0, bytes=100 * 1024 ** 2, full_transfer=True))
+    limit = limiter.limit
+    limiter._last_decrease = 0.0
+    limiter.observe(Permit(started=now - 10.0, bytes=100 * 1024 ** 2, full_transfer=True))
+    assert limiter.limit < limit
+
+
+def _hold_permits_and_die(shared: SharedConcurrency, count: int):
+    async def run():
+        limiter = AdaptiveLimiter(shared=shared)
+        for _ in range(count):
+            await limiter.acquire()
+    asyncio.run(run())
+    os._exit(0)
+
+
+def test_permits_of_a_dead_process_are_given_back():
+    shared = SharedConcurrency(initial_limit=2, min_limit=2, max_limit=2)
+    process = multiprocessing.get_context('fork').Process(target=_hold_permits_and_die, args=(shared, 2))
+    process.start()
+    process.join()
+    assert shared.in_flight.value == 2
+
+    async def run():
+        limiter = AdaptiveLimiter(shared=shared, poll_interval=0.05)
+        permits = [await asyncio.wait_for(limiter.acquire(), 5) for _ in range(2)]
+        for permit in permits:
+            await limiter.release(permit)
+
+    asyncio.run(run())
+    assert shared.in_flight.value == 0
@@ -0,0 +1,65 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from cima.goes.aio.gcs import RetryPolicy
+from cima.goes.aio.gcs.gcs import download
+
+BODY = bytes(range(256)) * 400
+RETRY = RetryPolicy(max_attempts=3, base_delay=0.0)
+
+
+class _DroppingServer(object):
+    # Drops the connection halfway through the first response, then answers resumed requests
+    # with the rest of the body while the ETag is still the one of the first response
+    def __init__(self, change_after_drop: bool = False):
+        self.body, self.etag = BODY, '"1"'
+        self.change_after_drop = change_after_drop
+        self.requests = []
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        self.requests.append(dict(request.headers))
+        if len(self.requests) == 1:
+            response = web.StreamResponse(headers={'ETag': self.etag})
+            response.content_length = len(self.body)
+            await response.prepare(request)
+            await response.write(self.body[:len(self.body) // 2])
+            request.transport.close()
+            if self.change_after_drop:
+                self.body, self.etag = BODY[::-1], '"2"'
+            return response
+        if 'Range' in request.headers and request.headers.get('If-Range') == self.etag:
+            start = int(request.headers['Range'][len('bytes='):-1])
+            return web.Response(status=206, body=self.body[start:], headers={
+                'ETag': self.etag,
+                'Content-Range': f'bytes {start}-{len(self.body) - 1}/{len(self.body)}'})
+        return web.Response(body=self.body, headers={'ETag': self.etag})
+
+
+def _download(server: _DroppingServer) -> bytearray:
+    async def run():
+        app = web.Application()
+        app.router.add_get('/blob.nc', server.handle)
+        async with TestServer(app) as test_server:
+            async with aiohttp.ClientSession() as session:
+                return await download(str(test_server.make_url('/blob.nc')), session, asyncio.Semaphore(1),
+                                      retry=RETRY)
+    return asyncio.run(run())
+
+
+def test_dropped_download_is_resumed_from_the_last_byte():
+    server = _DroppingServer()
+    assert _download(server) == BODY
+    assert len(server.requests) == 2
+    received = int(server.requests[1]['Range'][len('bytes='):-1])
+    assert 0 < received <= len(BODY) // 2
+    assert server.requests[1]['If-Range'] == '"1"'
+
+
+def test_changed_object_is_downloaded_again_in_full():
+    server = _DroppingServer(change_after_drop=True)
+    assert _download(server) == BODY[::-1]
+    assert len(server.requests) == 2
+    assert server.requests[1]['If-Range'] == '"1"'
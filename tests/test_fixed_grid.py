@@ -0,0 +1,73 @@
+import numpy as np
+import pyproj
+
+from cima.goes.datasets import LatLonRegion, RegionIndexes, find_region_indexes
+from cima.goes.datasets.fixed_grid import GOES_R_SAT_HEIGHT, GOES_R_SEMI_MAJOR_AXIS, GOES_R_SEMI_MINOR_AXIS
+from cima.goes.datasets.fixed_grid import compute_lats_lons, full_disk_grid, iter_lats_lons_tiles
+
+GRID = full_disk_grid(-75.0, '2km')
+PROJECTION = pyproj.Proj(proj='geos', h=GOES_R_SAT_HEIGHT, lon_0=-75.0, sweep='x',
+                         a=GOES_R_SEMI_MAJOR_AXIS, b=GOES_R_SEMI_MINOR_AXIS)
+
+
+def _points():
+    rng = np.random.default_rng(0)
+    return rng.uniform(-60.0, 60.0, 500), rng.uniform(-135.0, -15.0, 500)
+
+
+def test_scan_angles_are_the_ones_of_pyproj():
+    lats, lons = _points()
+    x, y, visible = GRID.scan_angles(lats, lons)
+    expected_x, expected_y = PROJECTION(lons[visible], lats[visible])
+    assert visible.sum() > 300
+    assert np.allclose(x[visible] * GOES_R_SAT_HEIGHT, expected_x, atol=0.01)
+    assert np.allclose(y[visible] * GOES_R_SAT_HEIGHT, expected_y, atol=0.01)
+
+
+def test_lats_lons_are_the_ones_of_pyproj():
+    cols, rows = np.meshgrid(np.arange(0, GRID.columns, 97), np.arange(0, GRID.rows, 89))
+    x, y = GRID.x(cols), GRID.y(rows)
+    lats, lons = GRID.lats_lons(x, y)
+    expected_lons, expected_lats = PROJECTION(x * GOES_R_SAT_HEIGHT, y * GOES_R_SAT_HEIGHT, inverse=True)
+    on_disk = ~np.isnan(lats)
+    assert np.array_equal(on_disk, np.isfinite(expected_lats))
+    assert np.allclose(lats[on_disk], expected_lats[on_disk], atol=1e-7)
+    assert np.allclose(lons[on_disk], expected_lons[on_disk], atol=1e-7)
+
+
+def test_rows_cols_invert_lats_lons():
+    lats, lons = _points()
+    rows, cols, visible = GRID.rows_cols(lats, lons)
+    inverted_lats, inverted_lons = GRID.lats_lons(GRID.x(cols[visible]), GRID.y(rows[visible]))
+    assert np.allclose(inverted_lats, lats[visible], atol=1e-8)
+    assert np.allclose(inverted_lons, lons[visible], atol=1e-8)
+
+
+def test_tiles_cover_the_window_in_order():
+    indexes = RegionIndexes(col_min=10, col_max=50, row_min=100, row_max=170)
+    lats, lons = np.empty((70, 40)), np.empty((70, 40))
+    compute_lats_lons(GRID, lats, lons, indexes, tile_rows=16)
+    x, y = GRID.x(np.arange(10, 50)), GRID.y(np.arange(100, 170))
+    expected_lats, expected_lons = GRID.lats_lons(x[np.newaxis, :], y[:, np.newaxis])
+    assert np.array_equal(np.isnan(lats), np.isnan(expected_lats))
+    assert np.allclose(lats, expected_lats, equal_nan=True)
+    assert np.allclose(lons, expected_lons, equal_nan=True)
+    rows = [row for row, _, _ in iter_lats_lons_tiles(GRID, indexes, tile_rows=16)]
+    assert rows == [0, 16, 32, 48, 64]
+
+
+def test_region_indexes_bound_the_pixels_inside_the_region():
+    region = LatLonRegion(lat_north=-30.0, lat_south=-35.5, lon_west=-66.0, lon_east=-58.0)
+    indexes = find_region_indexes(GRID, region)
+    # Every pixel of a margin around the found window, the ones inside the region are the brute force answer
+    margin = 20
+    cols = np.arange(indexes.col_min - margin, indexes.col_max + margin)
+    rows = np.arange(indexes.row_min - margin, indexes.row_max + margin)
+    lats, lons = GRID.lats_lons(GRID.x(cols)[np.newaxis, :], GRID.y(rows)[:, np.newaxis])
+    inside = ((lats >= region.lat_south) & (lats <= region.lat_north) &
+              (lons >= region.lon_west) & (lons <= region.lon_east))
+    inside_rows, inside_cols = rows[inside.any(axis=1)], cols[inside.any(axis=0)]
+    assert indexes.row_min <= inside_rows.min() <= indexes.row_min + 1
+    assert indexes.row_max - 1 <= inside_rows.max() <= indexes.row_max
+    assert indexes.col_min <= inside_cols.min() <= indexes.col_min + 1
+    assert indexes.col_max - 1 <= inside_cols.max() <= indexes.col_max
@@ -0,0 +1,85 @@
+import asyncio
+
+from cima.goes.aio.gcs import ByteBudget, HedgePolicy
+
+
+def _policy() -> HedgePolicy:
+    policy = HedgePolicy(min_delay=0.01, min_samples=1, max_hedges=2)
+    policy.observe(0.001)
+    return policy
+
+
+def test_extra_successes_release_their_budget():
+    async def run():
+        budget = ByteBudget(1000)
+        finished = asyncio.Event()
+
+        async def attempt():
+            await budget.acquire(10)
+            await finished.wait()
+            return bytearray(10)
+
+        async def finish_later():
+            await asyncio.sleep(0.1)
+            finished.set()
+
+        asyncio.ensure_future(finish_later())
+        # The primary and both hedges finish in the same round
+        result = await _policy().run(attempt, discard=lambda buffer: budget.release(len(buffer)))
+        return budget, result
+
+    budget, result = asyncio.run(run())
+    assert len(result) == 10
+    assert budget.used == 10
+
+
+def test_cancelled_attempts_release_their_budget():
+    async def run():
+        budget = ByteBudget(1000)
+        calls = []
+
+        async def attempt():
+            calls.append(None)
+            await budget.acquire(10)
+            try:
+                await asyncio.sleep(0.2 if len(calls) == 1 else 0.05)
+            except asyncio.CancelledError:
+                await budget.release(10)
+                raise
+            return bytearray(10)
+
+        result = await _policy().run(attempt, discard=lambda buffer: budget.release(len(buffer)))
+        return budget, result
+
+    budget, result = asyncio.run(run())
+    assert len(result) == 10
+    assert budget.used == 10
+
+
+def test_waiting_for_a_permit_is_not_hedged():
+    async def run():
+        policy = _policy()
+        semaphore = asyncio.Semaphore(1)
+        transfer_started = asyncio.Event()
+        calls = []
+
+        async def attempt():
+            calls.append(None)
+            async with semaphore:
+                if len(calls) == 1:
+                    transfer_started.set()
+                await asyncio.sleep(0.005)
+                return bytearray(10)
+
+        async with semaphore:
+            # Queued well over the hedge delay before the transfer starts
+            task = asyncio.ensure_future(policy.run(attempt, transfer_started=transfer_started))
+            await asyncio.sleep(0.1)
+        await task
+        return policy, calls
+
+    policy, calls = asyncio.run(run())
+    assert policy.hedges == 0
+    assert len(calls) == 1
+    # Only the transfer is learned, not the wait
+    assert policy._samples[-1] < 0.05
@@ -0,0 +1,52 @@
+import asyncio
+import datetime
+
+from cima.goes.aio.gcs import manifest
+from cima.goes.aio.gcs.listing import BlobInfo
+from cima.goes.products import Band, Product, ProductBand
+
+PRODUCT_BAND = ProductBand(product=Product.CMIPF, band=Band.CLEAN_LONGWAVE_WINDOW)
+
+
+def _blob(day_of_year: int, hour: int) -> BlobInfo:
+    start = f'2018{day_of_year:03d}{hour:02d}00380'
+    return BlobInfo(name=f'ABI-L2-CMIPF/2018/{day_of_year:03d}/{hour:02d}/'
+                         f'OR_ABI-L2-CMIPF-M3C13_G16_s{start}_e{start}_c{start}.nc',
+                    size=100, generation=1)
+
+
+def _refresh(monkeypatch, tmp_path, *refreshes):
+    listed = []
+
+    async def list_prefixes(prefixes, session, proxy, pattern, max_concurrent, retry=None):
+        for prefix in prefixes:
+            listed.append(prefix)
+            day_of_year = int(prefix.split('/')[2])
+            hours = [int(prefix.split('/')[3])] if prefix.count('/') == 4 else [0, 12]
+            for hour in hours:
+                yield _blob(day_of_year, hour)
+
+    monkeypatch.setattr(manifest, 'list_prefixes', list_prefixes)
+    with manifest.Manifest(str(tmp_path / 'manifest.db')) as index:
+        for from_date, to_date in refreshes:
+            listed.clear()
+            asyncio.run(index.refresh(PRODUCT_BAND, from_date, to_date, session=object()))
+        return index.obs_starts(PRODUCT_BAND), listed
+
+
+def test_refresh_lists_again_from_the_last_hour(monkeypatch, tmp_path):
+    # 2018-08-01 is day 213
+    obs_starts, listed = _refresh(monkeypatch, tmp_path,
+                                  (datetime.date(2018, 8, 1), datetime.date(2018, 8, 2)),
+                                  (datetime.date(2018, 8, 1), datetime.date(2018, 8, 3)))
+    assert listed == [f'ABI-L2-CMIPF/2018/214/{hour:02d}/' for hour in range(12, 24)] + ['ABI-L2-CMIPF/2018/215/']
+    assert len(obs_starts) == len(set(obs_starts))
+
+
+def test_refresh_before_the_indexed_range_lists_it_all(monkeypatch, tmp_path):
+    obs_starts, listed = _refresh(monkeypatch, tmp_path,
+                                  (datetime.date(2018, 8, 3), datetime.date(2018, 8, 3)),
+                                  (datetime.date(2018, 8, 1), datetime.date(2018, 8, 3)))
+    assert listed == ['ABI-L2-CMIPF/2018/213/', 'ABI-L2-CMIPF/2018/214/', 'ABI-L2-CMIPF/2018/215/']
+    assert obs_starts[0] == datetime.datetime(2018, 8, 1, 0, 0, 38)
+    assert len(obs_starts) == 6
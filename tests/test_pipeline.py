@@ -0,0 +1,100 @@
+import asyncio
+
+import aiohttp
+import netCDF4
+import numpy as np
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from cima.goes.aio.gcs import ByteBudget, SourceSelector, download_datasets
+
+FILES = 6
+
+
+def _netcdf_bytes(value: int) -> bytes:
+    dataset = netCDF4.Dataset('in_memory_file', 'w', memory=1024)
+    dataset.createDimension('x', 100)
+    dataset.createVariable('CMI', 'f4', ('x',))[:] = np.full(100, value, dtype=np.float32)
+    return bytes(dataset.close())
+
+
+def _download(names, on_success, on_error, **kwargs):
+    blobs = {f'blob-{i}.nc': _netcdf_bytes(i) for i in range(FILES)}
+
+    async def handle(request: web.Request) -> web.Response:
+        body = blobs.get(request.match_info['name'])
+        if body is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=body)
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/{name}', handle)
+        async with TestServer(app) as test_server:
+            sources = SourceSelector({'local': str(test_server.make_url('/')) + '{name}'})
+            async with aiohttp.ClientSession() as session:
+                return await download_datasets(names, on_success, on_error, session=session, sources=sources,
+                                               **kwargs)
+    return asyncio.run(run())
+
+
+def test_names_are_consumed_as_files_finish():
+    values, errors, ahead = {}, [], []
+
+    async def names():
+        for i in range(FILES + 1):
+            # blob-6.nc is not on the server
+            ahead.append(i - len(values) - len(errors))
+            yield f'blob-{i}.nc'
+
+    async def on_success(name, dataset):
+        await asyncio.sleep(0.01)
+        values[name] = float(dataset.variables['CMI'][0])
+
+    async def on_error(name, e):
+        errors.append((name, e))
+
+    stats = _download(names(), on_success, on_error, max_in_flight=2, max_in_flight_bytes=2 * 1024)
+    assert values == {f'blob-{i}.nc': float(i) for i in range(FILES)}
+    assert [name for name, _ in errors] == [f'blob-{FILES}.nc']
+    assert isinstance(errors[0][1], aiohttp.ClientResponseError) and errors[0][1].status == 404
+    assert max(ahead) <= 2
+    assert (stats.files, stats.failed) == (FILES, 1)
+    assert stats.bytes == sum(len(_netcdf_bytes(i)) for i in range(FILES))
+
+
+def _first_value(name: str, dataset: netCDF4.Dataset) -> float:
+    return float(dataset.variables['CMI'][0])
+
+
+def test_process_results_are_handed_to_on_success():
+    results = {}
+
+    async def on_success(name, result):
+        results[name] = result
+
+    async def on_error(name, e):
+        raise e
+
+    _download([f'blob-{i}.nc' for i in range(FILES)], on_success, on_error, process=_first_value,
+              max_in_flight_bytes=1)
+    assert results == {f'blob-{i}.nc': float(i) for i in range(FILES)}
+
+
+def test_byte_budget_waits_for_released_bytes():
+    async def run():
+        budget = ByteBudget(100)
+        await budget.acquire(60)
+        waiting = asyncio.ensure_future(budget.acquire(60))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        await budget.release(60)
+        await asyncio.wait_for(waiting, 1)
+        assert budget.used == 60
+        await budget.release(60)
+        # Larger than the whole budget, let through when nothing else is held
+        await asyncio.wait_for(budget.acquire(500), 1)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(budget.acquire(1), 0.05)
+    asyncio.run(run())
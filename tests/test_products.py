@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from cima.goes.products import GoesFileName, parse_file_names
+
+NAMES = [
+    'ABI-L2-CMIPF/2018/213/15/OR_ABI-L2-CMIPF-M3C13_G16_s20182131500380_e20182131511147_c20182131511219.nc',
+    'ABI-L2-CMIPF/2019/101/00/OR_ABI-L2-CMIPF-M6C02_G16_s20191010000270_e20191010009578_c20191010010063.nc',
+    'OR_ABI-L2-CMIPF-M3C13_G16_s20182131515380_e20182131526147_c20182131526219.nc',
+    'ABI-L2-MCMIPF/2018/213/15/OR_ABI-L2-MCMIPF-M3_G16_s20182131500380_e20182131511147_c20182131511225.nc',
+    'ABI-L2-CMIPM/2018/213/15/OR_ABI-L2-CMIPM1-M3C13_G16_s20182131500280_e20182131500337_c20182131500405.nc',
+    'GLM-L2-LCFA/2018/213/15/OR_GLM-L2-LCFA_G16_s20182131500000_e20182131500200_c20182131500227.nc',
+    'ABI-L2-CMIPF/2018/213/15/OR_ABI-L2-CMIPF-M3C13_G16_s20182131530380_e20182131541147_c20182131541219.nc',
+]
+
+
+def _datetime64(value) -> np.datetime64:
+    return np.datetime64(value.replace(tzinfo=None), 'ms')
+
+
+def test_parse_file_names_matches_the_regex():
+    parsed = parse_file_names(NAMES)
+    assert len(parsed) == len(NAMES)
+    for i, name in enumerate(NAMES):
+        expected = GoesFileName.parse(name)
+        assert parsed.product[i] == expected.product
+        assert parsed.subproduct[i] == (expected.subproduct or 0)
+        assert parsed.mode[i] == (expected.mode or 0)
+        assert parsed.band[i] == (expected.band or 0)
+        assert parsed.start[i] == _datetime64(expected.start)
+        assert parsed.end[i] == _datetime64(expected.end)
+        assert parsed.created[i] == _datetime64(expected.created)
+
+
+def test_parse_file_names_of_nothing():
+    assert len(parse_file_names([])) == 0
+
+
+@pytest.mark.parametrize('name', [
+    'ABI-L2-CMIPF/2018/213/15/OR_ABI-L2-CMIPF-M3C13_G16_s2018213150038x_e20182131511147_c20182131511219.nc',
+    'ABI-L2-CMIPF/2018/213/15/OR_ABI-L2-CMIPF-M3C13_G16_s20182131500380-e20182131511147_c20182131511219.nc',
+    'ABI-L2-CMIPF/2018/213/15/not a goes name_s20182131500380_e20182131511147_c20182131511219.nc',
+    'short.nc',
+])
+def test_parse_file_names_rejects_other_names(name):
+    with pytest.raises(ValueError, match='Not a GOES file name'):
+        parse_file_names(NAMES[:2] + [name])
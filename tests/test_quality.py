@@ -0,0 +1,91 @@
+import netCDF4
+import numpy as np
+import pytest
+
+from cima.goes.datasets import QUALITY_LAYER_NAME, QUALITY_REJECTED_FLAG, QualityRules
+from cima.goes.datasets import fill_clipped_variable_from_source, pack_quality, unpack_quality, write_quality_layer
+
+CMI_FLAG_MEANINGS = 'good_pixel_qf conditionally_usable_pixel_qf out_of_range_pixel_qf no_value_pixel_qf ' \
+                    'focal_plane_temperature_threshold_exceeded_qf'
+
+
+def test_pack_quality_round_trip():
+    flags = np.array([[0, 1, 2, 3, 4, 0, 1],
+                      [4, 4, 0, 2, 1, 3, 255]], dtype=np.uint8)
+    unpacked = unpack_quality(pack_quality(flags), flags.shape[1])
+    assert np.array_equal(unpacked, np.minimum(flags, QUALITY_REJECTED_FLAG))
+    # Flag 4 is rejected, not good
+    assert unpacked[0, 4] == QUALITY_REJECTED_FLAG
+
+
+def test_quality_layer_lists_its_own_flags():
+    source = netCDF4.Dataset('source.nc', 'w', diskless=True)
+    clipped = netCDF4.Dataset('clipped.nc', 'w', diskless=True)
+    try:
+        source.createDimension('y', 2)
+        source.createDimension('x', 5)
+        dqf = source.createVariable('DQF', 'i1', ('y', 'x'))
+        dqf.flag_values = np.arange(5, dtype=np.int8)
+        dqf.flag_meanings = CMI_FLAG_MEANINGS
+        clipped.createDimension('cropped_y', 2)
+        flags = np.array([[0, 1, 2, 3, 4], [4, 3, 2, 1, 0]], dtype=np.uint8)
+        write_quality_layer(clipped, source, flags, QualityRules(quality_layer=True))
+        layer = clipped.variables[QUALITY_LAYER_NAME]
+        assert layer.flag_values.tolist() == [0, 1, 2, 3]
+        assert layer.flag_meanings.split() == ['good_pixel_qf', 'conditionally_usable_pixel_qf',
+                                               'out_of_range_pixel_qf', 'rejected_pixel_qf']
+        assert 'focal_plane_temperature_threshold_exceeded_qf' in layer.comments
+        assert np.array_equal(unpack_quality(layer[:], 5), np.minimum(flags, QUALITY_REJECTED_FLAG))
+    finally:
+        clipped.close()
+        source.close()
+
+
+def _source_dataset() -> netCDF4.Dataset:
+    source = netCDF4.Dataset('source.nc', 'w', diskless=True)
+    source.time_coverage_start = '2018-08-01T15:00:00.0Z'
+    source.time_coverage_end = '2018-08-01T15:10:00.0Z'
+    source.createDimension('y', 4)
+    source.createDimension('x', 6)
+    source.createVariable('goes_imager_projection', 'i4')
+    cmi = source.createVariable('CMI', 'f4', ('y', 'x'))
+    cmi[:, :] = np.arange(24, dtype=np.float32).reshape(4, 6)
+    dqf = source.createVariable('DQF', 'i1', ('y', 'x'))
+    dqf[:, :] = np.arange(24).reshape(4, 6) % 5
+    return source
+
+
+def _clipped_dataset() -> netCDF4.Dataset:
+    clipped = netCDF4.Dataset('clipped.nc', 'w', diskless=True)
+    clipped.row_min, clipped.row_max, clipped.col_min, clipped.col_max = 1, 3, 2, 5
+    clipped.createDimension('cropped_y', 2)
+    clipped.createDimension('cropped_x', 3)
+    return clipped
+
+
+def test_quality_masks_the_data_given():
+    source, clipped = _source_dataset(), _clipped_dataset()
+    try:
+        data = source.variables['CMI'][1:3, 2:5]
+        rules = QualityRules(accepted_flags=(0, 1), quality_layer=True)
+        fill_clipped_variable_from_source(clipped, source, 'test', data=data, quality=rules)
+        dqf = source.variables['DQF'][1:3, 2:5]
+        cmi = clipped.variables['CMI'][:]
+        assert np.array_equal(np.ma.getmaskarray(cmi), dqf > 1)
+        assert np.array_equal(unpack_quality(clipped.variables[QUALITY_LAYER_NAME][:], 3),
+                              np.minimum(dqf, QUALITY_REJECTED_FLAG))
+    finally:
+        clipped.close()
+        source.close()
+
+
+def test_quality_of_aggregated_clipping_is_not_ignored():
+    source, clipped = _source_dataset(), _clipped_dataset()
+    try:
+        clipped.aggregation_factor = 2
+        with pytest.raises(ValueError):
+            fill_clipped_variable_from_source(clipped, source, 'test', data=np.zeros((2, 3)),
+                                              quality=QualityRules())
+    finally:
+        clipped.close()
+        source.close()
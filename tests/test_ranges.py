@@ -0,0 +1,103 @@
+import asyncio
+
+import netCDF4
+import numpy as np
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from cima.goes.aio.gcs import AdaptiveLimiter, RangedRead, close_sessions, download_datasets, get_variable_window
+from cima.goes.aio.gcs import gcs
+from cima.goes.aio.gcs.ranges import ChunkLayout, H5Z_FILTER_FLETCHER32, decode_chunk, fletcher32
+from cima.goes.datasets import RegionIndexes
+
+
+def _write_file(filename: str, fletcher: bool):
+    dataset = netCDF4.Dataset(filename, 'w', format='NETCDF4')
+    dataset.createDimension('y', 100)
+    dataset.createDimension('x', 120)
+    variable = dataset.createVariable('CMI', 'i2', ('y', 'x'), zlib=True, shuffle=True, fletcher32=fletcher,
+                                      chunksizes=(16, 32), fill_value=-1)
+    variable.scale_factor = 0.5
+    variable.add_offset = 100.0
+    variable[:] = np.arange(100 * 120).reshape(100, 120) * 0.5 % 1000 + 100
+    dataset.close()
+
+
+async def _serve(directory: str) -> TestServer:
+    async def handler(request):
+        return web.FileResponse(f'{directory}/{request.match_info["name"]}')
+    app = web.Application()
+    app.router.add_route('*', '/{name}', handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+@pytest.mark.parametrize('fletcher', [False, True])
+def test_window_matches_netcdf(tmp_path, fletcher):
+    filename = str(tmp_path / 'full.nc')
+    _write_file(filename, fletcher)
+    indexes = RegionIndexes(row_min=10, row_max=70, col_min=5, col_max=90)
+
+    async def run():
+        server = await _serve(str(tmp_path))
+        try:
+            return await get_variable_window(str(server.make_url('/full.nc')), indexes)
+        finally:
+            await server.close()
+
+    window = asyncio.run(_run_with_session(run))
+    with netCDF4.Dataset(filename) as dataset:
+        expected = dataset.variables['CMI'][10:70, 5:90]
+    np.testing.assert_array_equal(window.data, expected)
+
+
+def test_fletcher32_matches_hdf5():
+    # Known values of H5_checksum_fletcher32
+    assert fletcher32(b'') == 0
+    assert fletcher32(b'\x00\x01') == (1 << 16) | 1
+    assert fletcher32(b'\x01') == (256 << 16) | 256
+
+
+def test_corrupted_chunk_is_rejected():
+    layout = ChunkLayout(dtype=np.dtype('<i2'), shape=(2, 2), chunks=(2, 2), filters=[H5Z_FILTER_FLETCHER32],
+                         fill_value=0, attributes={})
+    data = np.arange(4, dtype='<i2').tobytes()
+    stored = data + fletcher32(data).to_bytes(4, 'little')
+    np.testing.assert_array_equal(decode_chunk(stored, layout, 0), [[0, 1], [2, 3]])
+    with pytest.raises(IOError):
+        decode_chunk(b'\x09' + stored[1:], layout, 0)
+
+
+def test_download_datasets_ranged(tmp_path, monkeypatch):
+    _write_file(str(tmp_path / 'full.nc'), fletcher=True)
+    indexes = RegionIndexes(row_min=0, row_max=20, col_min=0, col_max=40)
+    windows = {}
+
+    async def run():
+        server = await _serve(str(tmp_path))
+        try:
+            async def on_success(name, window):
+                windows[name] = window
+
+            async def on_error(name, e):
+                raise e
+
+            monkeypatch.setattr(gcs, 'get_public_url', lambda name: str(server.make_url(f'/{name}')))
+            return await download_datasets(['full.nc'], on_success, on_error, ranged=RangedRead(indexes),
+                                           limiter=AdaptiveLimiter(initial_limit=2))
+        finally:
+            await server.close()
+
+    stats = asyncio.run(_run_with_session(run))
+    assert stats.files == 1 and stats.failed == 0
+    with netCDF4.Dataset(str(tmp_path / 'full.nc')) as dataset:
+        np.testing.assert_array_equal(windows['full.nc'].data, dataset.variables['CMI'][0:20, 0:40])
+
+
+async def _run_with_session(coroutine_function):
+    try:
+        return await coroutine_function()
+    finally:
+        await close_sessions()
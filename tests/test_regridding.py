@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+
+from cima.goes.datasets import BILINEAR, CELL_MEAN, NEAREST, LatLonGrid, RegionIndexes, get_regridder
+from cima.goes.datasets import regridding_weights, set_clipping_info_directory
+from cima.goes.datasets.fixed_grid import full_disk_grid
+
+# A 2 km window over the center of Argentina, and a 0.1 degree grid inside it
+GRID = full_disk_grid(-75.0, '2km').window(RegionIndexes(col_min=3110, col_max=3170, row_min=4260, row_max=4310))
+TARGET = LatLonGrid(lat_south=-31.0, lon_west=-66.0, resolution=0.1, lat_count=5, lon_count=6)
+
+
+def _target_rows_cols():
+    lats, lons = np.meshgrid(TARGET.lats, TARGET.lons, indexing='ij')
+    rows, cols, _ = GRID.rows_cols(lats, lons)
+    return rows, cols
+
+
+def test_target_is_inside_the_window():
+    rows, cols = _target_rows_cols()
+    assert rows.min() > 1 and rows.max() < GRID.rows - 2
+    assert cols.min() > 1 and cols.max() < GRID.columns - 2
+
+
+def test_bilinear_is_exact_for_a_linear_field():
+    rows, cols = _target_rows_cols()
+    field = 3.0 * np.arange(GRID.rows)[:, np.newaxis] - 2.0 * np.arange(GRID.columns)[np.newaxis, :]
+    regridded = get_regridder(GRID, TARGET, BILINEAR).regrid(field)
+    assert np.allclose(regridded, 3.0 * rows - 2.0 * cols)
+
+
+def test_nearest_takes_the_closest_pixel():
+    rows, cols = _target_rows_cols()
+    weights = regridding_weights(GRID, TARGET, NEAREST)
+    assert np.array_equal(weights.indices, (np.rint(rows) * GRID.columns + np.rint(cols)).astype(int).ravel())
+    assert np.all(weights.data == 1)
+
+
+def test_cell_mean_averages_the_pixel_centers_in_each_cell():
+    weights = regridding_weights(GRID, TARGET, CELL_MEAN).toarray()
+    lats, lons = GRID.lats_lons(GRID.x(np.arange(GRID.columns))[np.newaxis, :],
+                                GRID.y(np.arange(GRID.rows))[:, np.newaxis])
+    lat_index = np.floor((lats - TARGET.lat_south) / TARGET.resolution).ravel()
+    lon_index = np.floor((lons - TARGET.lon_west) / TARGET.resolution).ravel()
+    for cell in [0, 7, TARGET.lat_count * TARGET.lon_count - 1]:
+        inside = (lat_index == cell // TARGET.lon_count) & (lon_index == cell % TARGET.lon_count)
+        assert inside.sum() > 1
+        assert np.allclose(weights[cell], inside / inside.sum())
+
+
+def test_a_stack_is_regridded_as_its_frames():
+    rng = np.random.default_rng(0)
+    shape = (3, GRID.rows, GRID.columns)
+    frames = np.ma.masked_array(rng.random(shape), mask=rng.random(shape) < 0.2)
+    frames[1] = np.nan
+    regridder = get_regridder(GRID, TARGET, BILINEAR)
+    stacked = regridder.regrid(frames)
+    assert stacked.shape == (3,) + TARGET.shape
+    for i in range(3):
+        frame = regridder.regrid(frames[i])
+        assert np.array_equal(np.ma.getmaskarray(stacked[i]), np.ma.getmaskarray(frame))
+        assert np.allclose(stacked[i].compressed(), frame.compressed())
+    assert np.ma.getmaskarray(stacked[1]).all()
+    assert not np.ma.getmaskarray(stacked[0]).all()
+
+
+def test_weights_are_kept_in_the_clipping_info_directory(tmp_path):
+    set_clipping_info_directory(str(tmp_path))
+    try:
+        target = LatLonGrid(lat_south=-31.0, lon_west=-66.0, resolution=0.2, lat_count=2, lon_count=2)
+        get_regridder(GRID, target, NEAREST)
+    finally:
+        set_clipping_info_directory(None)
+    filenames = os.listdir(tmp_path)
+    assert len(filenames) == 1 and filenames[0].startswith('regrid-nearest-') and filenames[0].endswith('.npz')
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from cima.goes.aio.gcs import AdaptiveLimiter, RetryPolicy, SourceSelector, close_sessions, get_session
+from cima.goes.aio.gcs.gcs import download_from_sources
+
+CONTENT = b'netcdf bytes' * 1000
+
+
+async def _mirror(status: int) -> TestServer:
+    # A local stand-in for a public bucket mirror, answering every object with status
+    async def handler(request):
+        if status != 200:
+            return web.Response(status=status)
+        return web.Response(body=CONTENT)
+    app = web.Application()
+    app.router.add_get('/{name:.*}', handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+async def _download(statuses: dict, names=('ABI-L2-CMIPF/2018/213/15/file.nc',)):
+    servers = {key: await _mirror(status) for key, status in statuses.items()}
+    try:
+        sources = SourceSelector({key: str(server.make_url('/')) + '{name}' for key, server in servers.items()},
+                                 retry=RetryPolicy(max_attempts=1))
+        limiter = AdaptiveLimiter(initial_limit=4)
+        results = [await download_from_sources(name, sources, get_session(), limiter) for name in names]
+        return results, sources, limiter
+    finally:
+        for server in servers.values():
+            await server.close()
+        await close_sessions()
+
+
+def test_fails_over_to_a_healthy_mirror():
+    results, sources, limiter = asyncio.run(_download({'broken': 503, 'healthy': 200}, names=['a.nc', 'b.nc']))
+    assert results == [CONTENT, CONTENT]
+    broken, healthy = sources.mirrors
+    # A mirror not measured yet keeps going first until its error rate marks it unhealthy
+    assert broken.failures == 2 and broken.throughput is None
+    assert healthy.transfers == 2 and healthy.throughput > 0
+    # One permit per attempt: the failed ones and the two downloads
+    assert limiter.completed == 4 and limiter.in_flight == 0
+
+
+def test_missing_objects_do_not_count_as_failures():
+    results, sources, _ = asyncio.run(_download({'partial': 404, 'healthy': 200}))
+    assert results == [CONTENT]
+    assert sources.mirrors[0].failures == 0
+
+
+def test_all_mirrors_failing_raises_the_last_error():
+    with pytest.raises(Exception) as info:
+        asyncio.run(_download({'first': 503, 'second': 503}))
+    assert getattr(info.value, 'status', None) == 503
+
+
+def test_no_mirrors():
+    with pytest.raises(ValueError):
+        asyncio.run(_download({}))
@@ -0,0 +1,85 @@
+import dataclasses
+
+import numpy as np
+import pytest
+
+from cima.goes.datasets import FrameVariable, LatLonRegion, TimeSeriesFrame, TimeSeriesWriter
+from cima.goes.datasets import get_clipping_info_from_grid, get_shard_filenames, read_time_series
+from cima.goes.datasets.fixed_grid import full_disk_grid
+
+CLIPPING_INFO = dataclasses.replace(
+    get_clipping_info_from_grid(full_disk_grid(-75.0, '2km'),
+                                LatLonRegion(lat_north=-30.0, lat_south=-30.5, lon_west=-64.5, lon_east=-64.0),
+                                '2km at nadir', 'GOES-East'),
+    lats=None, lons=None)
+SHAPE = (CLIPPING_INFO.indexes.row_max - CLIPPING_INFO.indexes.row_min,
+         CLIPPING_INFO.indexes.col_max - CLIPPING_INFO.indexes.col_min)
+TIMES = ['2018-08-01T23:30', '2018-08-01T22:00', '2018-08-02T00:15', '2018-08-01T23:00']
+
+
+def _frame(time: str, clipping_info=CLIPPING_INFO) -> TimeSeriesFrame:
+    time = np.datetime64(time, 'ms')
+    value = (time - np.datetime64('2018-08-01', 'ms')) / np.timedelta64(1, 'm')
+    data = np.ma.masked_array(np.full(SHAPE, value, dtype=np.float32), mask=np.zeros(SHAPE, dtype=bool))
+    data[0, 0] = np.ma.masked
+    return TimeSeriesFrame(
+        name='CMIPF-C13',
+        time=time,
+        clipping_info=clipping_info,
+        variables={'CMI': FrameVariable(data=data, datatype='<f4', fill_value=np.float32(-1.0),
+                                        attributes={'units': 'K'})},
+        attributes={'orbital_slot': 'GOES-East'})
+
+
+def _expected(times):
+    return np.array(sorted(np.datetime64(time, 'ms') for time in times))
+
+
+def test_frames_are_read_in_time_order(tmp_path):
+    with TimeSeriesWriter(str(tmp_path)) as writer:
+        assert all(writer.append(_frame(time)) for time in TIMES)
+        # A retried task
+        assert not writer.append(_frame(TIMES[1]))
+    assert len(get_shard_filenames(str(tmp_path), 'CMIPF-C13')) == 2
+    times, data = read_time_series(str(tmp_path), 'CMIPF-C13')
+    assert np.array_equal(times, _expected(TIMES))
+    assert data.shape == (len(TIMES),) + SHAPE
+    minutes = (times - np.datetime64('2018-08-01', 'ms')) / np.timedelta64(1, 'm')
+    assert np.array_equal(data[:, 1, 1], minutes)
+    assert np.ma.getmaskarray(data)[:, 0, 0].all()
+    assert np.ma.getmaskarray(data).sum() == len(TIMES)
+
+
+def test_a_time_range_reads_only_its_frames(tmp_path):
+    with TimeSeriesWriter(str(tmp_path)) as writer:
+        for time in TIMES:
+            writer.append(_frame(time))
+    start, end = np.datetime64('2018-08-01T22:30', 'ms'), np.datetime64('2018-08-02T00:00', 'ms')
+    times, data = read_time_series(str(tmp_path), 'CMIPF-C13', start=start, end=end)
+    assert np.array_equal(times, _expected(['2018-08-01T23:00', '2018-08-01T23:30']))
+    assert data.shape == (2,) + SHAPE
+
+
+def test_an_existing_shard_is_appended_to(tmp_path):
+    with TimeSeriesWriter(str(tmp_path)) as writer:
+        writer.append(_frame(TIMES[0]))
+    with TimeSeriesWriter(str(tmp_path)) as writer:
+        assert not writer.append(_frame(TIMES[0]))
+        assert writer.append(_frame(TIMES[1]))
+    times, _ = read_time_series(str(tmp_path), 'CMIPF-C13')
+    assert np.array_equal(times, _expected(TIMES[:2]))
+
+
+def test_another_window_is_not_appended(tmp_path):
+    indexes = dataclasses.replace(CLIPPING_INFO.indexes, row_min=CLIPPING_INFO.indexes.row_min + 1,
+                                  row_max=CLIPPING_INFO.indexes.row_max + 1)
+    moved = dataclasses.replace(CLIPPING_INFO, indexes=indexes)
+    with TimeSeriesWriter(str(tmp_path)) as writer:
+        writer.append(_frame(TIMES[0]))
+        with pytest.raises(ValueError):
+            writer.append(_frame(TIMES[1], moved))
+    with TimeSeriesWriter(str(tmp_path)) as writer:
+        with pytest.raises(ValueError):
+            writer.append(_frame(TIMES[1], moved))
+    times, _ = read_time_series(str(tmp_path), 'CMIPF-C13')
+    assert np.array_equal(times, _expected(TIMES[:1]))